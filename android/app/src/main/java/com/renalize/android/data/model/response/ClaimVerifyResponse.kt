@@ -5,5 +5,6 @@ import androidx.annotation.Keep
 
 @Keep
 data class ClaimVerifyResponse(
-    val status: Boolean
+    val status: Boolean,
+    val reason: String? = null
 )
\ No newline at end of file
@@ -86,20 +86,20 @@ class PatientRepository(
             if(uri.size == 1){
                 val ref = billsRef.child("${uri.first().lastPathSegment}_${System.currentTimeMillis()}").putFile(uri.first()).await()
                 val url = "gs://$bucketName${ref.storage.path}"
-                if(apiService.verifyClaim(VerifyClaimRequest(documentType = "image", fileUri = url)).status) emit(NetworkResult.Success(Unit))
-                else emit(NetworkResult.Error("Failed to verify claim"))
+                val response = apiService.verifyClaim(VerifyClaimRequest(documentType = "image", fileUri = url))
+                if(response.status) emit(NetworkResult.Success(Unit))
+                else emit(NetworkResult.Error(response.reason ?: "Failed to verify claim"))
             }else{
                 val urls = uri.map { uploadUri(it) }.awaitAll().map{ "gs://$bucketName${it.storage.path}" }
-                if(
-                    apiService.verifyClaimBatch(
-                        VerifyClaimBatchRequest(
-                            urls.map{ VerifyClaimRequest(documentType = "image", fileUri = it) }
-                        )
-                    ).status
-                ){
+                val response = apiService.verifyClaimBatch(
+                    VerifyClaimBatchRequest(
+                        urls.map{ VerifyClaimRequest(documentType = "image", fileUri = it) }
+                    )
+                )
+                if(response.status){
                     emit(NetworkResult.Success(Unit))
                 }else{
-                    emit(NetworkResult.Error("Failed to verify claim"))
+                    emit(NetworkResult.Error(response.reason ?: "Failed to verify claim"))
                 }
             }
         }catch (e: Exception){
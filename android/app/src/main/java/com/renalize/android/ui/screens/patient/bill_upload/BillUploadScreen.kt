@@ -64,7 +64,7 @@ fun BillUploadScreen(
             }
         )
 
-        when(state){
+        when(val currState = state){
             is BillUploadUiState.Uploading ->{
                 UploadingScreen()
             }
@@ -79,9 +79,9 @@ fun BillUploadScreen(
                 )
             }
             else ->{
-                if(state is BillUploadUiState.Error){
-                    LaunchedEffect (Unit){
-                        Toast.makeText(ctx, "Error", Toast.LENGTH_SHORT).show()
+                if(currState is BillUploadUiState.Error){
+                    LaunchedEffect (currState){
+                        Toast.makeText(ctx, currState.message, Toast.LENGTH_LONG).show()
                     }
                 }
                 Column(
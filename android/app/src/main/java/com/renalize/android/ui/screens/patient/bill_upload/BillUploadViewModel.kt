@@ -28,7 +28,7 @@ class BillUploadViewModel @Inject constructor(
                         _uiState.value = BillUploadUiState.Success
                     }
                     is NetworkResult.Error -> {
-                        _uiState.value = BillUploadUiState.Error
+                        _uiState.value = BillUploadUiState.Error(it.message ?: "Error")
                     }
                     is NetworkResult.Loading -> {
                         _uiState.value = BillUploadUiState.Uploading
@@ -49,6 +49,6 @@ sealed interface BillUploadUiState{
     data object Idle: BillUploadUiState
     data object Uploading: BillUploadUiState
     data object Success: BillUploadUiState
-    data object Error: BillUploadUiState
+    data class Error(val message: String): BillUploadUiState
 
 }
\ No newline at end of file
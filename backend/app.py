@@ -1,27 +1,26 @@
 from fastapi import FastAPI
 from firebase_admin import credentials, initialize_app
 from config.settings import settings
-from routers import claim, kyc, patient, bills, hospital
+from routers import claim, kyc, patient, bills, hospital, ops, metrics
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
-from config.settings import initialize_pools, initialize_model, thread_pool, process_pool
+from services.runtime import initialize_services, shutdown_services
+from auth.verify import start_key_refresh, stop_key_refresh
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
 
-    # Startup: Initialize Firebase and pass executors to the router
+    # Startup: Initialize Firebase and the shared document services
     cred = credentials.Certificate(settings.FIREBASE_CREDENTIALS_PATH)
     initialize_app(cred)
-    initialize_pools()
-    initialize_model()
+    start_key_refresh()
+    await initialize_services()
     
     yield
     
-    # Shutdown: Clean up the executors
-    if thread_pool is not None:
-        thread_pool.shutdown(wait=True)
-    if process_pool is not None:
-        process_pool.shutdown(wait=True)
+    # Shutdown: Clean up the pipeline executors
+    await shutdown_services()
+    await stop_key_refresh()
 
 app = FastAPI(
     title="Cronic API",
@@ -36,6 +35,8 @@ app.include_router(kyc.router, prefix="/kyc", tags=["kyc"])
 app.include_router(patient.router, prefix="/patient", tags=["patient"])
 app.include_router(bills.router, prefix="/bills", tags=["bills"])
 app.include_router(hospital.router, prefix="/hospital", tags=["hospital"])
+app.include_router(ops.router, prefix="/ops", tags=["ops"])
+app.include_router(metrics.router, tags=["metrics"])
 
 app.add_middleware(
     CORSMiddleware,
@@ -1,18 +1,136 @@
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from firebase_admin import auth
 from config.logger import logger
+from config.settings import settings
 
 security = HTTPBearer()
 
 
+class TokenCache:
+    """
+    LRU cache of decoded Firebase ID tokens, keyed by the SHA-256 of the token.
+    Entries are dropped once the token's own `exp` claim has passed.
+    """
 
-async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):    
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, decoded_token = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return decoded_token
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def set(self, key: str, decoded_token: Dict):
+        expires_at = decoded_token.get("exp")
+        if not expires_at:
+            return
+        self._entries[key] = (float(expires_at), decoded_token)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+token_cache = TokenCache(settings.AUTH_TOKEN_CACHE_MAX_ENTRIES)
+_pending_verifications: Dict[str, asyncio.Future] = {}
+_key_refresh_task: Optional[asyncio.Task] = None
+
+
+def refresh_signing_keys():
+    """
+    Fetch the public keys used to sign ID tokens through firebase_admin's own
+    cache-control aware transport, so verify_id_token finds them fresh in its cache.
+
+    That transport is private to firebase_admin, which is why requirements.txt pins its
+    version; check this still works before upgrading it.
+
+    Raises:
+        AttributeError: If firebase_admin no longer exposes the transport this way.
+    """
+    token_verifier = auth._get_client(None)._token_verifier
+    token_verifier.request(token_verifier.id_token_verifier.cert_url, 'GET')
+
+
+async def _refresh_signing_keys_loop():
+    while True:
+        try:
+            await asyncio.to_thread(refresh_signing_keys)
+        except AttributeError as e:
+            # Tokens are still verified, fetching the keys on demand
+            logger.error(f"Token signing keys can not be refreshed with this firebase_admin version, stopping: {str(e)}")
+            return
+        except Exception as e:
+            logger.warning(f"Failed to refresh token signing keys: {str(e)}")
+        await asyncio.sleep(settings.AUTH_KEYS_REFRESH_SECONDS)
+
+
+def start_key_refresh():
+    """Pre-fetch the token signing keys and keep them fresh in the background."""
+    global _key_refresh_task
+    if _key_refresh_task is None:
+        _key_refresh_task = asyncio.get_running_loop().create_task(_refresh_signing_keys_loop())
+
+
+async def stop_key_refresh():
+    global _key_refresh_task
+    if _key_refresh_task is not None:
+        _key_refresh_task.cancel()
+        await asyncio.gather(_key_refresh_task, return_exceptions=True)
+        _key_refresh_task = None
+
+
+async def _verify_id_token(token: str, key: str) -> Dict:
+    # Concurrent requests carrying the same token share one verification
+    verification = _pending_verifications.get(key)
+    if verification is None:
+        verification = asyncio.ensure_future(asyncio.to_thread(auth.verify_id_token, token))
+        _pending_verifications[key] = verification
+        verification.add_done_callback(lambda _: _pending_verifications.pop(key, None))
+    return await asyncio.shield(verification)
+
+
+async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
+    key = hashlib.sha256(token.encode()).hexdigest()
+
+    decoded_token = token_cache.get(key)
+    if decoded_token is not None:
+        return decoded_token
+
     try:
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = await _verify_id_token(token, key)
+        token_cache.set(key, decoded_token)
         logger.info(f"Token verified successfully for user: {decoded_token.get('uid')}")
         return decoded_token
     except Exception as e:
         logger.error(f"Token verification failed: {str(e)}")
-        raise HTTPException(status_code=401, detail=f"Invalid authentication credentials: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=401, detail=f"Invalid authentication credentials: {e}")
+
+
+async def verify_ops_token(token: Dict = Depends(verify_token)) -> Dict:
+    """
+    Let through only users carrying the `ops` custom claim, for the operational endpoints
+    that expose pool, cache and upload internals. Set it with auth.set_custom_user_claims(uid, {'ops': True}).
+    """
+    if not token.get("ops"):
+        logger.warning(f"User {token.get('uid')} without the ops claim tried to read operational stats")
+        raise HTTPException(status_code=403, detail="Not allowed to read operational stats")
+    return token
@@ -1,9 +1,7 @@
 import os
-import asyncio
 import google.generativeai as genai
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
-from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 load_dotenv()
 
@@ -15,9 +13,127 @@ class Settings(BaseSettings):
     FIREBASE_STORAGE_BUCKET: str = os.getenv("FIREBASE_STORAGE_BUCKET")
     PROCESSING_TIMEOUT: int = int(os.getenv("PROCESSING_TIMEOUT"))
 
-    # Executor configurations
-    THREAD_POOL_MAX_WORKERS: int = min(32, 5 * os.cpu_count())
-    PROCESS_POOL_MAX_WORKERS: int = 4
+    # Deadline of every Firestore call made through the repositories
+    FIRESTORE_TIMEOUT: float = 10.0
+
+    # Patient profiles read by claim verification and GET /patient
+    PATIENT_CACHE_MAX_ENTRIES: int = 10_000
+    PATIENT_CACHE_TTL_SECONDS: int = 300
+
+    # Hospital directory snapshot, refreshed in the background and cached by clients
+    HOSPITAL_DIRECTORY_REFRESH_SECONDS: int = 900
+    HOSPITAL_CACHE_MAX_AGE_SECONDS: int = 3600
+
+    # Concurrent verifications of the same document by the same user share one run; "local" coalesces
+    # them within an instance, "firestore" also across instances through a lock in claim_locks
+    CLAIM_LOCK_BACKEND: str = "local"
+    CLAIM_LOCK_POLL_SECONDS: float = 1.0
+
+    # Background claim jobs: "firestore" shares the queue between instances, "sqlite" keeps it in a local file
+    # (only for development and tests: jobs are lost with the instance and invisible to the others)
+    CLAIM_JOB_BACKEND: str = "firestore"
+    CLAIM_JOB_DB_PATH: str = "output/claim_jobs.sqlite3"
+    CLAIM_JOB_WORKERS: int = 4
+    CLAIM_JOB_POLL_SECONDS: float = 1.0
+    CLAIM_JOB_MAX_ATTEMPTS: int = 3
+    CLAIM_JOB_RETRY_BASE_DELAY_SECONDS: float = 10.0
+    CLAIM_JOB_RETRY_MAX_DELAY_SECONDS: float = 300.0
+
+    # Decoded ID tokens are cached until their exp; signing keys are refreshed in the background
+    AUTH_TOKEN_CACHE_MAX_ENTRIES: int = 10_000
+    AUTH_KEYS_REFRESH_SECONDS: int = 300
+
+    # Await Gemini with the native asyncio client instead of blocking a GENERATE pool worker
+    GEMINI_ASYNC: bool = True
+
+    # Adaptive limit of concurrent Gemini calls (AIMD: grows while calls succeed within the
+    # latency target, shrinks by the backoff ratio on overload errors or a slow p95)
+    GEMINI_CONCURRENCY_INITIAL: int = 10
+    GEMINI_CONCURRENCY_MIN: int = 1
+    GEMINI_CONCURRENCY_MAX: int = 64
+    GEMINI_LATENCY_TARGET_SECONDS: float = 15.0
+    GEMINI_CONCURRENCY_BACKOFF: float = 0.5
+    GEMINI_CONCURRENCY_COOLDOWN_SECONDS: float = 5.0
+
+    # Retries of transient Gemini and Storage errors with jittered exponential backoff,
+    # and circuit breaking after CIRCUIT_FAILURE_THRESHOLD consecutive failures
+    RETRY_MAX_ATTEMPTS: int = 4
+    RETRY_BASE_DELAY_SECONDS: float = 0.5
+    RETRY_MAX_DELAY_SECONDS: float = 8.0
+    CIRCUIT_FAILURE_THRESHOLD: int = 5
+    CIRCUIT_RESET_SECONDS: float = 30.0
+
+    # Start a second Gemini call when the first is slower than this percentile of recent calls
+    GEMINI_HEDGE_ENABLED: bool = False
+    GEMINI_HEDGE_PERCENTILE: float = 0.95
+
+    # Multi-page claim documents within this budget are sent to Gemini in one request, which
+    # returns one function call for the whole bill; larger ones are processed page by page
+    WHOLE_DOCUMENT_EXTRACTION: bool = True
+    WHOLE_DOCUMENT_MAX_PAGES: int = 10
+    WHOLE_DOCUMENT_MAX_TOKENS: int = 20_000
+
+    # Maximum number of pages of one document processed concurrently
+    PAGE_FANOUT: int = 4
+
+    # Photos up to this size are downloaded into memory, larger ones to a temporary file
+    IN_MEMORY_MAX_BYTES: int = 16 * 1024 * 1024
+
+    # Pages up to this size are sent inline to Gemini, larger ones through the File API
+    GEMINI_INLINE_MAX_BYTES: int = 4 * 1024 * 1024
+
+    # Lifecycle of files uploaded to the Gemini File API
+    GEMINI_FILE_RETENTION_SECONDS: int = 3600
+    GEMINI_FILE_EXPIRY_MARGIN_SECONDS: int = 600
+    GEMINI_FILE_CLEANUP_INTERVAL_SECONDS: int = 60
+    GEMINI_FILE_DELETE_BATCH_SIZE: int = 20
+
+    # Content-addressed cache of Gemini extractions (memory LRU + optional sqlite store)
+    EXTRACTION_CACHE_ENABLED: bool = True
+    EXTRACTION_CACHE_MAX_ENTRIES: int = 1024
+    EXTRACTION_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    EXTRACTION_CACHE_DB_PATH: str = "output/extraction_cache.sqlite3"
+    EXTRACTION_CACHE_MAX_STORED_ENTRIES: int = 100_000
+
+    # PDF rasterization limits
+    PDF_DPI: int = 200
+    PDF_MAX_PAGES: int = 50
+    PDF_MAX_PAGE_PIXELS: int = 8_000_000
+    PDF_MAX_DOCUMENT_PIXELS: int = 200_000_000
+
+    # Local pre-screen of photos before any Gemini call: blank, dark, blurry, tiny or text-less photos are rejected
+    PRESCREEN_ENABLED: bool = True
+    PRESCREEN_MIN_SHORT_EDGE: int = 400
+    PRESCREEN_MAX_ASPECT_RATIO: float = 4.0
+    PRESCREEN_MIN_BRIGHTNESS: float = 40.0
+    PRESCREEN_MAX_BRIGHTNESS: float = 250.0
+    PRESCREEN_MIN_CONTRAST: float = 10.0
+    PRESCREEN_MIN_SHARPNESS: float = 60.0
+    PRESCREEN_MIN_TEXT_DENSITY: float = 0.01
+
+    # Duplicate bills: earlier bills of the patient with pages within DUPLICATE_MAX_DISTANCE bits of the dHash are
+    # candidates, and a candidate with the same date and amount as the extracted bill is a duplicate
+    DUPLICATE_DETECTION_ENABLED: bool = True
+    DUPLICATE_MAX_DISTANCE: int = 6
+    DUPLICATE_INDEX_MAX_PATIENTS: int = 10_000
+
+    # Page preprocessing before upload (orientation fix, downscale, grayscale, re-encode)
+    PREPROCESS_ENABLED: bool = True
+    PREPROCESS_MAX_LONG_EDGE: int = 2048
+    PREPROCESS_GRAYSCALE: bool = True
+    PREPROCESS_FORMAT: str = "JPEG"
+    PREPROCESS_PHOTO_QUALITY: int = 80
+    PREPROCESS_PDF_QUALITY: int = 90
+
+    # Pipeline stage pool sizes (I/O stages run on threads, rasterization and preprocessing on processes)
+    DOWNLOAD_POOL_MAX_WORKERS: int = 8
+    RASTERIZE_POOL_MAX_WORKERS: int = min(4, os.cpu_count())
+    PREPROCESS_POOL_MAX_WORKERS: int = min(4, os.cpu_count())
+    CACHE_POOL_MAX_WORKERS: int = 4
+    UPLOAD_POOL_MAX_WORKERS: int = 16
+    GENERATE_POOL_MAX_WORKERS: int = 16
+    VERIFY_POOL_MAX_WORKERS: int = 8
+    WRITE_POOL_MAX_WORKERS: int = 8
 
     class Config:
         env_file = ".env"
@@ -25,16 +141,6 @@ class Settings(BaseSettings):
 
 settings = Settings()
 
-# Declare executors and semaphore
-thread_pool: ThreadPoolExecutor = None
-process_pool: ProcessPoolExecutor = None
-file_processing_semaphore = asyncio.Semaphore(10)
-
-def initialize_pools():
-    global thread_pool, process_pool
-    thread_pool = ThreadPoolExecutor(max_workers=settings.THREAD_POOL_MAX_WORKERS)
-    process_pool = ProcessPoolExecutor(max_workers=settings.PROCESS_POOL_MAX_WORKERS)
-
 def initialize_model():
     genai.configure(api_key=settings.GEMINI_API_KEY)
     return genai.GenerativeModel(model_name=settings.MODEL_NAME)
\ No newline at end of file
@@ -20,6 +20,8 @@ class BillCreate(BaseModel):
     status: BillStatus
     reasoning: Optional[str] = None
     type: BillType
+    # Hex dHash of each page of the document, for near-duplicate detection
+    page_hashes: List[str] = []
 
 class Bill(BaseModel):
     id: str
@@ -37,4 +39,5 @@ class Bill(BaseModel):
         }
 
 class UserBillsResponse(BaseModel):
-    bills: List[Bill]
\ No newline at end of file
+    bills: List[Bill]
+    next_page_token: Optional[str] = None
\ No newline at end of file
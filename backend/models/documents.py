@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
+from datetime import datetime
 from enum import Enum
 
 class DocumentType(str, Enum):
@@ -14,4 +15,29 @@ class BatchDocumentInput(BaseModel):
     documents: List[DocumentInput] = Field(..., min_items=1, max_items=10, description="List of documents to process")
 
 class DocumentResponse(BaseModel):
-    status: bool = Field(..., description="True if document(s) were processed successfully, False otherwise")
\ No newline at end of file
+    status: bool = Field(..., description="True if document(s) were processed successfully, False otherwise")
+    reason: Optional[str] = Field(None, description="Why a document was rejected, worded to be shown to the user")
+
+class DocumentResult(BaseModel):
+    index: int = Field(..., description="Position of the document in the submitted batch")
+    file_uri: str
+    status: bool = Field(..., description="True if the document was processed and verified successfully")
+    bill_ids: List[str] = Field(default_factory=list, description="IDs of the bills created from the document")
+    reasoning: Optional[str] = Field(None, description="Why the document was verified or rejected")
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+class ClaimJobResponse(BaseModel):
+    job_id: str = Field(..., description="ID of the claim job, to poll with GET /claim/jobs/{job_id}")
+    file_uri: str
+    document_type: DocumentType
+    status: JobStatus = Field(..., description="queued, running, succeeded or failed")
+    attempts: int = Field(0, description="Number of times processing was started")
+    result: Optional[bool] = Field(None, description="The claim status once the job succeeded")
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
\ No newline at end of file
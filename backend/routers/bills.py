@@ -1,25 +1,90 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import Dict
-from models.bills import Bill, UserBillsResponse
+import asyncio
+import hashlib
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from datetime import datetime
+from typing import Dict, List, Optional
+from models.bills import Bill, BillStatus, BillType, UserBillsResponse
 from auth.verify import verify_token
-from utils.helper import get_data_from_firestore
+from services.repositories import bills
+from utils.helper import etag_matches
 from config.logger import logger
 
 router = APIRouter()
 
+MAX_PAGE_SIZE = 200
+BILL_FIELDS = [name for name in Bill.model_fields if name != 'id']
+
+
+def bills_etag(user_id: str, last_updated: Optional[datetime], bill_count: int, params: Dict[str, Optional[str]]) -> str:
+    """
+    Strong ETag of a page of bills: it changes whenever any bill of the patient is written
+    (latest updated_at) or deleted (bill count), and differs between pages and filters.
+    """
+    version = f"{last_updated.isoformat() if last_updated else ''}:{bill_count}"
+    query = "&".join(f"{key}={value}" for key, value in sorted(params.items()) if value is not None)
+    return '"' + hashlib.sha256(f"{user_id}:{version}:{query}".encode()).hexdigest()[:32] + '"'
+
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in requested if field not in BILL_FIELDS and field != 'id']
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown bill fields: {', '.join(unknown)}")
+    return [field for field in requested if field != 'id']
+
+
 @router.get("/", response_model=UserBillsResponse)
-async def get_user_bills(token: Dict = Depends(verify_token)):
+async def get_user_bills(
+    request: Request,
+    # Without a limit every bill is returned, as clients that do not page (the Android passbook) expect
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    page_token: Optional[str] = None,
+    status: Optional[BillStatus] = None,
+    type: Optional[BillType] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated bill fields to return, all of them by default"),
+    token: Dict = Depends(verify_token)
+):
+    user_id = token.get("uid")
+    projection = parse_fields(fields)
+    if page_token:
+        try:
+            bills.decode_page_token(page_token)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
     try:
-        user_id = token.get("uid")
-        bills_data = get_data_from_firestore('bills', filter_field='patient_id', filter_value=user_id)
-        
-        if bills_data is None:
-            raise HTTPException(status_code=404, detail="No bills found")
-        
-        user_bills = [Bill(**bill) for bill in bills_data]
+        # Answer repeated polls from the latest updated_at and the bill count alone when nothing changed
+        last_updated, bill_count = await asyncio.gather(bills.last_updated(user_id), bills.count_for_patient(user_id))
+        etag = bills_etag(user_id, last_updated, bill_count, dict(request.query_params))
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+        bills_data, next_page_token = await bills.list_page(
+            user_id,
+            limit,
+            page_token=page_token,
+            status=status.value if status else None,
+            bill_type=type.value if type else None,
+            date_from=date_from,
+            date_to=date_to,
+            fields=projection
+        )
+
+        if projection is None:
+            user_bills = [Bill(**bill).model_dump() for bill in bills_data]
+        else:
+            user_bills = bills_data
         
         logger.info(f"Successfully retrieved {len(user_bills)} bills for user {user_id}")
-        return UserBillsResponse(bills=user_bills)
+        content = {"bills": user_bills, "next_page_token": next_page_token}
+        return JSONResponse(content=jsonable_encoder(content), headers=headers)
     except Exception as e:
         logger.error(f"Error retrieving bills for user {user_id}: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
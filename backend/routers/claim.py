@@ -1,20 +1,40 @@
 import asyncio
+from datetime import datetime, timezone
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer
-from models.documents import DocumentInput, DocumentResponse, BatchDocumentInput
-from typing import Dict
+from models.documents import DocumentInput, DocumentResponse, DocumentResult, BatchDocumentInput, ClaimJobResponse
+from typing import AsyncIterator, Dict, Optional, Tuple
 from services.doc_service import DocService
 from auth.verify import verify_token
-from config.settings import initialize_model
 from config.logger import logger
-from config.settings import process_pool, file_processing_semaphore, settings
+from config.settings import settings
+from services.runtime import get_doc_service, get_claim_jobs
+from services.claim_jobs import ClaimJob, ClaimJobQueue
+from services.resilience import UpstreamUnavailable
+from services.metrics import ClaimOutcome, record_claim_outcome
 
 router = APIRouter()
 security = HTTPBearer()
 
-def get_file_service():
-    model = initialize_model()
-    return DocService(model)
+def get_file_service() -> DocService:
+    return get_doc_service()
+
+def get_job_queue() -> ClaimJobQueue:
+    return get_claim_jobs()
+
+def to_job_response(job: ClaimJob) -> ClaimJobResponse:
+    return ClaimJobResponse(
+        job_id=job.job_id,
+        file_uri=job.file_uri,
+        document_type=job.document_type,
+        status=job.status,
+        attempts=job.attempts,
+        result=job.result,
+        error=job.error,
+        created_at=datetime.fromtimestamp(job.created_at, tz=timezone.utc),
+        updated_at=datetime.fromtimestamp(job.updated_at, tz=timezone.utc)
+    )
 
 @router.post("/verify", response_model=DocumentResponse)
 async def verify_claim(
@@ -25,25 +45,27 @@ async def verify_claim(
     user_id = token.get("uid")
     
     try:
-        async with file_processing_semaphore:
-            try:
-                async with asyncio.timeout(settings.PROCESSING_TIMEOUT):
-                    status = await asyncio.get_event_loop().run_in_executor(
-                        process_pool,
-                        file_service.get_claim_status,
-                        user_id,
-                        str(document.file_uri),
-                        document.document_type
-                    )
-            except asyncio.TimeoutError:
-                logger.error(f"Document processing timed out for user {user_id}")
-                raise HTTPException(status_code=504, detail="Document processing timed out")
+        try:
+            async with asyncio.timeout(settings.PROCESSING_TIMEOUT):
+                result = await file_service.verify_claim(
+                    user_id,
+                    str(document.file_uri),
+                    document.document_type
+                )
+        except asyncio.TimeoutError:
+            logger.error(f"Document processing timed out for user {user_id}")
+            record_claim_outcome(ClaimOutcome.TIMEOUT)
+            raise HTTPException(status_code=504, detail="Document processing timed out")
 
-        if status:
+        if result.status:
             logger.info(f"Successfully processed document for user {user_id}")
 
-        return DocumentResponse(status=status)
+        return DocumentResponse(status=result.status, reason=None if result.status else result.reasoning)
 
+    except UpstreamUnavailable as e:
+        logger.error(f"Document processing unavailable for user {user_id}: {str(e)}")
+        raise HTTPException(status_code=503, detail="Document processing is temporarily unavailable, please try again later",
+                            headers={"Retry-After": str(int(settings.CIRCUIT_RESET_SECONDS))})
     except Exception as e:
         logger.error(f"Error processing document: {str(e)}")
         raise HTTPException(status_code=500, detail="An error occurred while processing the document")
@@ -57,36 +79,116 @@ async def verify_claim_batch(
 ):
     user_id = token.get("uid")
     
-    async def process_document(document: DocumentInput) -> bool:
+    async def process_document(document: DocumentInput) -> Tuple[bool, Optional[str]]:
         try:
-            async with file_processing_semaphore:
-                try:
-                    async with asyncio.timeout(settings.PROCESSING_TIMEOUT):
-                        status = await asyncio.get_event_loop().run_in_executor(
-                            process_pool,
-                            file_service.get_claim_status,
-                            user_id,
-                            str(document.file_uri),
-                            document.document_type
-                        )
-                except asyncio.TimeoutError:
-                    logger.error(f"Document processing timed out for user {user_id}")
-                    return False
-                if status:
-                    logger.info(f"Successfully processed document {document.file_uri} for user {user_id}")
-                return status
+            try:
+                async with asyncio.timeout(settings.PROCESSING_TIMEOUT):
+                    result = await file_service.verify_claim(
+                        user_id,
+                        str(document.file_uri),
+                        document.document_type
+                    )
+            except asyncio.TimeoutError:
+                logger.error(f"Document processing timed out for user {user_id}")
+                record_claim_outcome(ClaimOutcome.TIMEOUT)
+                return False, "Document processing timed out"
+            if result.status:
+                logger.info(f"Successfully processed document {document.file_uri} for user {user_id}")
+            return result.status, result.reasoning
         except Exception as e:
             logger.error(f"Error processing document {document.file_uri}: {str(e)}")
-            return False
+            return False, "An error occurred while processing the document"
 
     try:
         tasks = [process_document(document) for document in documents.documents]
-        statuses = await asyncio.gather(*tasks)
-        # Check if all documents were processed successfully
-        all_successful = all(statuses)
+        outcomes = await asyncio.gather(*tasks)
+        # Check if all documents were processed successfully, and report why the first one that was not failed
+        all_successful = all(status for status, _ in outcomes)
+        reason = next((reason for status, reason in outcomes if not status), None)
 
-        return DocumentResponse(status=all_successful)
+        return DocumentResponse(status=all_successful, reason=reason)
 
     except Exception as e:
         logger.error(f"Error processing batch of documents: {str(e)}")
-        raise HTTPException(status_code=500, detail="An error occurred while processing the documents")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="An error occurred while processing the documents")
+
+
+@router.post("/verify-batch/stream", response_class=StreamingResponse)
+async def verify_claim_batch_stream(
+    documents: BatchDocumentInput,
+    token: Dict = Depends(verify_token),
+    file_service: DocService = Depends(get_file_service)
+):
+    """
+    Verify a batch of documents and stream one DocumentResult per line (NDJSON) as soon
+    as each document is done, in completion order. Clients can re-submit only the failed ones.
+    """
+    user_id = token.get("uid")
+
+    async def process_document(index: int, document: DocumentInput) -> DocumentResult:
+        file_uri = str(document.file_uri)
+        try:
+            async with asyncio.timeout(settings.PROCESSING_TIMEOUT):
+                result = await file_service.verify_claim(user_id, file_uri, document.document_type)
+            return DocumentResult(index=index, file_uri=file_uri, status=result.status,
+                                  bill_ids=result.bill_ids, reasoning=result.reasoning)
+        except asyncio.TimeoutError:
+            logger.error(f"Document processing timed out for user {user_id}")
+            record_claim_outcome(ClaimOutcome.TIMEOUT)
+            return DocumentResult(index=index, file_uri=file_uri, status=False, reasoning="Document processing timed out")
+        except UpstreamUnavailable as e:
+            logger.error(f"Document processing unavailable for {file_uri}: {str(e)}")
+            return DocumentResult(index=index, file_uri=file_uri, status=False,
+                                  reasoning="Document processing is temporarily unavailable, please try again later")
+        except Exception as e:
+            logger.error(f"Error processing document {file_uri}: {str(e)}")
+            return DocumentResult(index=index, file_uri=file_uri, status=False,
+                                  reasoning="An error occurred while processing the document")
+
+    async def stream_results() -> AsyncIterator[str]:
+        tasks = [asyncio.create_task(process_document(index, document)) for index, document in enumerate(documents.documents)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                yield result.model_dump_json() + "\n"
+        finally:
+            # The client went away: stop the documents still being processed
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+@router.post("/jobs", response_model=ClaimJobResponse, status_code=202)
+async def submit_claim_job(
+    document: DocumentInput,
+    token: Dict = Depends(verify_token),
+    job_queue: ClaimJobQueue = Depends(get_job_queue)
+):
+    user_id = token.get("uid")
+    try:
+        job = await job_queue.submit(user_id, str(document.file_uri), document.document_type)
+        return to_job_response(job)
+    except Exception as e:
+        logger.error(f"Error queueing claim job for user {user_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="An error occurred while queueing the document")
+
+
+@router.get("/jobs/{job_id}", response_model=ClaimJobResponse)
+async def get_claim_job(
+    job_id: str,
+    token: Dict = Depends(verify_token),
+    job_queue: ClaimJobQueue = Depends(get_job_queue)
+):
+    user_id = token.get("uid")
+    try:
+        job = await job_queue.get(job_id)
+    except Exception as e:
+        logger.error(f"Error retrieving claim job {job_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="An error occurred while retrieving the job")
+
+    # Jobs of other users are reported as missing
+    if job is None or job.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return to_job_response(job)
\ No newline at end of file
@@ -1,38 +1,54 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
 from typing import List, Dict
 from models.hospital import Hospital
 from auth.verify import verify_token
-from utils.helper import get_data_from_firestore
+from services.hospital_directory import HospitalDirectory
+from services.runtime import get_hospital_directory
+from utils.helper import etag_matches
+from config.settings import settings
 from config.logger import logger
 
 router = APIRouter()
 
+def get_directory() -> HospitalDirectory:
+    return get_hospital_directory()
+
+def cached_json(request: Request, body: bytes, etag: str) -> Response:
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={settings.HOSPITAL_CACHE_MAX_AGE_SECONDS}"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @router.get("/", response_model=List[Hospital])
-async def get_hospitals(token: Dict = Depends(verify_token)):
+async def get_hospitals(
+    request: Request,
+    token: Dict = Depends(verify_token),
+    directory: HospitalDirectory = Depends(get_directory)
+):
     try:
-        hospitals_data = get_data_from_firestore('hospitals')
-        
-        if hospitals_data is None:
-            raise HTTPException(status_code=404, detail="No hospitals found")
-        
-        hospitals = [Hospital(**hospital) for hospital in hospitals_data]
-        
-        logger.info(f"Successfully retrieved {len(hospitals)} hospitals")
-        return hospitals
+        snapshot = await directory.snapshot()
+        logger.info(f"Successfully retrieved {len(snapshot.hospitals)} hospitals")
+        return cached_json(request, snapshot.list_body, snapshot.list_etag)
     except Exception as e:
         logger.error(f"Error retrieving hospitals: {str(e)}")
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 @router.get("/{hospital_id}", response_model=Hospital)
-async def get_hospital(hospital_id: str, token: Dict = Depends(verify_token)):
+async def get_hospital(
+    hospital_id: str,
+    request: Request,
+    token: Dict = Depends(verify_token),
+    directory: HospitalDirectory = Depends(get_directory)
+):
     try:
-        hospital_data = get_data_from_firestore(f'hospitals/{hospital_id}')
-        
-        if hospital_data is None:
-            raise HTTPException(status_code=404, detail="Hospital not found")
-        
-        logger.info(f"Successfully retrieved hospital with ID: {hospital_id}")
-        return Hospital(**hospital_data)
+        snapshot = await directory.snapshot()
     except Exception as e:
         logger.error(f"Error retrieving hospital with ID {hospital_id}: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+    hospital = snapshot.hospitals.get(hospital_id)
+    if hospital is None:
+        raise HTTPException(status_code=404, detail="Hospital not found")
+
+    logger.info(f"Successfully retrieved hospital with ID: {hospital_id}")
+    return cached_json(request, *hospital)
@@ -7,14 +7,16 @@ from models.kyc import KYCDocumentResponse
 from services.doc_service import DocService
 from auth.verify import verify_token
 from config.logger import logger
-from config.settings import process_pool, file_processing_semaphore, initialize_model, settings
+from config.settings import settings
+from services.runtime import get_doc_service
+from services.resilience import UpstreamUnavailable
+from services.prescreen import DocumentRejected
 
 router = APIRouter()
 security = HTTPBearer()
 
-def get_file_service():
-    model = initialize_model()
-    return DocService(model)
+def get_file_service() -> DocService:
+    return get_doc_service()
 
 @router.post("/verify", response_model=KYCDocumentResponse)
 async def verify_kyc_document(
@@ -25,18 +27,15 @@ async def verify_kyc_document(
     user_id = token.get("uid")
     
     try:
-        async with file_processing_semaphore:
-            try:
-                async with asyncio.timeout(settings.PROCESSING_TIMEOUT):
-                    extracted_data = await asyncio.get_event_loop().run_in_executor(
-                        process_pool,
-                        file_service.get_kyc_data,
-                        str(document.file_uri),
-                        document.document_type
-                    )
-            except asyncio.TimeoutError:
-                logger.error(f"KYC document processing timed out for user {user_id}")
-                raise HTTPException(status_code=504, detail="Document processing timed out")
+        try:
+            async with asyncio.timeout(settings.PROCESSING_TIMEOUT):
+                extracted_data = await file_service.get_kyc_data(
+                    str(document.file_uri),
+                    document.document_type
+                )
+        except asyncio.TimeoutError:
+            logger.error(f"KYC document processing timed out for user {user_id}")
+            raise HTTPException(status_code=504, detail="Document processing timed out")
 
         if extracted_data:
             logger.info(f"Successfully processed KYC document for user {user_id} with data : {extracted_data}")
@@ -45,6 +44,13 @@ async def verify_kyc_document(
         else:
             raise HTTPException(status_code=400, detail="Failed to extract data from the document")
 
+    except DocumentRejected as e:
+        logger.info(f"KYC document of user {user_id} rejected by the pre-screen: {e.reason}")
+        raise HTTPException(status_code=422, detail=e.reason)
+    except UpstreamUnavailable as e:
+        logger.error(f"Document processing unavailable for user {user_id}: {str(e)}")
+        raise HTTPException(status_code=503, detail="Document processing is temporarily unavailable, please try again later",
+                            headers={"Retry-After": str(int(settings.CIRCUIT_RESET_SECONDS))})
     except Exception as e:
         logger.error(f"Error processing KYC document: {str(e)}")
         raise HTTPException(status_code=500, detail="An error occurred while processing the document")
\ No newline at end of file
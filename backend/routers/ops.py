@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends
+from typing import Dict, Any
+from auth.verify import token_cache, verify_ops_token
+from services.patient_profiles import patient_profiles
+from services.runtime import (
+    get_engine, get_extraction_cache, get_file_registry, get_hospital_directory, get_claim_jobs, get_gemini_limiter,
+    get_upstream_callers, get_claim_flights, get_duplicate_index
+)
+
+router = APIRouter(dependencies=[Depends(verify_ops_token)])
+
+@router.get("/pipeline", response_model=Dict[str, Any])
+async def get_pipeline_stats():
+    return {
+        "stages": get_engine().stats(),
+        "gemini_limiter": get_gemini_limiter().stats(),
+        "upstreams": {name: caller.stats() for name, caller in get_upstream_callers().items()},
+        "claim_flights": get_claim_flights().stats(),
+        "claim_jobs": get_claim_jobs().stats()
+    }
+
+
+@router.get("/cache", response_model=Dict[str, Any])
+async def get_cache_stats():
+    extraction_cache = get_extraction_cache()
+    duplicate_index = get_duplicate_index()
+    return {
+        "extraction_cache": extraction_cache.stats() if extraction_cache else None,
+        "token_cache": token_cache.stats(),
+        "patient_cache": patient_profiles.stats(),
+        "duplicate_index": duplicate_index.stats() if duplicate_index else None,
+        "hospital_directory": get_hospital_directory().stats()
+    }
+
+
+@router.get("/gemini-files", response_model=Dict[str, Any])
+async def get_gemini_file_stats():
+    file_registry = get_file_registry()
+    return {"gemini_files": file_registry.stats() if file_registry else None}
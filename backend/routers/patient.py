@@ -5,7 +5,7 @@ from models.patients import PatientCreate, Patient
 from services.patient_service import PatientService
 from auth.verify import verify_token
 from config.logger import logger
-from utils.helper import get_data_from_firestore
+from services.patient_profiles import patient_profiles
 
 router = APIRouter()
 security = HTTPBearer()
@@ -27,7 +27,7 @@ async def add_patient(
             raise HTTPException(status_code=400, detail=validation_result['errors'])
 
         # Add patient to Firestore
-        patient_id = patient_service.add_patient(patient_data, user_id)
+        patient_id = await patient_service.add_patient(patient_data, user_id)
 
         return {"status": "success", "patient_id": patient_id}
     except HTTPException as he:
@@ -41,21 +41,12 @@ async def add_patient(
 async def get_patient(token: Dict = Depends(verify_token)):
     try:
         user_id = token.get("uid")
-        patients_data = get_data_from_firestore('patients', filter_field='id', filter_value=user_id)
+        patient_data = await patient_profiles.get(user_id)
         
-        if not patients_data:
+        if not patient_data:
             logger.warning(f"No patient found with id {user_id}")
             return {"patient_data": None}
         
-        if isinstance(patients_data, list):
-            if len(patients_data) > 1:
-                logger.warning(f"Multiple patients found with id {user_id}")
-            patient_data = patients_data[0]
-        elif isinstance(patients_data, dict):
-            patient_data = patients_data
-        else:
-            raise ValueError(f"Unexpected data type returned from Firestore: {type(patients_data)}")
-        
         return {"patient_data": Patient(**patient_data)}
     except Exception as e:
         logger.error(f"Error retrieving patient data: {str(e)}")
@@ -0,0 +1,370 @@
+import os
+import time
+import random
+import uuid
+import asyncio
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional
+from google.cloud.firestore_v1.async_transaction import async_transactional
+from google.cloud.firestore_v1.base_query import FieldFilter
+from models.documents import DocumentType, JobStatus
+from services.metrics import ClaimOutcome, record_claim_outcome
+from config.settings import settings
+from config.logger import logger
+
+
+@dataclass
+class ClaimJob:
+    job_id: str
+    user_id: str
+    file_uri: str
+    document_type: str
+    status: str = JobStatus.QUEUED.value
+    attempts: int = 0
+    result: Optional[bool] = None
+    error: Optional[str] = None
+    created_at: float = 0.0
+    updated_at: float = 0.0
+    lease_expires_at: float = 0.0
+    # A queued job is not claimed before this time; pushed back when a failed job is re-queued
+    not_before: float = 0.0
+
+    @classmethod
+    def new(cls, user_id: str, file_uri: str, document_type: DocumentType) -> "ClaimJob":
+        now = time.time()
+        return cls(job_id=uuid.uuid4().hex, user_id=user_id, file_uri=file_uri,
+                   document_type=document_type.value, created_at=now, updated_at=now, not_before=now)
+
+
+class JobBackend(ABC):
+    """
+    Durable store of claim jobs. A claimed job is leased to one worker; a job whose
+    lease expired (its worker died or the process restarted) can be claimed again.
+    """
+
+    @abstractmethod
+    async def enqueue(self, job: ClaimJob):
+        ...
+
+    @abstractmethod
+    async def claim_next(self, lease_seconds: float) -> Optional[ClaimJob]:
+        """Lease the oldest runnable job, or return None if there is none."""
+
+    @abstractmethod
+    async def finish(self, job_id: str, status: JobStatus, result: Optional[bool] = None, error: Optional[str] = None,
+                     not_before: float = 0.0):
+        """Record the outcome of a job. A job finished as QUEUED is retried, not before not_before."""
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[ClaimJob]:
+        ...
+
+    async def close(self):
+        pass
+
+
+class SqliteJobBackend(JobBackend):
+    """
+    Job store in a local sqlite file. Survives restarts of a single instance; meant for
+    development, tests and single-instance deployments.
+    """
+
+    COLUMNS = [
+        "job_id", "user_id", "file_uri", "document_type", "status", "attempts",
+        "result", "error", "created_at", "updated_at", "lease_expires_at", "not_before",
+    ]
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS claim_jobs ("
+            "job_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, file_uri TEXT NOT NULL, document_type TEXT NOT NULL, "
+            "status TEXT NOT NULL, attempts INTEGER NOT NULL, result INTEGER, error TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, lease_expires_at REAL NOT NULL, "
+            "not_before REAL NOT NULL DEFAULT 0)"
+        )
+        # Files created before jobs had a not_before
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(claim_jobs)")}
+        if "not_before" not in columns:
+            self._db.execute("ALTER TABLE claim_jobs ADD COLUMN not_before REAL NOT NULL DEFAULT 0")
+        self._db.execute("CREATE INDEX IF NOT EXISTS claim_jobs_status_created_at ON claim_jobs (status, created_at)")
+        self._db.commit()
+
+    def _to_job(self, row) -> ClaimJob:
+        job = ClaimJob(**dict(zip(self.COLUMNS, row)))
+        if job.result is not None:
+            job.result = bool(job.result)
+        return job
+
+    def _enqueue(self, job: ClaimJob):
+        with self._lock:
+            self._db.execute(
+                f"INSERT INTO claim_jobs ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                [getattr(job, column) for column in self.COLUMNS]
+            )
+            self._db.commit()
+
+    def _claim_next(self, lease_seconds: float) -> Optional[ClaimJob]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM claim_jobs "
+                "WHERE (status = ? AND not_before <= ?) OR (status = ? AND lease_expires_at < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (JobStatus.QUEUED.value, now, JobStatus.RUNNING.value, now)
+            ).fetchone()
+            if row is None:
+                return None
+            job = self._to_job(row)
+            job.status = JobStatus.RUNNING.value
+            job.attempts += 1
+            job.updated_at = now
+            job.lease_expires_at = now + lease_seconds
+            self._db.execute(
+                "UPDATE claim_jobs SET status = ?, attempts = ?, updated_at = ?, lease_expires_at = ? WHERE job_id = ?",
+                (job.status, job.attempts, job.updated_at, job.lease_expires_at, job.job_id)
+            )
+            self._db.commit()
+            return job
+
+    def _finish(self, job_id: str, status: JobStatus, result: Optional[bool], error: Optional[str], not_before: float):
+        with self._lock:
+            self._db.execute(
+                "UPDATE claim_jobs SET status = ?, result = ?, error = ?, updated_at = ?, lease_expires_at = 0, not_before = ? "
+                "WHERE job_id = ?",
+                (status.value, None if result is None else int(result), error, time.time(), not_before, job_id)
+            )
+            self._db.commit()
+
+    def _get(self, job_id: str) -> Optional[ClaimJob]:
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM claim_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return self._to_job(row) if row is not None else None
+
+    async def enqueue(self, job: ClaimJob):
+        await asyncio.to_thread(self._enqueue, job)
+
+    async def claim_next(self, lease_seconds: float) -> Optional[ClaimJob]:
+        return await asyncio.to_thread(self._claim_next, lease_seconds)
+
+    async def finish(self, job_id: str, status: JobStatus, result: Optional[bool] = None, error: Optional[str] = None,
+                     not_before: float = 0.0):
+        await asyncio.to_thread(self._finish, job_id, status, result, error, not_before)
+
+    async def get(self, job_id: str) -> Optional[ClaimJob]:
+        return await asyncio.to_thread(self._get, job_id)
+
+    async def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class FirestoreJobBackend(JobBackend):
+    """
+    Job store in the claim_jobs Firestore collection, shared by every instance.
+    Jobs are leased in a transaction, so two workers never claim the same job.
+    Needs composite indexes on claim_jobs (status, not_before) and (status, lease_expires_at).
+    """
+
+    collection_path = 'claim_jobs'
+
+    def __init__(self, client, timeout: float):
+        self.client = client
+        self.timeout = timeout
+
+    def collection(self):
+        return self.client.collection(self.collection_path)
+
+    async def enqueue(self, job: ClaimJob):
+        async with asyncio.timeout(self.timeout):
+            await self.collection().document(job.job_id).set(asdict(job), timeout=self.timeout)
+
+    async def _claim_first(self, filters: List[FieldFilter], order_by: str, lease_seconds: float) -> Optional[ClaimJob]:
+        query = self.collection()
+        for field_filter in filters:
+            query = query.where(filter=field_filter)
+        query = query.order_by(order_by).limit(1)
+
+        @async_transactional
+        async def claim(transaction) -> Optional[ClaimJob]:
+            async for snapshot in query.stream(transaction=transaction):
+                job = ClaimJob(**snapshot.to_dict())
+                now = time.time()
+                if job.status == JobStatus.RUNNING.value and job.lease_expires_at >= now:
+                    return None
+                job.status = JobStatus.RUNNING.value
+                job.attempts += 1
+                job.updated_at = now
+                job.lease_expires_at = now + lease_seconds
+                transaction.update(snapshot.reference, {
+                    'status': job.status,
+                    'attempts': job.attempts,
+                    'updated_at': job.updated_at,
+                    'lease_expires_at': job.lease_expires_at,
+                })
+                return job
+            return None
+
+        async with asyncio.timeout(self.timeout):
+            return await claim(self.client.transaction())
+
+    async def claim_next(self, lease_seconds: float) -> Optional[ClaimJob]:
+        # Jobs abandoned by a dead worker first, then the queued job that became runnable first
+        # (a new job's not_before is its created_at)
+        now = time.time()
+        abandoned = [
+            FieldFilter('status', '==', JobStatus.RUNNING.value),
+            FieldFilter('lease_expires_at', '<', now),
+        ]
+        job = await self._claim_first(abandoned, 'lease_expires_at', lease_seconds)
+        if job is not None:
+            return job
+        queued = [
+            FieldFilter('status', '==', JobStatus.QUEUED.value),
+            FieldFilter('not_before', '<=', now),
+        ]
+        return await self._claim_first(queued, 'not_before', lease_seconds)
+
+    async def finish(self, job_id: str, status: JobStatus, result: Optional[bool] = None, error: Optional[str] = None,
+                     not_before: float = 0.0):
+        async with asyncio.timeout(self.timeout):
+            await self.collection().document(job_id).update({
+                'status': status.value,
+                'result': result,
+                'error': error,
+                'updated_at': time.time(),
+                'lease_expires_at': 0.0,
+                'not_before': not_before,
+            }, timeout=self.timeout)
+
+    async def get(self, job_id: str) -> Optional[ClaimJob]:
+        async with asyncio.timeout(self.timeout):
+            snapshot = await self.collection().document(job_id).get(timeout=self.timeout)
+        return ClaimJob(**snapshot.to_dict()) if snapshot.exists else None
+
+
+class ClaimJobQueue:
+    """
+    Runs claim verification in the background: requests enqueue a job and return
+    its ID right away, and a pool of workers drains the backend.
+
+    A job that times out or fails with an error is retried up to max_attempts times, after
+    a jittered exponential backoff of retry_base_delay_seconds up to retry_max_delay_seconds.
+    """
+
+    def __init__(self, backend: JobBackend, doc_service, workers: int, poll_seconds: float, max_attempts: int,
+                 retry_base_delay_seconds: float, retry_max_delay_seconds: float):
+        self.backend = backend
+        self.doc_service = doc_service
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self.retry_base_delay_seconds = retry_base_delay_seconds
+        self.retry_max_delay_seconds = retry_max_delay_seconds
+        # A lease outlives a worker's processing time, so only abandoned jobs are claimed again
+        self.lease_seconds = 2 * settings.PROCESSING_TIMEOUT
+        self._wakeup = asyncio.Event()
+        self._worker_tasks: List[asyncio.Task] = []
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        """Start the workers."""
+        loop = asyncio.get_running_loop()
+        while len(self._worker_tasks) < self.workers:
+            self._worker_tasks.append(loop.create_task(self._worker()))
+
+    async def submit(self, user_id: str, file_uri: str, document_type: DocumentType) -> ClaimJob:
+        job = ClaimJob.new(user_id, file_uri, document_type)
+        await self.backend.enqueue(job)
+        self._wakeup.set()
+        logger.info(f"Claim job {job.job_id} queued for user {user_id}")
+        return job
+
+    async def get(self, job_id: str) -> Optional[ClaimJob]:
+        return await self.backend.get(job_id)
+
+    async def _worker(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                job = await self.backend.claim_next(self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Failed to claim the next claim job: {str(e)}")
+                job = None
+            if job is None:
+                try:
+                    async with asyncio.timeout(self.poll_seconds):
+                        await self._wakeup.wait()
+                except TimeoutError:
+                    pass
+                continue
+            # Another job may be waiting behind this one
+            self._wakeup.set()
+            try:
+                await self._run(job)
+            except Exception as e:
+                # The job's lease expires and it is claimed again; the worker goes on
+                logger.error(f"Claim job {job.job_id} crashed its worker: {str(e)}")
+
+    def _retry_delay(self, attempts: int) -> float:
+        return random.uniform(0, min(self.retry_max_delay_seconds, self.retry_base_delay_seconds * 2 ** (attempts - 1)))
+
+    async def _run(self, job: ClaimJob):
+        if job.attempts > self.max_attempts:
+            await self.backend.finish(job.job_id, JobStatus.FAILED, error="Too many attempts")
+            self.failed += 1
+            return
+
+        self.running += 1
+        try:
+            async with asyncio.timeout(settings.PROCESSING_TIMEOUT):
+                status = await self.doc_service.get_claim_status(
+                    job.user_id, job.file_uri, DocumentType(job.document_type)
+                )
+        except Exception as e:
+            if isinstance(e, TimeoutError):
+                record_claim_outcome(ClaimOutcome.TIMEOUT)
+            error = "Document processing timed out" if isinstance(e, TimeoutError) else str(e)
+            retry = job.attempts < self.max_attempts
+            logger.error(f"Claim job {job.job_id} failed (attempt {job.attempts}): {error}")
+            try:
+                if retry:
+                    not_before = time.time() + self._retry_delay(job.attempts)
+                    await self.backend.finish(job.job_id, JobStatus.QUEUED, error=error, not_before=not_before)
+                else:
+                    await self.backend.finish(job.job_id, JobStatus.FAILED, error=error)
+            except Exception as finish_error:
+                logger.error(f"Failed to record the outcome of claim job {job.job_id}: {str(finish_error)}")
+            if not retry:
+                self.failed += 1
+        else:
+            # The bills are saved, so a failed write must not re-queue the job: it is only
+            # claimed again once its lease expires
+            self.completed += 1
+            logger.info(f"Claim job {job.job_id} finished with status: {status}")
+            try:
+                await self.backend.finish(job.job_id, JobStatus.SUCCEEDED, result=status)
+            except Exception as finish_error:
+                logger.error(f"Failed to record the outcome of claim job {job.job_id}: {str(finish_error)}")
+        finally:
+            self.running -= 1
+
+    async def close(self):
+        """Stop the workers. Jobs they were running are picked up again once their lease expires."""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        await self.backend.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": len(self._worker_tasks), "running": self.running, "completed": self.completed, "failed": self.failed}
@@ -0,0 +1,142 @@
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict
+from google.api_core import exceptions as api_exceptions
+from config.logger import logger
+
+# Errors by which Gemini tells us to slow down
+OVERLOAD_ERRORS = (
+    api_exceptions.TooManyRequests,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.DeadlineExceeded,
+)
+
+# Number of recent calls the latency and queue wait percentiles are computed over
+WINDOW_SIZE = 100
+
+
+def percentile(samples, fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit that adapts to the upstream with AIMD.
+
+    Each call that succeeds within latency_target_seconds grows the limit by 1/limit,
+    so roughly by one per round of calls. An overload error, or a p95 latency above the
+    target, multiplies the limit by backoff_ratio, at most once per cooldown_seconds
+    so one burst of failures counts as a single congestion signal.
+    """
+
+    def __init__(self, name: str, initial_limit: int, min_limit: int, max_limit: int,
+                 latency_target_seconds: float, backoff_ratio: float, cooldown_seconds: float):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target_seconds = latency_target_seconds
+        self.backoff_ratio = backoff_ratio
+        self.cooldown_seconds = cooldown_seconds
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._latencies: Deque[float] = deque(maxlen=WINDOW_SIZE)
+        self._queue_waits: Deque[float] = deque(maxlen=WINDOW_SIZE)
+        self._last_decrease = 0.0
+        self.completed = 0
+        self.overloads = 0
+        self.decreases = 0
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, int(self._limit))
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[None]:
+        """
+        Hold one slot of the limit for the duration of the block. Errors in OVERLOAD_ERRORS
+        raised by the block shrink the limit; they are re-raised.
+        """
+        queued_at = time.monotonic()
+        if self._in_flight >= self.limit or self._waiters:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # The slot was handed over just before the cancellation
+                    self._release()
+                elif waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                raise
+        else:
+            self._in_flight += 1
+
+        started_at = time.monotonic()
+        self._queue_waits.append(started_at - queued_at)
+        try:
+            yield
+        except OVERLOAD_ERRORS as e:
+            self.overloads += 1
+            self._decrease(f"{type(e).__name__}")
+            raise
+        else:
+            self._on_success(time.monotonic() - started_at)
+        finally:
+            self._release()
+
+    def _on_success(self, latency: float):
+        self.completed += 1
+        self._latencies.append(latency)
+        if latency > self.latency_target_seconds:
+            if percentile(self._latencies, 0.95) > self.latency_target_seconds:
+                self._decrease("p95 latency above target")
+            return
+        if self._limit < self.max_limit:
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            self._wake()
+
+    def _decrease(self, reason: str):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown_seconds:
+            return
+        self._last_decrease = now
+        self._limit = max(self.min_limit, self._limit * self.backoff_ratio)
+        self.decreases += 1
+        logger.warning(f"Concurrency limit of {self.name} lowered to {self.limit} ({reason})")
+
+    def _release(self):
+        self._in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        # Hand free slots over to the waiters in arrival order
+        while self._waiters and self._in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._in_flight += 1
+                waiter.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "in_flight": self._in_flight,
+            "waiting": len(self._waiters),
+            "queue_wait_p95_seconds": percentile(self._queue_waits, 0.95),
+            "latency_p95_seconds": percentile(self._latencies, 0.95),
+            "completed": self.completed,
+            "overloads": self.overloads,
+            "decreases": self.decreases,
+        }
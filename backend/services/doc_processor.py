@@ -1,18 +1,82 @@
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, List, Tuple, Optional
 import google.generativeai as genai
-from utils.helper import load_prompt_from_file, add_data_to_firestore
+from utils.helper import load_prompt_from_file
 from config.logger import logger
 from datetime import datetime, date
 from models.bills import BillCreate, BillType, BillStatus
 from services.doc_verifier import DocVerifier
+from services.repositories import bills
+from services.resilience import TRANSIENT_ERRORS
 from proto.marshal.collections.maps import MapComposite
 import re
 
 
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_ONLY_HIGH"
+    },
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_ONLY_HIGH"
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_ONLY_HIGH"
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_ONLY_HIGH"
+    }
+]
+
+GENERATION_CONFIG = {"temperature": 0.1}
+
+CLAIM_BILL_TYPES = {
+    "process_discharge_bill": BillType.DISCHARGE,
+    "process_pharmacy_bill": BillType.PHARMACY
+}
+
+# Put before the pages when a whole document is sent in one request
+DOCUMENT_PAGES_NOTE = "The following {count} images are the pages of a single document, in page order. Process them together as one document."
+
+KYC_FUNCTIONS = ["process_prescription", "process_aadhar_card_front", "process_aadhar_card_back", "process_pan_card", "process_bank_account"]
+
+
 class DocProcessor:
     def __init__(self, model: genai.GenerativeModel):
+        """
+        Build the prompts and tool declarations once. A DocProcessor is meant to be
+        created at startup and shared across requests (see services.runtime).
+        """
         self.model = model
+        self.claim_prompt = load_prompt_from_file('config/prompt.json', 'prompt_claim_classification')
+        self.kyc_prompt = load_prompt_from_file('config/prompt.json', 'prompt_kyc_classification')
         self.setup_function_declarations()
+        self.claim_tool = genai.protos.Tool(function_declarations=self.claim_function_declarations)
+        self.kyc_tool = genai.protos.Tool(function_declarations=self.kyc_function_declarations)
+
+    def warm_up(self) -> bool:
+        """
+        Send a cheap count_tokens probe with both tool sets so the client, credentials
+        and tool serialization are exercised before the first real request.
+
+        Returns:
+            bool: True if the probe succeeded, False otherwise.
+        """
+        try:
+            for prompt, tool in ((self.claim_prompt, self.claim_tool), (self.kyc_prompt, self.kyc_tool)):
+                self.model.count_tokens(
+                    [prompt],
+                    safety_settings=SAFETY_SETTINGS,
+                    generation_config=GENERATION_CONFIG,
+                    tools=[tool]
+                )
+            logger.info("Gemini model warmed up successfully")
+            return True
+        except Exception as e:
+            logger.warning(f"Gemini warm-up probe failed: {str(e)}")
+            return False
 
     def setup_function_declarations(self):
 
@@ -150,6 +214,15 @@ class DocProcessor:
         ]
 
 
+    def build_contents(self, document, prompt: str) -> List[Any]:
+        """
+        Build the request contents for one page, or for all the pages of a document given as a list.
+        """
+        if isinstance(document, list):
+            return [DOCUMENT_PAGES_NOTE.format(count=len(document)), *document, prompt]
+        return [document, prompt]
+
+
     def extract_function_call(self, response):
         if not response.candidates or len(response.candidates) == 0:
             logger.error("No candidates in the response")
@@ -195,134 +268,176 @@ class DocProcessor:
         return function_name, extracted_data
 
 
-    def process_claim(self, document, user_id) -> bool:
-        try:
-            classification_prompt = load_prompt_from_file('config/prompt.json', 'prompt_claim_classification')
-
-            safety_settings = [
-                {
-                    "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                    "threshold": "BLOCK_ONLY_HIGH"
-                },
-                {
-                    "category": "HARM_CATEGORY_HARASSMENT",
-                    "threshold": "BLOCK_ONLY_HIGH"
-                },
-                {
-                    "category": "HARM_CATEGORY_HATE_SPEECH",
-                    "threshold": "BLOCK_ONLY_HIGH"
-                },
-                {
-                    "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                    "threshold": "BLOCK_ONLY_HIGH"
-                },
-            ]
+    def interpret_claim_response(self, response) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Turn a Gemini response for a claim document into a validated function call.
 
-            response = self.model.generate_content(
-                [document, classification_prompt],
-                safety_settings=safety_settings,
-                generation_config={"temperature": 0.1},
-                tools=[genai.protos.Tool(function_declarations=self.claim_function_declarations)]
-            )
-            logger.info(f"Function Calling Response: {response}")
+        Returns:
+            Tuple[Optional[str], Optional[Dict[str, Any]]]: The function name and validated data, or (None, None).
+        """
+        function_name, extracted_data = self.extract_function_call(response)
 
-            function_name, extracted_data = self.extract_function_call(response)
+        if not function_name or not extracted_data:
+            return None, None
 
-            if not function_name or not extracted_data:
-                return False
+        if isinstance(extracted_data, MapComposite):
+            extracted_data = dict(extracted_data)
 
-            if isinstance(extracted_data, MapComposite):
-                extracted_data = dict(extracted_data)
+        if function_name not in CLAIM_BILL_TYPES:
+            logger.error(f"Invalid function name: {function_name}")
+            return None, None
 
-            if function_name not in ["process_discharge_bill", "process_pharmacy_bill"]:
-                logger.error(f"Invalid function name: {function_name}")
-                return False
+        is_valid, validated_data = self.validate_extracted_data(function_name, extracted_data)
+        if not is_valid:
+            logger.error(f"Invalid data extracted for {function_name}: {extracted_data}")
+            return None, None
 
-            is_valid, validated_data = self.validate_extracted_data(function_name, extracted_data)
-            if not is_valid:
-                logger.error(f"Invalid data extracted for {function_name}: {extracted_data}")
-                return False
+        return function_name, validated_data
 
-            processors = {
-                "process_discharge_bill": self.process_discharge_bill,
-                "process_pharmacy_bill": self.process_pharmacy_bill
-            }
-            
-            processor = processors.get(function_name)
-            if processor:
-                return processor(validated_data, user_id)
-            else:
-                logger.error(f"No processor found for function: {function_name}")
-                return False
 
-        except Exception as e:
-            logger.error(f"Error in process_doc: {str(e)}", exc_info=True)
-            return False
+    def interpret_kyc_response(self, response) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Turn a Gemini response for a KYC document into a validated function call.
 
+        Returns:
+            Tuple[Optional[str], Optional[Dict[str, Any]]]: The function name and validated data, or (None, None).
+        """
+        function_name, extracted_data = self.extract_function_call(response)
 
-    def process_kyc(self, document) -> Dict[str, Any]:
-        try:
-            classification_prompt = load_prompt_from_file('config/prompt.json', 'prompt_kyc_classification')
-
-            safety_settings = [
-                {
-                    "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                    "threshold": "BLOCK_ONLY_HIGH"
-                },
-                {
-                    "category": "HARM_CATEGORY_HARASSMENT",
-                    "threshold": "BLOCK_ONLY_HIGH"
-                },
-                {
-                    "category": "HARM_CATEGORY_HATE_SPEECH",
-                    "threshold": "BLOCK_ONLY_HIGH"
-                },
-                {
-                    "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                    "threshold": "BLOCK_ONLY_HIGH"
-                }
-            ]
+        if not function_name or not extracted_data:
+            return None, None
 
+        if function_name not in KYC_FUNCTIONS:
+            logger.error(f"Invalid function name for KYC document: {function_name}")
+            return None, None
+
+        is_valid, validated_data = self.validate_extracted_data(function_name, extracted_data)
+        if not is_valid:
+            logger.error(f"Invalid data extracted for {function_name}: {extracted_data}")
+            return None, None
+
+        return function_name, validated_data
+
+
+    def classify_claim(self, document) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Ask Gemini to classify a claim document and extract its data.
+
+        Returns:
+            Tuple[Optional[str], Optional[Dict[str, Any]]]: The function name and validated data, or (None, None).
+
+        Raises:
+            TRANSIENT_ERRORS: If Gemini is overloaded or failed transiently, so the caller can back off and retry.
+        """
+        try:
             response = self.model.generate_content(
-                [document, classification_prompt],
-                safety_settings=safety_settings,
-                generation_config={"temperature": 0.1},
-                tools=[genai.protos.Tool(function_declarations=self.kyc_function_declarations)]
+                self.build_contents(document, self.claim_prompt),
+                safety_settings=SAFETY_SETTINGS,
+                generation_config=GENERATION_CONFIG,
+                tools=[self.claim_tool]
             )
+            logger.info(f"Function Calling Response: {response}")
+            return self.interpret_claim_response(response)
+        except TRANSIENT_ERRORS:
+            raise
+        except Exception as e:
+            logger.error(f"Error in classify_claim: {str(e)}", exc_info=True)
+            return None, None
+
 
+    def classify_kyc(self, document) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Ask Gemini to classify a KYC document and extract its data.
+
+        Returns:
+            Tuple[Optional[str], Optional[Dict[str, Any]]]: The function name and validated data, or (None, None).
+
+        Raises:
+            TRANSIENT_ERRORS: If Gemini is overloaded or failed transiently, so the caller can back off and retry.
+        """
+        try:
+            response = self.model.generate_content(
+                self.build_contents(document, self.kyc_prompt),
+                safety_settings=SAFETY_SETTINGS,
+                generation_config=GENERATION_CONFIG,
+                tools=[self.kyc_tool]
+            )
             logger.info(f"Function Calling Response: {response}")
+            return self.interpret_kyc_response(response)
+        except TRANSIENT_ERRORS:
+            raise
+        except Exception as e:
+            logger.error(f"Error in classify_kyc: {str(e)}", exc_info=True)
+            return None, None
 
-            function_name, extracted_data = self.extract_function_call(response)
 
-            if not function_name or not extracted_data:
-                return None
+    async def classify_claim_async(self, document) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Native asyncio variant of classify_claim. The Gemini call is awaited on the
+        event loop, so no executor worker is held while waiting for the model.
 
-            if function_name not in ["process_prescription", "process_aadhar_card_front", "process_aadhar_card_back", "process_pan_card", "process_bank_account"]:
-                logger.error(f"Invalid function name for KYC document: {function_name}")
-                return None
+        Returns:
+            Tuple[Optional[str], Optional[Dict[str, Any]]]: The function name and validated data, or (None, None).
 
-            is_valid, validated_data = self.validate_extracted_data(function_name, extracted_data)
-            if not is_valid:
-                logger.error(f"Invalid data extracted for {function_name}: {extracted_data}")
-                return None
+        Raises:
+            TRANSIENT_ERRORS: If Gemini is overloaded or failed transiently, so the caller can back off and retry.
+        """
+        try:
+            response = await self.model.generate_content_async(
+                self.build_contents(document, self.claim_prompt),
+                safety_settings=SAFETY_SETTINGS,
+                generation_config=GENERATION_CONFIG,
+                tools=[self.claim_tool]
+            )
+            logger.info(f"Function Calling Response: {response}")
+            return self.interpret_claim_response(response)
+        except TRANSIENT_ERRORS:
+            raise
+        except Exception as e:
+            logger.error(f"Error in classify_claim_async: {str(e)}", exc_info=True)
+            return None, None
 
-            processors = {
-                "process_prescription": self.process_prescription,
-                "process_aadhar_card_front": self.process_aadhar_card_front,
-                "process_aadhar_card_back": self.process_aadhar_card_back,
-                "process_pan_card": self.process_pan_card,
-                "process_bank_account": self.process_bank_account
-            }
-            
-            processor = processors.get(function_name)
-            if processor:
-                return processor(validated_data)
-            else:
-                logger.error(f"No processor found for function: {function_name}")
-                return None
 
+    async def classify_kyc_async(self, document) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Native asyncio variant of classify_kyc.
+
+        Returns:
+            Tuple[Optional[str], Optional[Dict[str, Any]]]: The function name and validated data, or (None, None).
+
+        Raises:
+            TRANSIENT_ERRORS: If Gemini is overloaded or failed transiently, so the caller can back off and retry.
+        """
+        try:
+            response = await self.model.generate_content_async(
+                self.build_contents(document, self.kyc_prompt),
+                safety_settings=SAFETY_SETTINGS,
+                generation_config=GENERATION_CONFIG,
+                tools=[self.kyc_tool]
+            )
+            logger.info(f"Function Calling Response: {response}")
+            return self.interpret_kyc_response(response)
+        except TRANSIENT_ERRORS:
+            raise
         except Exception as e:
-            logger.error(f"Error in process_kyc_doc: {str(e)}", exc_info=True)
+            logger.error(f"Error in classify_kyc_async: {str(e)}", exc_info=True)
+            return None, None
+
+
+    def extract_kyc_data(self, function_name: str, validated_data: Dict[str, Any]) -> Dict[str, Any]:
+        processors = {
+            "process_prescription": self.process_prescription,
+            "process_aadhar_card_front": self.process_aadhar_card_front,
+            "process_aadhar_card_back": self.process_aadhar_card_back,
+            "process_pan_card": self.process_pan_card,
+            "process_bank_account": self.process_bank_account
+        }
+
+        processor = processors.get(function_name)
+        if processor:
+            return processor(validated_data)
+        else:
+            logger.error(f"No processor found for function: {function_name}")
             return None
 
 
@@ -418,72 +533,65 @@ class DocProcessor:
         return True, validated_data
 
 
-    def process_discharge_bill(self, data: Dict[str, Any], user_id: str) -> bool:
-        try:
-            verification_message, verification_status = DocVerifier.verify_discharge_bill_data(data, user_id)
-            
-            # Try parsing the date with multiple formats
-            date_formats = ["%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y", "%d-%m-%Y", "%Y-%d-%m"]
-            parsed_date = None
-            for date_format in date_formats:
-                try:
-                    parsed_date = datetime.strptime(data["date"], date_format)
-                    break
-                except ValueError:
-                    continue
-            
-            if parsed_date is None:
-                raise ValueError(f"Unable to parse date: {data['date']}")
-
-            bill_create = BillCreate(
-                    patient_id=user_id,
-                    date=parsed_date.isoformat(),
-                    amount=float(data["total_amount"]),
-                    status=BillStatus.VERIFIED if verification_status else BillStatus.REJECTED,
-                    reasoning=verification_message,
-                    type=BillType.DISCHARGE
-            )
-            bill_id = add_data_to_firestore(bill_create.model_dump(), 'bills')
-            logger.info(f"Discharge Bill created with ID: {bill_id}")
+    def build_bill(self, function_name: str, data: Dict[str, Any], user_id: str, patient_data: Optional[Dict[str, Any]]) -> Tuple[BillCreate, bool]:
+        """
+        Verify the extracted claim data against the patient's profile and build the bill to store.
 
-            return verification_status
-        except Exception as e:
-            logger.error(f"Error processing discharge bill: {str(e)}")
-            return False
+        Args:
+            function_name (str): Either process_discharge_bill or process_pharmacy_bill.
+            data (Dict[str, Any]): The validated extracted data.
+            user_id (str): The ID of the patient.
+            patient_data (Optional[Dict[str, Any]]): The patient's profile, None if it does not exist.
 
+        Returns:
+            Tuple[BillCreate, bool]: The bill to store and its verification status.
 
-    def process_pharmacy_bill(self, data: Dict[str, Any], user_id: str) -> bool:
-        try:
-            verification_message, verification_status = DocVerifier.verify_pharmacy_bill_data(data, user_id)
-            
-            # Try parsing the date with multiple formats
-            date_formats = ["%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y", "%d-%m-%Y", "%Y-%d-%m"]
-            parsed_date = None
-            for date_format in date_formats:
-                try:
-                    parsed_date = datetime.strptime(data["date"], date_format)
-                    break
-                except ValueError:
-                    continue
-            
-            if parsed_date is None:
-                raise ValueError(f"Unable to parse date: {data['date']}")
-
-            bill_create = BillCreate(
-                    patient_id=user_id,
-                    date=parsed_date.isoformat(),
-                    amount=float(data["total_amount"]),
-                    status=BillStatus.VERIFIED if verification_status else BillStatus.REJECTED,
-                    reasoning=verification_message,
-                    type=BillType.PHARMACY
-            )
-            bill_id = add_data_to_firestore(bill_create.model_dump(), 'bills')
-            logger.info(f"Pharmacy Bill created with ID: {bill_id}")
+        Raises:
+            ValueError: If the bill date can not be parsed.
+        """
+        verifiers = {
+            "process_discharge_bill": DocVerifier.verify_discharge_bill_data,
+            "process_pharmacy_bill": DocVerifier.verify_pharmacy_bill_data
+        }
+        verification_message, verification_status = verifiers[function_name](data, user_id, patient_data)
+
+        # Try parsing the date with multiple formats
+        date_formats = ["%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y", "%d-%m-%Y", "%Y-%d-%m"]
+        parsed_date = None
+        for date_format in date_formats:
+            try:
+                parsed_date = datetime.strptime(data["date"], date_format)
+                break
+            except ValueError:
+                continue
+
+        if parsed_date is None:
+            raise ValueError(f"Unable to parse date: {data['date']}")
+
+        bill_create = BillCreate(
+                patient_id=user_id,
+                date=parsed_date.isoformat(),
+                amount=float(data["total_amount"]),
+                status=BillStatus.VERIFIED if verification_status else BillStatus.REJECTED,
+                reasoning=verification_message,
+                type=CLAIM_BILL_TYPES[function_name]
+        )
+        return bill_create, verification_status
 
-            return verification_status
+
+    async def save_bills_async(self, bill_creates: List[BillCreate]) -> List[str]:
+        """
+        Raises:
+            Exception: If the bills could not be written; none of them is stored then.
+        """
+        try:
+            bill_ids = await bills.add_bills([bill_create.model_dump() for bill_create in bill_creates])
         except Exception as e:
-            logger.error(f"Error processing pharmacy bill: {str(e)}")
-            return False
+            logger.error(f"An error occurred while adding data to Firestore: {str(e)}")
+            raise
+        for bill_create, bill_id in zip(bill_creates, bill_ids):
+            logger.info(f"{bill_create.type.value.capitalize()} Bill created with ID: {bill_id}")
+        return bill_ids
 
 
     def process_prescription(self, data: Dict[str, Any]) -> Dict[str, Any]:
@@ -1,56 +1,692 @@
+import os
+import time
+import asyncio
+import hashlib
+import functools
+import dataclasses
 import google.generativeai as genai
-from utils.helper import upload_to_gemini, download_from_storage, pdf_to_images
-from typing import Dict, Any
+from collections import deque
+from contextlib import AsyncExitStack, aclosing, asynccontextmanager, nullcontext
+from utils.helper import (
+    PageImage, PreprocessProfile, download_from_storage, download_image_from_storage, detect_image_mime_type,
+    get_pdf_info, plan_pdf_dpi, render_pdf_page_to_bytes, preprocess_page, preprocess_image_file, upload_page_to_gemini,
+    estimate_image_tokens
+)
+from typing import Dict, Any, AsyncIterator, List, Tuple, Optional
 from services.doc_processor import DocProcessor
+from services.pipeline import ExecutionEngine, Stage
+from services.extraction_cache import ExtractionCache
+from services.gemini_files import GeminiFileRegistry
+from services.patient_profiles import patient_profiles
+from services.concurrency import AdaptiveLimiter
+from services.resilience import ResilientCaller, UpstreamUnavailable, resilient_call
+from services.single_flight import SingleFlight
+from services.prescreen import DocumentRejected, PrescreenThresholds, prescreen_page, prescreen_file
+from services.duplicates import INDEXED_STATUSES, DuplicateDocument, DuplicateIndex, Fingerprint, dhash_page
+from services.metrics import (
+    ClaimOutcome, record_claim_outcome, gemini_generate_seconds, patient_read_seconds, document_pages, document_bytes, page_bytes
+)
 from config.settings import settings
 from models.documents import DocumentType
+from models.bills import BillCreate, BillStatus
 from config.logger import logger
 from enum import Enum
+from dataclasses import dataclass, field
 
 class ProcessingType(Enum):
     CLAIM = 'claim'
     KYC = 'kyc'
 
+@dataclass
+class ClaimResult:
+    status: bool
+    bills: List[BillCreate] = field(default_factory=list)
+    bill_ids: List[str] = field(default_factory=list)
+    reasoning: Optional[str] = None
+    outcome: ClaimOutcome = ClaimOutcome.ERROR
+    # Why the bills could not be written, if they could not
+    write_error: Optional[str] = None
+
+    def to_shared(self) -> Dict[str, Any]:
+        return {"status": self.status, "bill_ids": self.bill_ids, "reasoning": self.reasoning,
+                "outcome": self.outcome.value, "write_error": self.write_error}
+
+    @classmethod
+    def from_shared(cls, data: Dict[str, Any]) -> "ClaimResult":
+        return cls(status=data["status"], bill_ids=list(data.get("bill_ids") or []), reasoning=data.get("reasoning"),
+                   outcome=ClaimOutcome(data.get("outcome", ClaimOutcome.ERROR)), write_error=data.get("write_error"))
+
+
+def preprocess_profile(document_type: DocumentType) -> Optional[PreprocessProfile]:
+    """
+    Choose how pages of a document are normalized before upload.
+
+    Phone photos get orientation, grayscale and contrast normalization at a lower
+    quality. Rendered PDF pages are already clean, so they are only converted to
+    grayscale and kept at a higher quality; their DPI is derived from the same
+    long edge target.
+    """
+    if not settings.PREPROCESS_ENABLED:
+        return None
+    if document_type == DocumentType.PDF:
+        return PreprocessProfile(
+            max_long_edge=settings.PREPROCESS_MAX_LONG_EDGE,
+            grayscale=settings.PREPROCESS_GRAYSCALE,
+            autocontrast=False,
+            format=settings.PREPROCESS_FORMAT,
+            quality=settings.PREPROCESS_PDF_QUALITY
+        )
+    return PreprocessProfile(
+        max_long_edge=settings.PREPROCESS_MAX_LONG_EDGE,
+        grayscale=settings.PREPROCESS_GRAYSCALE,
+        autocontrast=True,
+        format=settings.PREPROCESS_FORMAT,
+        quality=settings.PREPROCESS_PHOTO_QUALITY
+    )
+
+
+def prescreen_thresholds() -> Optional[PrescreenThresholds]:
+    """
+    The limits photos are pre-screened with, or None when the pre-screen is disabled.
+    """
+    if not settings.PRESCREEN_ENABLED:
+        return None
+    return PrescreenThresholds(
+        min_short_edge=settings.PRESCREEN_MIN_SHORT_EDGE,
+        max_aspect_ratio=settings.PRESCREEN_MAX_ASPECT_RATIO,
+        min_brightness=settings.PRESCREEN_MIN_BRIGHTNESS,
+        max_brightness=settings.PRESCREEN_MAX_BRIGHTNESS,
+        min_contrast=settings.PRESCREEN_MIN_CONTRAST,
+        min_sharpness=settings.PRESCREEN_MIN_SHARPNESS,
+        min_text_density=settings.PRESCREEN_MIN_TEXT_DENSITY
+    )
+
+
 class DocService:
     """
     A service class for processing various types of documents using the Gemini API.
     """
 
-    def __init__(self, model: genai.GenerativeModel):
+    def __init__(self, model: genai.GenerativeModel, engine: ExecutionEngine, extraction_cache: ExtractionCache = None,
+                 file_registry: GeminiFileRegistry = None, limiter: AdaptiveLimiter = None,
+                 gemini_calls: ResilientCaller = None, storage_calls: ResilientCaller = None, claim_flights: SingleFlight = None,
+                 duplicate_index: DuplicateIndex = None):
         """
         Initialize the DocService with a Gemini model.
 
         Args:
             model (genai.GenerativeModel): The Gemini model to use for processing.
+            engine (ExecutionEngine): The execution engine running the blocking pipeline stages.
+            extraction_cache (ExtractionCache, optional): Cache of extractions by page content.
+            file_registry (GeminiFileRegistry, optional): Registry of files uploaded to the Gemini File API.
+            limiter (AdaptiveLimiter, optional): Adaptive concurrency limit of the Gemini calls.
+            gemini_calls (ResilientCaller, optional): Retries and circuit breaker of the Gemini uploads and calls.
+            storage_calls (ResilientCaller, optional): Retries and circuit breaker of the Storage downloads.
+            claim_flights (SingleFlight, optional): Coalesces concurrent verifications of the same document.
+                Defaults to coalescing within this process.
+            duplicate_index (DuplicateIndex, optional): Page hashes of the patients' bills, to reject resubmitted bills.
         """
         self.model = model
+        self.engine = engine
+        self.extraction_cache = extraction_cache
+        self.file_registry = file_registry
+        self.limiter = limiter
+        self.gemini_calls = gemini_calls
+        self.storage_calls = storage_calls
+        self.claim_flights = claim_flights if claim_flights is not None else SingleFlight()
+        self.duplicate_index = duplicate_index
         self.doc_processor = DocProcessor(model)
 
 
-    def _process_single_image(self, user_id: str, image_path: str, processing_type: ProcessingType) -> Dict[str, Any]:
+    @asynccontextmanager
+    async def _gemini_document(self, page: PageImage, inline_limit: Optional[int] = None) -> AsyncIterator[Any]:
+        """
+        Turn an in-memory page into a Gemini content part for the duration of the block.
+
+        Pages up to inline_limit bytes (GEMINI_INLINE_MAX_BYTES by default) are sent inline
+        with the request. Larger pages go through the File API, which is the only place
+        they touch the disk. Uploaded files are tracked by the file registry, which reuses
+        them for identical pages and deletes them once they are no longer needed.
         """
-        Process a single image file for either claim or KYC data extraction.
+        if len(page.data) <= (settings.GEMINI_INLINE_MAX_BYTES if inline_limit is None else inline_limit):
+            yield {"mime_type": page.mime_type, "data": page.data}
+        elif self.file_registry is None:
+            yield await resilient_call(self.gemini_calls, functools.partial(self.engine.run, Stage.UPLOAD, upload_page_to_gemini, page))
+        else:
+            document = await self.file_registry.acquire(page)
+            try:
+                yield document
+            finally:
+                self.file_registry.release(page, document)
+
+
+    async def _process_single_image(self, user_id: str, page: PageImage, processing_type: ProcessingType, bills: Optional[List[BillCreate]] = None) -> Dict[str, Any]:
+        """
+        Process a single page image for either claim or KYC data extraction.
 
         Args:
             user_id (str): The user ID, required for claim processing.
-            image_path (str): The path to the image file.
+            page (PageImage): The encoded page image.
             processing_type (ProcessingType): The type of processing to perform (CLAIM or KYC).
+            bills (List[BillCreate], optional): Collects the bills built from claim pages, to be written together.
 
         Returns:
             Dict[str, Any]: The extracted data from the image.
+
+        Raises:
+            DocumentRejected: If the claim page duplicates a bill the user submitted before.
         """
-        document = upload_to_gemini(image_path)
-        if document is None:
-            raise Exception(f"Failed to upload image {image_path} to Gemini. Document is None")
+        page_hashes, candidates = None, None
         if processing_type == ProcessingType.CLAIM:
-            return self.doc_processor.process_claim(document, user_id)
+            page_hashes, candidates = await self._check_duplicate(user_id, [page])
+        function_name, validated_data = await self._extract(page, processing_type)
+        if processing_type == ProcessingType.CLAIM:
+            if not function_name:
+                return False
+            return await self._verify_claim(user_id, function_name, validated_data, bills, page_hashes, candidates)
         elif processing_type == ProcessingType.KYC:
-            return self.doc_processor.process_kyc(document)
+            if not function_name:
+                return None
+            return self.doc_processor.extract_kyc_data(function_name, validated_data)
         else:
             raise ValueError(f"Invalid processing type: {processing_type}")
 
 
-    def get_claim_status(self, user_id: str, file_uri: str, document_type: DocumentType) -> bool:
+    async def _extract(self, page: PageImage, processing_type: ProcessingType) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Get the function call Gemini chooses for a page, from the extraction cache when
+        the same page bytes were already processed.
+
+        Returns:
+            Tuple[Optional[str], Optional[Dict[str, Any]]]: The function name and validated data, or (None, None).
+        """
+        return await self._extract_pages([page], processing_type)
+
+
+    async def _extract_pages(self, pages: List[PageImage], processing_type: ProcessingType) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Get the function call Gemini chooses for a single page, or for several pages sent
+        together as one document. Cached by the bytes of the pages.
+
+        The pages share one inline budget of GEMINI_INLINE_MAX_BYTES; the pages past it
+        go through the File API.
+
+        Returns:
+            Tuple[Optional[str], Optional[Dict[str, Any]]]: The function name and validated data, or (None, None).
+        """
+        cache_key = None
+        if self.extraction_cache is not None:
+            if len(pages) == 1:
+                cache_key = ExtractionCache.make_key(f"{settings.MODEL_NAME}:{processing_type.value}", pages[0].content_hash)
+            else:
+                content_hash = hashlib.sha256("".join(page.content_hash for page in pages).encode()).hexdigest()
+                cache_key = ExtractionCache.make_key(f"{settings.MODEL_NAME}:{processing_type.value}:document", content_hash)
+            cached = await self.engine.run(Stage.CACHE, self.extraction_cache.get, cache_key)
+            if cached is not None:
+                logger.info(f"Extraction cache hit for page(s) {[page.page_number for page in pages]}: {cached[0]}")
+                return cached
+
+        async with AsyncExitStack() as stack:
+            documents = []
+            inline_left = settings.GEMINI_INLINE_MAX_BYTES
+            for page in pages:
+                document = await stack.enter_async_context(self._gemini_document(page, inline_left))
+                if document is None:
+                    raise Exception(f"Failed to upload page {page.page_number} to Gemini. Document is None")
+                if isinstance(document, dict):
+                    inline_left -= len(page.data)
+                documents.append(document)
+            function_name, validated_data = await self._classify(documents[0] if len(documents) == 1 else documents, processing_type)
+
+        if function_name and cache_key is not None:
+            # KYC extractions hold identity and bank account numbers, which must not reach the disk
+            await self.engine.run(Stage.CACHE, self.extraction_cache.set, cache_key, function_name, validated_data,
+                                  persist=processing_type != ProcessingType.KYC)
+        return function_name, validated_data
+
+
+    async def _classify(self, document, processing_type: ProcessingType) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Classify an uploaded document with Gemini.
+
+        Uses the native asyncio client when GEMINI_ASYNC is enabled, so waiting on the
+        model costs no thread. Otherwise falls back to the blocking client on the
+        GENERATE pool. Calls are bounded by the adaptive limiter, which backs off when
+        Gemini reports overload. Transient errors are retried with the same document,
+        and a slow call may be hedged.
+
+        Raises:
+            UpstreamUnavailable: If Gemini kept failing or its circuit is open.
+        """
+        if processing_type == ProcessingType.CLAIM:
+            classify_async, classify = self.doc_processor.classify_claim_async, self.doc_processor.classify_claim
+        else:
+            classify_async, classify = self.doc_processor.classify_kyc_async, self.doc_processor.classify_kyc
+
+        async def attempt() -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+            async with self._gemini_slot():
+                with gemini_generate_seconds.time():
+                    if settings.GEMINI_ASYNC:
+                        return await self.engine.run_async(Stage.GENERATE, classify_async, document)
+                    return await self.engine.run(Stage.GENERATE, classify, document)
+
+        return await resilient_call(self.gemini_calls, attempt, hedge=True)
+
+
+    def _gemini_slot(self):
+        if self.limiter is None:
+            return nullcontext()
+        return self.limiter.acquire()
+
+
+    async def _check_duplicate(self, user_id: str, pages: List[PageImage]) -> Tuple[List[str], Dict[str, Fingerprint]]:
+        """
+        Hash the pages of a bill on the PREPROCESS pool and look for earlier bills of the
+        user with similar pages, to be confirmed once the bill is extracted.
+
+        Returns:
+            Tuple[List[str], Dict[str, Fingerprint]]: The hex hashes of the pages, to be stored
+            with the bill, and the candidate earlier bills. Both empty when duplicate detection
+            is disabled or a page could not be hashed.
+        """
+        if self.duplicate_index is None:
+            return [], {}
+        hashes = [await self.engine.run(Stage.PREPROCESS, dhash_page, page) for page in pages]
+        if None in hashes:
+            return [], {}
+        try:
+            candidates = await self.duplicate_index.find(user_id, hashes)
+        except Exception as e:
+            logger.error(f"Failed to look up duplicate bills of user {user_id}: {str(e)}")
+            candidates = {}
+        return [f"{page_hash:016x}" for page_hash in hashes], candidates
+
+
+    async def _verify_claim(self, user_id: str, function_name: str, validated_data: Dict[str, Any], bills: List[BillCreate],
+                            page_hashes: Optional[List[str]] = None, candidates: Optional[Dict[str, Fingerprint]] = None) -> bool:
+        """
+        Verify an extracted bill and add it to bills, to be written with the other bills of the claim.
+        page_hashes are stored with the bill for duplicate detection.
+
+        Returns:
+            bool: The verification status of the bill.
+
+        Raises:
+            DuplicateDocument: If the bill has the date and amount of one of the candidate earlier bills.
+        """
+        try:
+            # Pages of one claim share a single cached read of the patient profile
+            started_at = time.perf_counter()
+            patient_data = await patient_profiles.get(user_id)
+            patient_read_seconds.observe(time.perf_counter() - started_at)
+            bill_create, verification_status = await self.engine.run(
+                Stage.VERIFY, self.doc_processor.build_bill, function_name, validated_data, user_id, patient_data
+            )
+            if candidates:
+                duplicate_of = self.duplicate_index.confirm(candidates, bill_create)
+                if duplicate_of is not None:
+                    raise DuplicateDocument(duplicate_of)
+            bill_create.page_hashes = page_hashes or []
+            bills.append(bill_create)
+            return verification_status
+        except DuplicateDocument:
+            raise
+        except Exception as e:
+            logger.error(f"Error recording {function_name} for user {user_id}: {str(e)}")
+            return False
+
+
+    async def _rasterize_pdf(self, pdf_path: str) -> AsyncIterator[PageImage]:
+        """
+        Render a PDF page by page on the RASTERIZE pool and yield the encoded pages in page order.
+
+        Only a few pages are rendered ahead of the consumer, so processing of page 1 starts
+        while later pages are still rendering and memory stays bounded.
+
+        Raises:
+            ValueError: If the PDF exceeds the configured page or pixel budget.
+        """
+        page_count, page_size = await self.engine.run(Stage.RASTERIZE, get_pdf_info, pdf_path)
+        if page_count > settings.PDF_MAX_PAGES:
+            raise ValueError(f"PDF has {page_count} pages, the maximum is {settings.PDF_MAX_PAGES}")
+        profile = preprocess_profile(DocumentType.PDF)
+        dpi = plan_pdf_dpi(page_size, settings.PDF_DPI, settings.PDF_MAX_PAGE_PIXELS, profile.max_long_edge if profile else None)
+
+        renders = deque()
+        next_page = 1
+        total_pixels = 0
+        try:
+            while next_page <= page_count or renders:
+                while next_page <= page_count and len(renders) < settings.PAGE_FANOUT:
+                    renders.append(asyncio.ensure_future(
+                        self.engine.run(Stage.RASTERIZE, render_pdf_page_to_bytes, pdf_path, next_page, dpi, profile)
+                    ))
+                    next_page += 1
+                page, pixels = await renders.popleft()
+                total_pixels += pixels
+                if total_pixels > settings.PDF_MAX_DOCUMENT_PIXELS:
+                    raise ValueError(f"PDF exceeds the pixel budget of {settings.PDF_MAX_DOCUMENT_PIXELS} pixels")
+                yield page
+        finally:
+            for render in renders:
+                render.cancel()
+
+
+    async def _take_whole_document(self, pages: AsyncIterator[PageImage]) -> Tuple[Optional[List[PageImage]], Optional[AsyncIterator[PageImage]]]:
+        """
+        Read the pages of a document while they fit the whole-document budget
+        (WHOLE_DOCUMENT_MAX_PAGES pages, WHOLE_DOCUMENT_MAX_TOKENS estimated image tokens).
+
+        Returns:
+            Tuple[Optional[List[PageImage]], AsyncIterator[PageImage]]: All the pages if the document
+            has several pages and fits the budget. Otherwise None, and the pages to process one by
+            one, starting with the pages already read.
+        """
+        taken = []
+        tokens = 0
+        try:
+            async for page in pages:
+                taken.append(page)
+                tokens += estimate_image_tokens(page)
+                if len(taken) > settings.WHOLE_DOCUMENT_MAX_PAGES or tokens > settings.WHOLE_DOCUMENT_MAX_TOKENS:
+                    logger.info(f"Document exceeds the whole-document budget after {len(taken)} pages, processing it page by page")
+                    return None, self._chain_pages(taken, pages)
+        except BaseException:
+            await pages.aclose()
+            raise
+        if len(taken) < 2:
+            return None, self._chain_pages(taken, pages)
+        return taken, None
+
+
+    async def _chain_pages(self, taken: List[PageImage], rest: AsyncIterator[PageImage]) -> AsyncIterator[PageImage]:
+        try:
+            for page in taken:
+                yield page
+            async for page in rest:
+                yield page
+        finally:
+            await rest.aclose()
+
+
+    async def _process_pages(self, user_id: str, pages: AsyncIterator[PageImage], processing_type: ProcessingType, fail_fast: bool, bills: Optional[List[BillCreate]] = None) -> List[Any]:
+        """
+        Process the pages of a document concurrently, at most settings.PAGE_FANOUT at a time.
+        Pages are started as soon as they are produced by pages.
+
+        Args:
+            user_id (str): The user ID, required for claim processing.
+            pages (AsyncIterator[PageImage]): The page images, in page order.
+            processing_type (ProcessingType): The type of processing to perform (CLAIM or KYC).
+            fail_fast (bool): Stop as soon as one page returns a falsy result, cancelling the pages still pending.
+            bills (List[BillCreate], optional): Collects the bills built from claim pages.
+
+        Returns:
+            List[Any]: The page results in page order. Cancelled pages are reported as None.
+
+        Raises:
+            Exception: The first error raised while producing or processing a page; the other pages are cancelled.
+        """
+        semaphore = asyncio.Semaphore(settings.PAGE_FANOUT)
+        stop = asyncio.Event()
+
+        async def process_page(page: PageImage) -> Any:
+            async with semaphore:
+                try:
+                    result = await self._process_single_image(user_id, page, processing_type, bills)
+                except Exception:
+                    stop.set()
+                    raise
+                logger.info(f"Processed page: {page.page_number} with status: {bool(result)}")
+                if fail_fast and not result:
+                    stop.set()
+                return result
+
+        tasks = []
+        try:
+            async with aclosing(pages) as page_iterator:
+                async for page in page_iterator:
+                    if stop.is_set():
+                        break
+                    tasks.append(asyncio.create_task(process_page(page)))
+
+            if fail_fast:
+                for next_done in asyncio.as_completed(tasks):
+                    if not await next_done:
+                        break
+            else:
+                await asyncio.gather(*tasks)
+        finally:
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.info(f"Cancelled {len(pending)} remaining page(s)")
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        return [None if task.cancelled() or task.exception() else task.result() for task in tasks]
+
+
+    async def _load_image(self, data: Optional[bytes], image_path: Optional[str]) -> PageImage:
+        """
+        Pre-screen and shrink a photo held in memory (data) or, when it was too large for
+        that, in a temporary file (image_path). A photo in a file is only read into memory
+        once it is shrunk.
+
+        Raises:
+            DocumentRejected: If the photo failed the pre-screen.
+        """
+        thresholds = prescreen_thresholds()
+        profile = preprocess_profile(DocumentType.IMAGE)
+        if image_path is not None:
+            document_bytes.labels(DocumentType.IMAGE.value).observe(os.path.getsize(image_path))
+            if thresholds is not None:
+                reason = await self.engine.run(Stage.PREPROCESS, prescreen_file, image_path, thresholds)
+                if reason is not None:
+                    raise DocumentRejected(reason)
+            return await self.engine.run(Stage.PREPROCESS, preprocess_image_file, image_path, profile)
+
+        page = PageImage(data=data, mime_type=detect_image_mime_type(data, default='image/jpeg'))
+        document_bytes.labels(DocumentType.IMAGE.value).observe(len(data))
+        if thresholds is not None:
+            reason = await self.engine.run(Stage.PREPROCESS, prescreen_page, page, thresholds)
+            if reason is not None:
+                raise DocumentRejected(reason)
+        if profile is not None:
+            page = await self.engine.run(Stage.PREPROCESS, preprocess_page, page, profile)
+        return page
+
+
+    async def _load_pages(self, file_uri: str, document_type: DocumentType) -> AsyncIterator[PageImage]:
+        """
+        Download a document and yield its pages as in-memory images.
+
+        Images up to IN_MEMORY_MAX_BYTES are downloaded straight into memory, larger ones
+        to a temporary file. PDFs are always downloaded to a temporary file because poppler
+        can only rasterize from a path. Temporary files are removed once the pages have
+        been produced. Pages are shrunk with the document type's preprocessing profile
+        before they are yielded. Transient download errors are retried.
+
+        Photos are pre-screened first, so ones that can not be a readable document are
+        rejected without a Gemini call. Rendered PDF pages are not pre-screened.
+
+        Raises:
+            DocumentRejected: If the photo failed the pre-screen.
+        """
+        if document_type == DocumentType.IMAGE:
+            data, image_path = await resilient_call(self.storage_calls, functools.partial(
+                self.engine.run, Stage.DOWNLOAD, download_image_from_storage, file_uri, settings.FIREBASE_STORAGE_BUCKET,
+                settings.IN_MEMORY_MAX_BYTES
+            ))
+            try:
+                page = await self._load_image(data, image_path)
+            finally:
+                if image_path is not None:
+                    try:
+                        os.remove(image_path)
+                    except OSError as e:
+                        logger.warning(f"Failed to remove local file {image_path}: {e}")
+            page_bytes.labels(document_type.value).observe(len(page.data))
+            document_pages.labels(document_type.value).observe(1)
+            yield page
+        elif document_type == DocumentType.PDF:
+            pdf_path = await resilient_call(self.storage_calls, functools.partial(
+                self.engine.run, Stage.DOWNLOAD, download_from_storage, file_uri, settings.FIREBASE_STORAGE_BUCKET
+            ))
+            try:
+                document_bytes.labels(document_type.value).observe(os.path.getsize(pdf_path))
+                page_count = 0
+                async with aclosing(self._rasterize_pdf(pdf_path)) as pages:
+                    async for page in pages:
+                        page_bytes.labels(document_type.value).observe(len(page.data))
+                        page_count += 1
+                        yield page
+                # Documents abandoned part way, once a page failed, are not counted
+                document_pages.labels(document_type.value).observe(page_count)
+            finally:
+                try:
+                    os.remove(pdf_path)
+                except OSError as e:
+                    logger.warning(f"Failed to remove local file {pdf_path}: {e}")
+        else:
+            raise ValueError(f"Unsupported document type: {document_type}")
+
+
+    async def save_bills(self, bills: List[BillCreate]) -> List[str]:
+        """
+        Write the bills of a claim document to Firestore in a single batch.
+
+        Written bills are added to the duplicate index.
+
+        Returns:
+            List[str]: The IDs of the written bills.
+
+        Raises:
+            Exception: If the write failed; none of the bills is stored then.
+        """
+        if not bills:
+            return []
+        bill_ids = await self.engine.run_async(Stage.WRITE, self.doc_processor.save_bills_async, bills)
+        if self.duplicate_index is not None:
+            for bill, bill_id in zip(bills, bill_ids):
+                if bill.page_hashes and bill.status in INDEXED_STATUSES:
+                    self.duplicate_index.add(bill_id, bill)
+        return bill_ids
+
+
+    async def _verify_document(self, user_id: str, file_uri: str, document_type: DocumentType) -> ClaimResult:
+        """
+        Run the claim pipeline on a document and collect its bills without writing them.
+        A multi-page document within the whole-document budget is extracted with one Gemini call.
+
+        Photos that fail the pre-screen are rejected with the reason without a Gemini call.
+        Bills that duplicate an earlier bill of the user are rejected with the reason too,
+        and none of the document's bills is recorded.
+
+        Raises:
+            UpstreamUnavailable: If Gemini or Storage kept failing.
+        """
+        result = ClaimResult(status=False)
+        try:
+            pages, whole_document = self._load_pages(file_uri, document_type), None
+            if settings.WHOLE_DOCUMENT_EXTRACTION:
+                whole_document, pages = await self._take_whole_document(pages)
+            if whole_document is not None:
+                page_hashes, candidates = await self._check_duplicate(user_id, whole_document)
+                # One request for all the pages, so the model sees the bill as a whole
+                function_name, validated_data = await self._extract_pages(whole_document, ProcessingType.CLAIM)
+                logger.info(f"Processed {len(whole_document)} pages as one document with function: {function_name}")
+                if function_name:
+                    result.status = await self._verify_claim(user_id, function_name, validated_data, result.bills, page_hashes, candidates)
+            else:
+                # A claim fails as soon as one page fails, so stop the remaining pages early
+                results = await self._process_pages(user_id, pages, ProcessingType.CLAIM, fail_fast=True, bills=result.bills)
+                result.status = bool(results) and all(results)
+        except UpstreamUnavailable:
+            raise
+        except DocumentRejected as e:
+            logger.info(f"Document {file_uri} rejected: {e.reason}")
+            # Bills of other pages of a rejected document are not recorded
+            result.bills.clear()
+            result.reasoning = e.reason
+            result.outcome = ClaimOutcome.DUPLICATE if isinstance(e, DuplicateDocument) else ClaimOutcome.UNREADABLE
+        except Exception as e:
+            logger.error(f"Error processing file from URI {file_uri}: {str(e)}")
+            result.reasoning = "An error occurred while processing the document"
+
+        if result.reasoning is None:
+            rejected = [bill for bill in result.bills if bill.status != BillStatus.VERIFIED]
+            if rejected:
+                result.reasoning = rejected[0].reasoning
+                result.outcome = ClaimOutcome.REJECTED
+            elif result.status:
+                result.reasoning = result.bills[0].reasoning if result.bills else None
+                result.outcome = ClaimOutcome.VERIFIED
+            else:
+                result.reasoning = "No bill could be extracted from the document"
+                result.outcome = ClaimOutcome.UNRECOGNIZED
+        return result
+
+
+    async def _verify_and_save(self, user_id: str, file_uri: str, document_type: DocumentType) -> ClaimResult:
+        """
+        Verify a claim document and write its bills. This is the unit shared by concurrent
+        verifications of the document, so its result is only published once the bills are stored.
+
+        A failed write is kept in the result instead of raised, so every caller sharing the
+        result, on this instance or another one, fails with it.
+        """
+        result = await self._verify_document(user_id, file_uri, document_type)
+        try:
+            result.bill_ids = await self.save_bills(result.bills)
+        except Exception as e:
+            logger.error(f"Failed to write the bills of {file_uri} for user {user_id}: {str(e)}")
+            result.write_error = str(e) or type(e).__name__
+        return result
+
+
+    async def verify_claim(self, user_id: str, file_uri: str, document_type: DocumentType) -> ClaimResult:
+        """
+        Verify a claim document, write the bills it produced and report its outcome.
+
+        Concurrent requests of the same user for the same document share one run of the
+        pipeline and one write of its bills, so a double submission does not write them
+        twice. If Gemini or Storage kept failing, no bill is recorded, as the document will
+        be submitted again.
+
+        Args:
+            user_id (str): The ID of the user.
+            file_uri (str): The URI of the file.
+            document_type (DocumentType): The type of the document (image or pdf).
+
+        Returns:
+            ClaimResult: The claim status, the IDs the bills were written under, a reason for
+            the status and the outcome, which is counted in the claim_documents metric. The
+            bills themselves are only returned on the instance that wrote them.
+
+        Raises:
+            UpstreamUnavailable: If Gemini or Storage kept failing; the claim was not rejected and can be retried.
+            Exception: If the bills could not be written, so the claim must not be reported as verified.
+        """
+        try:
+            shared = await self.claim_flights.run(
+                f"{user_id}:{document_type.value}:{file_uri}",
+                functools.partial(self._verify_and_save, user_id, file_uri, document_type),
+                encode=ClaimResult.to_shared,
+                decode=ClaimResult.from_shared
+            )
+        except UpstreamUnavailable:
+            record_claim_outcome(ClaimOutcome.UNAVAILABLE)
+            raise
+        if shared.write_error is not None:
+            record_claim_outcome(ClaimOutcome.ERROR)
+            raise Exception(f"Failed to write the bills of {file_uri}: {shared.write_error}")
+        record_claim_outcome(shared.outcome)
+        # Each caller gets its own copy of the shared result
+        return dataclasses.replace(shared, bills=list(shared.bills), bill_ids=list(shared.bill_ids))
+
+
+    async def get_claim_status(self, user_id: str, file_uri: str, document_type: DocumentType) -> bool:
         """
         Process a document from a given URI.
 
@@ -63,30 +699,13 @@ class DocService:
             bool: True if processing was successful, False otherwise.
 
         Raises:
-            Exception: If there's an error during file download or processing.
+            UpstreamUnavailable, Exception: See verify_claim.
         """
-        try:
-            temp_file_path = download_from_storage(file_uri, settings.FIREBASE_STORAGE_BUCKET)
-            
-            if document_type == DocumentType.PDF:
-                path_list = pdf_to_images(temp_file_path)
-                results = []
-                for image_path in path_list:
-                    result = self._process_single_image(user_id, image_path, ProcessingType.CLAIM)
-                    results.append(result)
-                    logger.info(f"Processed image: {image_path} with status: {result}")
-                return all(results)
-            elif document_type == DocumentType.IMAGE:
-                return self._process_single_image(user_id, temp_file_path, ProcessingType.CLAIM)
-            else:
-                logger.error(f"Unsupported document type: {document_type}")
-                return False
-        except Exception as e:
-            logger.error(f"Error processing file from URI {file_uri}: {str(e)}")
-            return False
+        result = await self.verify_claim(user_id, file_uri, document_type)
+        return result.status
 
 
-    def get_kyc_data(self, file_uri: str, document_type: DocumentType) -> Dict[str, Any]:
+    async def get_kyc_data(self, file_uri: str, document_type: DocumentType) -> Dict[str, Any]:
         """
         Process a KYC document from a given URI.
 
@@ -96,21 +715,22 @@ class DocService:
 
         Returns:
             Dict[str, Any]: The extracted data from the document.
+
+        Raises:
+            UpstreamUnavailable: If Gemini or Storage kept failing.
+            DocumentRejected: If the photo failed the pre-screen.
         """
         try:
-            temp_file_path = download_from_storage(file_uri, settings.FIREBASE_STORAGE_BUCKET)
-            
-            if document_type == DocumentType.PDF:
-                image_paths = pdf_to_images(temp_file_path)
-                extracted_data = {}
-                for image_path in image_paths:
-                    page_data = self._process_single_image(None, image_path, ProcessingType.KYC)
-                    extracted_data.update(page_data or {})
-            else:
-                extracted_data = self._process_single_image(None, temp_file_path, ProcessingType.KYC)
-            
+            page_results = await self._process_pages(None, self._load_pages(file_uri, document_type), ProcessingType.KYC, fail_fast=False)
+            # Merge in page order so later pages win deterministically, whatever order they finished in
+            extracted_data = {}
+            for page_data in page_results:
+                extracted_data.update(page_data or {})
+
             logger.info(f"Extracted data : {extracted_data}")
             return extracted_data
+        except (UpstreamUnavailable, DocumentRejected):
+            raise
         except Exception as e:
             logger.error(f"Error processing KYC file: {str(e)}")
-            return {}
\ No newline at end of file
+            return {}
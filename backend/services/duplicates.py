@@ -0,0 +1,217 @@
+import io
+import asyncio
+import functools
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from PIL import Image, ImageOps
+from models.bills import BillCreate, BillStatus
+from utils.helper import PageImage
+from services.repositories import BillRepository
+from services.prescreen import DocumentRejected
+from config.logger import logger
+
+# dHash compares neighbouring pixels of a 9x8 thumbnail, giving 64 bits
+DHASH_SIZE = 8
+
+# Bills whose pages are indexed; rejected bills may be resubmitted
+INDEXED_STATUSES = (BillStatus.VERIFIED.value, BillStatus.PENDING.value)
+
+# What a candidate must share with the new bill to be its duplicate: bill day and amount
+Fingerprint = Tuple[str, float]
+
+
+def fingerprint(date: datetime, amount: float) -> Fingerprint:
+    return date.date().isoformat(), round(float(amount), 2)
+
+
+class DuplicateDocument(DocumentRejected):
+    """A claim document duplicates a bill the patient submitted before."""
+
+    def __init__(self, bill_id: str):
+        super().__init__(f"This bill looks like a duplicate of bill {bill_id} submitted earlier")
+        self.bill_id = bill_id
+
+
+def dhash_page(page: PageImage) -> Optional[int]:
+    """
+    Compute the 64-bit difference hash of a page image. Photos of the same page taken
+    from a slightly different angle or distance, or re-encoded, hash a few bits apart.
+
+    Returns:
+        Optional[int]: The hash, or None if the image can not be decoded.
+    """
+    try:
+        with Image.open(io.BytesIO(page.data)) as image:
+            image.draft('L', (DHASH_SIZE * 16, DHASH_SIZE * 16))
+            gray = ImageOps.exif_transpose(image).convert('L')
+    except Exception as e:
+        logger.warning(f"Failed to hash page {page.page_number}: {e}")
+        return None
+    pixels = list(gray.resize((DHASH_SIZE + 1, DHASH_SIZE), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(DHASH_SIZE):
+        for column in range(DHASH_SIZE):
+            offset = row * (DHASH_SIZE + 1) + column
+            value = (value << 1) | (pixels[offset] > pixels[offset + 1])
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """
+    BK-tree of 64-bit hashes under the Hamming distance. A search only descends into the
+    children whose distance to the node is within max_distance of the query's, so it
+    touches a small part of the tree.
+    """
+
+    def __init__(self):
+        # Node: (hash, items with that hash, children by distance)
+        self._root: Optional[Tuple[int, List[Any], Dict[int, Any]]] = None
+        self.size = 0
+
+    def add(self, value: int, item: Any):
+        self.size += 1
+        if self._root is None:
+            self._root = (value, [item], {})
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, [item], {})
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """Return the (distance, item) pairs of the hashes within max_distance of value."""
+        matches = []
+        nodes = [self._root] if self._root is not None else []
+        while nodes:
+            node_value, items, children = nodes.pop()
+            distance = hamming_distance(value, node_value)
+            if distance <= max_distance:
+                matches.extend((distance, item) for item in items)
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    nodes.append(child)
+        return matches
+
+
+class DuplicateIndex:
+    """
+    Per-patient index of the page hashes of their verified and pending bills, used to
+    spot a bill that is submitted again.
+
+    Page hashes capture the layout of a page more than its content, so bills printed on
+    the same template (weekly bills of one pharmacy) hash a few bits apart. A hash match
+    only makes an earlier bill a candidate, before the Gemini call; the new bill is a
+    duplicate once its extracted date and amount match the candidate's too.
+
+    A patient's index is read from Firestore on first use, kept in an LRU of max_patients,
+    and updated as new bills are written.
+    """
+
+    def __init__(self, repository: BillRepository, max_patients: int, max_distance: int):
+        self.repository = repository
+        self.max_patients = max_patients
+        self.max_distance = max_distance
+        self._trees: "OrderedDict[str, BKTree]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._added_while_loading: Dict[str, List[Tuple[str, BillCreate]]] = {}
+        self.loads = 0
+        self.lookups = 0
+        self.candidates = 0
+        self.duplicates = 0
+
+    async def find(self, patient_id: str, page_hashes: List[Optional[int]]) -> Dict[str, Fingerprint]:
+        """
+        Return the earlier bills of the patient with a similar page for every given page,
+        as the fingerprints of their date and amount by bill ID. Pages that could not be
+        hashed never match.
+
+        Raises:
+            Exception: If the patient's bills could not be read.
+        """
+        if not page_hashes or None in page_hashes:
+            return {}
+        self.lookups += 1
+        tree = await self._tree(patient_id)
+        candidates: Optional[Dict[str, Fingerprint]] = None
+        for page_hash in page_hashes:
+            matches = dict(item for _, item in tree.search(page_hash, self.max_distance))
+            candidates = matches if candidates is None else {bill_id: candidates[bill_id] for bill_id in candidates.keys() & matches.keys()}
+            if not candidates:
+                return {}
+        self.candidates += 1
+        return candidates
+
+    def confirm(self, candidates: Dict[str, Fingerprint], bill: BillCreate) -> Optional[str]:
+        """Return the ID of the candidate with the same date and amount as bill, or None."""
+        matches = sorted(bill_id for bill_id, candidate in candidates.items() if candidate == fingerprint(bill.date, bill.amount))
+        if not matches:
+            return None
+        self.duplicates += 1
+        return matches[0]
+
+    def add(self, bill_id: str, bill: BillCreate):
+        """Index the pages of a bill that was just written."""
+        if bill.patient_id in self._trees:
+            self._index(self._trees[bill.patient_id], bill_id, bill.page_hashes, fingerprint(bill.date, bill.amount))
+        elif bill.patient_id in self._loading:
+            # The read in flight may have missed this bill
+            self._added_while_loading.setdefault(bill.patient_id, []).append((bill_id, bill))
+
+    @staticmethod
+    def _index(tree: BKTree, bill_id: str, page_hashes: List[str], bill_fingerprint: Fingerprint):
+        for page_hash in page_hashes:
+            tree.add(int(page_hash, 16), (bill_id, bill_fingerprint))
+
+    async def _tree(self, patient_id: str) -> BKTree:
+        tree = self._trees.get(patient_id)
+        if tree is not None:
+            self._trees.move_to_end(patient_id)
+            return tree
+        load = self._loading.get(patient_id)
+        if load is None:
+            load = asyncio.ensure_future(self._load(patient_id))
+            self._loading[patient_id] = load
+            load.add_done_callback(functools.partial(self._loaded, patient_id))
+            self.loads += 1
+        return await asyncio.shield(load)
+
+    async def _load(self, patient_id: str) -> BKTree:
+        tree = BKTree()
+        for bill in await self.repository.list_page_hashes(patient_id):
+            if bill.get('status') in INDEXED_STATUSES and bill.get('date') is not None and bill.get('amount') is not None:
+                self._index(tree, bill['id'], bill.get('page_hashes') or [], fingerprint(bill['date'], bill['amount']))
+        return tree
+
+    def _loaded(self, patient_id: str, load: asyncio.Future):
+        del self._loading[patient_id]
+        added = self._added_while_loading.pop(patient_id, [])
+        if load.cancelled() or load.exception() is not None:
+            return
+        tree = load.result()
+        self._trees[patient_id] = tree
+        for bill_id, bill in added:
+            self._index(tree, bill_id, bill.page_hashes, fingerprint(bill.date, bill.amount))
+        while len(self._trees) > self.max_patients:
+            self._trees.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "patients": len(self._trees),
+            "hashes": sum(tree.size for tree in self._trees.values()),
+            "loads": self.loads,
+            "lookups": self.lookups,
+            "candidates": self.candidates,
+            "duplicates": self.duplicates,
+        }
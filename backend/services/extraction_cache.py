@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from config.logger import logger
+
+CachedExtraction = Tuple[str, Dict[str, Any]]
+
+# The persistent store is pruned of expired and overflowing entries every N writes
+PRUNE_EVERY_WRITES = 256
+
+
+class ExtractionCache:
+    """
+    Content-addressed cache of Gemini extractions, keyed by the SHA-256 of the page bytes.
+
+    Entries hold the function name chosen by the model and the validated extracted data.
+    Lookups go through an in-process LRU first and then an optional sqlite store that
+    survives restarts. Both tiers expire entries after ttl_seconds. The store is not
+    encrypted, so entries holding personal data are kept in memory only.
+
+    All methods are blocking and thread-safe; call them from an executor.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int, db_path: Optional[str] = None, max_stored_entries: int = 100_000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_stored_entries = max_stored_entries
+        self._memory: "OrderedDict[str, Tuple[float, CachedExtraction]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._writes_since_prune = 0
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS extractions ("
+                "key TEXT PRIMARY KEY, function_name TEXT NOT NULL, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS extractions_expires_at ON extractions (expires_at)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(namespace: str, content_hash: str) -> str:
+        """
+        Build the cache key of a page from the SHA-256 of its bytes. The namespace
+        separates extractions done with different prompts or models for the same bytes.
+        """
+        return f"{namespace}:{content_hash}"
+
+    def get(self, key: str) -> Optional[CachedExtraction]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return value[0], dict(value[1])
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT function_name, data, expires_at FROM extractions WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[2] > now:
+                    value = (row[0], json.loads(row[1]))
+                    self._remember(key, row[2], value)
+                    self.store_hits += 1
+                    return value[0], dict(value[1])
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, function_name: str, data: Dict[str, Any], persist: bool = True):
+        """Cache an extraction. With persist=False it is not written to the sqlite store."""
+        expires_at = time.time() + self.ttl_seconds
+        value = (function_name, dict(data))
+        with self._lock:
+            self._remember(key, expires_at, value)
+            if self._db is not None and persist:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO extractions (key, function_name, data, expires_at) VALUES (?, ?, ?, ?)",
+                        (key, function_name, json.dumps(data), expires_at)
+                    )
+                    self._writes_since_prune += 1
+                    if self._writes_since_prune >= PRUNE_EVERY_WRITES:
+                        self._prune_store()
+                        self._writes_since_prune = 0
+                    self._db.commit()
+                except (sqlite3.Error, TypeError, ValueError) as e:
+                    logger.warning(f"Failed to persist extraction cache entry: {str(e)}")
+
+    def delete_stored(self, key_pattern: str) -> int:
+        """Delete the stored entries whose key matches the SQL LIKE pattern. Returns how many were deleted."""
+        with self._lock:
+            if self._db is None:
+                return 0
+            deleted = self._db.execute("DELETE FROM extractions WHERE key LIKE ?", (key_pattern,)).rowcount
+            self._db.commit()
+            return deleted
+
+    def _remember(self, key: str, expires_at: float, value: CachedExtraction):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _prune_store(self):
+        self._db.execute("DELETE FROM extractions WHERE expires_at <= ?", (time.time(),))
+        self._db.execute(
+            "DELETE FROM extractions WHERE key NOT IN "
+            "(SELECT key FROM extractions ORDER BY expires_at DESC LIMIT ?)",
+            (self.max_stored_entries,)
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.store_hits + self.misses
+        return {
+            "entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": (self.memory_hits + self.store_hits) / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,167 @@
+import time
+import asyncio
+import functools
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from utils.helper import PageImage, upload_page_to_gemini, delete_from_gemini
+from services.pipeline import ExecutionEngine, Stage
+from services.resilience import ResilientCaller, resilient_call
+from config.logger import logger
+
+# Gemini keeps uploaded files for 48 hours
+DEFAULT_FILE_TTL_SECONDS = 48 * 3600
+
+
+@dataclass
+class RegisteredFile:
+    handle: Any
+    expires_at: float
+    ref_count: int = 0
+    released_at: float = 0.0
+
+
+class GeminiFileRegistry:
+    """
+    Tracks the files uploaded to the Gemini File API by page content hash.
+
+    Identical pages reuse the uploaded file until it is close to expiry instead of
+    being uploaded again. Files no longer in use are kept for retention_seconds so
+    retries can reuse them, then deleted in batches by a background task.
+    """
+
+    def __init__(self, engine: ExecutionEngine, retention_seconds: int, expiry_margin_seconds: int,
+                 cleanup_interval_seconds: int, delete_batch_size: int, caller: ResilientCaller = None):
+        self.engine = engine
+        self.caller = caller
+        self.retention_seconds = retention_seconds
+        self.expiry_margin_seconds = expiry_margin_seconds
+        self.cleanup_interval_seconds = cleanup_interval_seconds
+        self.delete_batch_size = delete_batch_size
+        self._files: Dict[str, RegisteredFile] = {}
+        self._uploads: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[str, int] = {}
+        self._cleanup_task: Optional[asyncio.Task] = None
+        self.uploads = 0
+        self.reuses = 0
+        self.deleted = 0
+
+    def start(self):
+        """Start the background cleanup task."""
+        if self._cleanup_task is None:
+            self._cleanup_task = asyncio.get_running_loop().create_task(self._cleanup_loop())
+
+    async def acquire(self, page: PageImage) -> Any:
+        """
+        Return an uploaded Gemini file for the page, uploading it only if no usable
+        file with the same content exists. Every acquire must be paired with a release.
+
+        Raises:
+            Exception: If the upload failed.
+        """
+        key = page.content_hash
+        registered = self._files.get(key)
+        if registered is not None and registered.expires_at - time.time() > self.expiry_margin_seconds:
+            registered.ref_count += 1
+            self.reuses += 1
+            return registered.handle
+
+        # Concurrent requests for the same content share one upload
+        upload = self._uploads.get(key)
+        if upload is None:
+            upload = asyncio.ensure_future(self._upload(key, page))
+            self._uploads[key] = upload
+            upload.add_done_callback(lambda _: self._uploads.pop(key, None))
+        else:
+            self.reuses += 1
+        # Waiters keep the file from being collected before they take their reference
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            registered = await asyncio.shield(upload)
+            registered.ref_count += 1
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+        return registered.handle
+
+    def release(self, page: PageImage, handle: Any):
+        """
+        Give back a file returned by acquire. A file that has since been replaced by a new
+        upload of the same page is left to expire; the new file's references are untouched.
+        """
+        registered = self._files.get(page.content_hash)
+        if registered is None or registered.handle.name != handle.name:
+            return
+        registered.ref_count = max(0, registered.ref_count - 1)
+        if registered.ref_count == 0:
+            registered.released_at = time.time()
+
+    async def _upload(self, key: str, page: PageImage) -> RegisteredFile:
+        handle = await resilient_call(self.caller, functools.partial(self.engine.run, Stage.UPLOAD, upload_page_to_gemini, page))
+        if handle is None:
+            raise Exception(f"Failed to upload page {page.page_number} to Gemini")
+        self.uploads += 1
+
+        expiration_time = getattr(handle, "expiration_time", None)
+        if isinstance(expiration_time, datetime):
+            if expiration_time.tzinfo is None:
+                expiration_time = expiration_time.replace(tzinfo=timezone.utc)
+            expires_at = expiration_time.timestamp()
+        else:
+            expires_at = time.time() + DEFAULT_FILE_TTL_SECONDS
+
+        # A replaced file that is still in use is left to expire on the Gemini side
+        previous = self._files.get(key)
+        registered = RegisteredFile(handle=handle, expires_at=expires_at, released_at=time.time())
+        self._files[key] = registered
+        if previous is not None and previous.ref_count == 0:
+            await self._delete([previous.handle.name])
+        return registered
+
+    def _collect_idle(self, force: bool = False) -> List[str]:
+        now = time.time()
+        names = []
+        for key, registered in list(self._files.items()):
+            if registered.ref_count > 0 or key in self._waiters:
+                continue
+            idle = now - registered.released_at >= self.retention_seconds
+            expiring = registered.expires_at - now <= self.expiry_margin_seconds
+            if force or idle or expiring:
+                names.append(registered.handle.name)
+                del self._files[key]
+        return names
+
+    async def _delete(self, names: List[str]):
+        for start in range(0, len(names), self.delete_batch_size):
+            batch = names[start:start + self.delete_batch_size]
+            self.deleted += await self.engine.run(Stage.UPLOAD, delete_from_gemini, batch)
+
+    async def _cleanup_loop(self):
+        while True:
+            await asyncio.sleep(self.cleanup_interval_seconds)
+            try:
+                names = self._collect_idle()
+                if names:
+                    await self._delete(names)
+            except Exception as e:
+                logger.error(f"Gemini file cleanup failed: {str(e)}")
+
+    async def close(self):
+        """Stop the cleanup task and delete every file that is not in use."""
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+            await asyncio.gather(self._cleanup_task, return_exceptions=True)
+            self._cleanup_task = None
+        names = self._collect_idle(force=True)
+        if names:
+            await self._delete(names)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "files": len(self._files),
+            "in_use": sum(1 for registered in self._files.values() if registered.ref_count > 0),
+            "uploads": self.uploads,
+            "reuses": self.reuses,
+            "deleted": self.deleted,
+        }
@@ -0,0 +1,106 @@
+import json
+import time
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+from fastapi.encoders import jsonable_encoder
+from models.hospital import Hospital
+from services.repositories import HospitalRepository
+from config.logger import logger
+
+
+@dataclass
+class DirectorySnapshot:
+    # Pre-serialized JSON bodies and their strong ETags
+    list_body: bytes
+    list_etag: str
+    hospitals: Dict[str, Tuple[bytes, str]]
+    loaded_at: float
+
+
+def _serialize(content: Any) -> Tuple[bytes, str]:
+    body = json.dumps(jsonable_encoder(content), separators=(",", ":")).encode()
+    return body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+class HospitalDirectory:
+    """
+    Process-wide snapshot of the hospitals collection, served without touching Firestore.
+
+    The collection is read once at startup and then every refresh_seconds in the
+    background; the list and every hospital are kept as ready-to-send JSON bytes.
+    If a refresh fails, the previous snapshot keeps being served.
+    """
+
+    def __init__(self, repository: HospitalRepository, refresh_seconds: int):
+        self.repository = repository
+        self.refresh_seconds = refresh_seconds
+        self._snapshot: Optional[DirectorySnapshot] = None
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.refreshes = 0
+        self.failed_refreshes = 0
+
+    def start(self):
+        """Load the directory and keep it fresh in the background."""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    async def refresh(self):
+        """
+        Reload the hospitals collection and swap in a new snapshot.
+
+        Raises:
+            Exception: If the hospitals could not be read.
+        """
+        async with self._refresh_lock:
+            hospitals_data = await self.repository.list_hospitals()
+            hospitals = {hospital['id']: Hospital(**hospital) for hospital in hospitals_data}
+            list_body, list_etag = _serialize(list(hospitals.values()))
+            self._snapshot = DirectorySnapshot(
+                list_body=list_body,
+                list_etag=list_etag,
+                hospitals={hospital_id: _serialize(hospital) for hospital_id, hospital in hospitals.items()},
+                loaded_at=time.time()
+            )
+            self.refreshes += 1
+        logger.info(f"Hospital directory loaded with {len(hospitals)} hospitals")
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.failed_refreshes += 1
+                logger.error(f"Failed to refresh the hospital directory: {str(e)}")
+            await asyncio.sleep(self.refresh_seconds)
+
+    async def snapshot(self) -> DirectorySnapshot:
+        """
+        Return the current snapshot, loading it first if the startup load has not finished or failed.
+
+        Raises:
+            Exception: If there is no snapshot and the hospitals could not be read.
+        """
+        if self._snapshot is None:
+            async with self._refresh_lock:
+                pass
+            if self._snapshot is None:
+                await self.refresh()
+        return self._snapshot
+
+    async def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            "hospitals": len(snapshot.hospitals) if snapshot else 0,
+            "loaded_at": snapshot.loaded_at if snapshot else None,
+            "refreshes": self.refreshes,
+            "failed_refreshes": self.failed_refreshes,
+        }
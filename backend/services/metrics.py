@@ -0,0 +1,98 @@
+from enum import Enum
+from prometheus_client import CollectorRegistry, Counter, Histogram, ProcessCollector
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+# Metrics of this process, served on /metrics. Each worker process serves its own.
+registry = CollectorRegistry()
+ProcessCollector(registry=registry)
+
+# From a cached sqlite read to a slow Gemini call
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+PAGE_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+BYTE_BUCKETS = (32_000, 64_000, 128_000, 256_000, 512_000, 1_000_000, 2_000_000, 4_000_000, 8_000_000, 16_000_000, 32_000_000)
+
+
+class ClaimOutcome(str, Enum):
+    """
+    How the verification of one claim document ended.
+    """
+    VERIFIED = "verified"
+    REJECTED = "rejected"
+    UNRECOGNIZED = "unrecognized"
+    UNREADABLE = "unreadable"
+    DUPLICATE = "duplicate"
+    ERROR = "error"
+    UNAVAILABLE = "unavailable"
+    TIMEOUT = "timeout"
+
+
+stage_seconds = Histogram(
+    'pipeline_stage_seconds', 'Duration of the calls run on each pipeline stage, waiting for a worker included',
+    ['stage'], buckets=LATENCY_BUCKETS, registry=registry
+)
+gemini_generate_seconds = Histogram(
+    'gemini_generate_seconds', 'Duration of the Gemini generate_content calls, once a concurrency slot is held',
+    buckets=LATENCY_BUCKETS, registry=registry
+)
+patient_read_seconds = Histogram(
+    'claim_patient_read_seconds', 'Time to get the patient profile a bill is verified against, cache hits included',
+    buckets=LATENCY_BUCKETS, registry=registry
+)
+claim_outcomes = Counter(
+    'claim_documents', 'Claim documents verified, by outcome', ['outcome'], registry=registry
+)
+document_pages = Histogram(
+    'document_pages', 'Pages per processed document', ['document_type'], buckets=PAGE_COUNT_BUCKETS, registry=registry
+)
+document_bytes = Histogram(
+    'document_bytes', 'Size of the documents downloaded from Storage', ['document_type'], buckets=BYTE_BUCKETS, registry=registry
+)
+page_bytes = Histogram(
+    'page_bytes', 'Size of the page images sent to Gemini, after preprocessing', ['document_type'], buckets=BYTE_BUCKETS, registry=registry
+)
+
+# Every outcome is exported from the start, so rates over them are defined
+for outcome in ClaimOutcome:
+    claim_outcomes.labels(outcome.value)
+
+
+def record_claim_outcome(outcome: ClaimOutcome):
+    claim_outcomes.labels(outcome.value).inc()
+
+
+class PipelineCollector(Collector):
+    """
+    Exports the load of the pipeline (stage queues, Gemini limiter, claim jobs and flights)
+    as gauges read from the stats of the services at scrape time, so the hot path does
+    no extra work for them.
+    """
+
+    def __init__(self, engine, limiter, claim_jobs, claim_flights):
+        self.engine = engine
+        self.limiter = limiter
+        self.claim_jobs = claim_jobs
+        self.claim_flights = claim_flights
+
+    def collect(self):
+        stage_gauges = {
+            "max_workers": GaugeMetricFamily('pipeline_stage_workers', 'Workers of each stage pool', labels=['stage']),
+            "in_flight": GaugeMetricFamily('pipeline_stage_in_flight', 'Calls submitted to each stage pool and not finished', labels=['stage']),
+            "queue_depth": GaugeMetricFamily('pipeline_stage_queue_depth', 'Calls waiting for a free worker of each stage pool', labels=['stage']),
+            "async_in_flight": GaugeMetricFamily('pipeline_stage_async_in_flight', 'Coroutines accounted to each stage in flight', labels=['stage']),
+        }
+        failures = CounterMetricFamily('pipeline_stage_failures', 'Calls of each stage that raised', labels=['stage'])
+        for stage, stats in self.engine.stats().items():
+            for key, gauge in stage_gauges.items():
+                gauge.add_metric([stage], stats[key])
+            failures.add_metric([stage], stats["failed"])
+        yield from stage_gauges.values()
+        yield failures
+
+        limiter = self.limiter.stats()
+        yield GaugeMetricFamily('gemini_concurrency_limit', 'Current adaptive limit of concurrent Gemini calls', value=limiter["limit"])
+        yield GaugeMetricFamily('gemini_concurrency_in_flight', 'Gemini calls holding a concurrency slot', value=limiter["in_flight"])
+        yield GaugeMetricFamily('gemini_concurrency_waiting', 'Gemini calls waiting for a concurrency slot', value=limiter["waiting"])
+
+        yield GaugeMetricFamily('claim_jobs_running', 'Queued claim jobs being processed', value=self.claim_jobs.stats()["running"])
+        yield GaugeMetricFamily('claim_flights_in_flight', 'Distinct claim documents being verified', value=self.claim_flights.stats()["in_flight"])
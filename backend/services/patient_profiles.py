@@ -0,0 +1,79 @@
+import copy
+import time
+import asyncio
+import functools
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from services.repositories import PatientRepository, patients
+from config.settings import settings
+
+
+class PatientProfileCache:
+    """
+    Read-through LRU cache of patient documents with a TTL.
+
+    Concurrent misses for the same patient share one Firestore read, and a read that
+    is in flight when the patient is invalidated is not cached. Callers get a copy
+    of the cached document.
+    """
+
+    def __init__(self, repository: PatientRepository, max_entries: int, ttl_seconds: int):
+        self.repository = repository
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+
+    async def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the patient document, reading it from Firestore on a miss.
+
+        Returns:
+            Optional[Dict[str, Any]]: The patient data, or None if the patient does not exist.
+
+        Raises:
+            Exception: If the Firestore read failed.
+        """
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            expires_at, patient = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return copy.deepcopy(patient)
+            del self._entries[user_id]
+        self.misses += 1
+
+        load = self._pending.get(user_id)
+        if load is None:
+            load = asyncio.ensure_future(self.repository.get_patient(user_id))
+            self._pending[user_id] = load
+            load.add_done_callback(functools.partial(self._loaded, user_id))
+            self.loads += 1
+        patient = await asyncio.shield(load)
+        return copy.deepcopy(patient)
+
+    def _loaded(self, user_id: str, load: asyncio.Future):
+        # A load replaced or dropped by invalidate() must not repopulate the cache
+        if self._pending.get(user_id) is not load:
+            return
+        del self._pending[user_id]
+        if load.cancelled() or load.exception() is not None or load.result() is None:
+            return
+        self._entries[user_id] = (time.monotonic() + self.ttl_seconds, load.result())
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str):
+        self._entries.pop(user_id, None)
+        self._pending.pop(user_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "loads": self.loads}
+
+
+patient_profiles = PatientProfileCache(patients, settings.PATIENT_CACHE_MAX_ENTRIES, settings.PATIENT_CACHE_TTL_SECONDS)
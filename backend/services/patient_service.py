@@ -2,11 +2,12 @@ from models.patients import PatientCreate
 from typing import Dict
 import re
 from datetime import date
-from utils.helper import add_data_to_firestore
+from services.repositories import patients
+from services.patient_profiles import patient_profiles
 from config.logger import logger
 
 class PatientService:
-    def add_patient(self, patient_data: PatientCreate, user_id: str) -> str:
+    async def add_patient(self, patient_data: PatientCreate, user_id: str) -> str:
         """
         Add a new patient to Firestore.
 
@@ -20,7 +21,6 @@ class PatientService:
         Raises:
         Exception: If failed to add patient to Firestore.
         """
-        collection_path = "patients"
         patient_dict = patient_data.model_dump()
         
         # Convert date of birth to ISO format string
@@ -32,7 +32,13 @@ class PatientService:
         # Set the id to the user_id from the token
         patient_dict['id'] = user_id
         
-        patient_id = add_data_to_firestore(patient_dict, collection_path, document_id=user_id)
+        try:
+            patient_id = await patients.save_patient(user_id, patient_dict)
+        except Exception as e:
+            logger.error(f"An error occurred while adding data to Firestore: {str(e)}")
+            patient_id = None
+        finally:
+            patient_profiles.invalidate(user_id)
         
         if patient_id:
             logger.info(f"Patient added with ID: {patient_id}")
@@ -0,0 +1,162 @@
+import time
+import asyncio
+import functools
+import multiprocessing
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from config.settings import settings
+from services.metrics import stage_seconds
+from config.logger import logger
+
+
+class Stage(str, Enum):
+    """
+    Stages of the document pipeline, in execution order.
+    """
+    DOWNLOAD = "download"
+    RASTERIZE = "rasterize"
+    PREPROCESS = "preprocess"
+    CACHE = "cache"
+    UPLOAD = "upload"
+    GENERATE = "generate"
+    VERIFY = "verify"
+    WRITE = "write"
+
+
+# CPU-bound stages run on processes, everything else is I/O bound and runs on threads
+PROCESS_STAGES = {Stage.RASTERIZE, Stage.PREPROCESS}
+
+# Process workers start from a fresh interpreter: forking the server would copy its threads
+# and its gRPC (Firestore, Gemini) state, which can deadlock the child
+PROCESS_START_METHOD = "spawn"
+
+
+def stage_pool_sizes() -> Dict[Stage, int]:
+    return {
+        Stage.DOWNLOAD: settings.DOWNLOAD_POOL_MAX_WORKERS,
+        Stage.RASTERIZE: settings.RASTERIZE_POOL_MAX_WORKERS,
+        Stage.PREPROCESS: settings.PREPROCESS_POOL_MAX_WORKERS,
+        Stage.CACHE: settings.CACHE_POOL_MAX_WORKERS,
+        Stage.UPLOAD: settings.UPLOAD_POOL_MAX_WORKERS,
+        Stage.GENERATE: settings.GENERATE_POOL_MAX_WORKERS,
+        Stage.VERIFY: settings.VERIFY_POOL_MAX_WORKERS,
+        Stage.WRITE: settings.WRITE_POOL_MAX_WORKERS,
+    }
+
+
+class StageExecutor:
+    """
+    A dedicated, sized executor for one pipeline stage that keeps track of its load.
+    """
+
+    def __init__(self, stage: Stage, max_workers: int):
+        self.stage = stage
+        self.max_workers = max_workers
+        if stage in PROCESS_STAGES:
+            self.executor: Executor = ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=multiprocessing.get_context(PROCESS_START_METHOD)
+            )
+        else:
+            self.executor: Executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"stage-{stage.value}")
+        self.in_flight = 0
+        self.async_in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self._seconds = stage_seconds.labels(stage.value)
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of submitted calls still waiting for a free worker."""
+        return max(0, self.in_flight - self.max_workers)
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        started_at = time.perf_counter()
+        try:
+            result = await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+            self.completed += 1
+            self._seconds.observe(time.perf_counter() - started_at)
+            return result
+        except asyncio.CancelledError:
+            raise
+        except BaseException:
+            self.failed += 1
+            self._seconds.observe(time.perf_counter() - started_at)
+            raise
+        finally:
+            self.in_flight -= 1
+
+    async def run_async(self, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """Await a native coroutine on the event loop while accounting it to this stage."""
+        self.async_in_flight += 1
+        started_at = time.perf_counter()
+        try:
+            result = await fn(*args, **kwargs)
+            self.completed += 1
+            self._seconds.observe(time.perf_counter() - started_at)
+            return result
+        except asyncio.CancelledError:
+            raise
+        except BaseException:
+            self.failed += 1
+            self._seconds.observe(time.perf_counter() - started_at)
+            raise
+        finally:
+            self.async_in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "kind": "process" if self.stage in PROCESS_STAGES else "thread",
+            "max_workers": self.max_workers,
+            "in_flight": self.in_flight,
+            "running": min(self.in_flight, self.max_workers),
+            "queue_depth": self.queue_depth,
+            "async_in_flight": self.async_in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+class ExecutionEngine:
+    """
+    Runs the blocking steps of the document pipeline
+    (Storage download -> PDF rasterize -> image preprocess -> extraction cache -> Gemini upload -> generate -> verify -> Firestore write)
+    on per-stage pools so a slow stage cannot starve the others.
+    """
+
+    def __init__(self, pool_sizes: Dict[Stage, int] = None):
+        pool_sizes = pool_sizes or stage_pool_sizes()
+        self.stages: Dict[Stage, StageExecutor] = {
+            stage: StageExecutor(stage, pool_sizes[stage]) for stage in Stage
+        }
+        sizes = {stage.value: size for stage, size in pool_sizes.items()}
+        logger.info(f"Execution engine started with pool sizes: {sizes}")
+
+    async def run(self, stage: Stage, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run a blocking callable on the pool of the given stage.
+
+        Callables for process-backed stages must be picklable (module-level functions)
+        and their modules must import cleanly in a fresh interpreter.
+        """
+        return await self.stages[stage].run(fn, *args, **kwargs)
+
+    async def run_async(self, stage: Stage, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        Await a coroutine function on the event loop, counted against the given stage
+        but without holding a worker of its pool.
+        """
+        return await self.stages[stage].run_async(fn, *args, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {stage.value: executor.stats() for stage, executor in self.stages.items()}
+
+    def shutdown(self, wait: bool = True):
+        for executor in self.stages.values():
+            executor.shutdown(wait=wait)
+        logger.info("Execution engine shut down")
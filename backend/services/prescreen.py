@@ -0,0 +1,94 @@
+import io
+from dataclasses import dataclass
+from typing import Optional
+from PIL import Image, ImageFilter, ImageOps, ImageStat
+from utils.helper import PageImage
+from config.logger import logger
+
+# Long edge the checks run at; decoding a phone photo at full size would cost more than the checks
+ANALYSIS_LONG_EDGE = 1024
+
+# Laplacian kernel, offset so negative responses are not clipped away
+LAPLACIAN = ImageFilter.Kernel((3, 3), [0, 1, 0, 1, -4, 1, 0, 1, 0], scale=1, offset=128)
+
+# Gray level change between neighbouring pixels counted as an edge by the text density check
+EDGE_THRESHOLD = 48
+
+
+class DocumentRejected(Exception):
+    """A document was rejected before processing; reason is worded for the user."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+@dataclass(frozen=True)
+class PrescreenThresholds:
+    """
+    Limits outside which a photo is rejected before it is sent to Gemini.
+    """
+    min_short_edge: int
+    max_aspect_ratio: float
+    min_brightness: float
+    max_brightness: float
+    min_contrast: float
+    min_sharpness: float
+    min_text_density: float
+
+
+def prescreen_page(page: PageImage, thresholds: PrescreenThresholds) -> Optional[str]:
+    """
+    Check that a photo can plausibly be read as a document, with cheap local image statistics.
+
+    Runs on the CPU only and takes a few milliseconds. Images that can not be decoded
+    here are let through, as Gemini may still read them.
+
+    Returns:
+        Optional[str]: Why the photo is rejected, worded for the user, or None if it passes.
+    """
+    return _prescreen(io.BytesIO(page.data), thresholds, f"page {page.page_number}")
+
+
+def prescreen_file(image_path: str, thresholds: PrescreenThresholds) -> Optional[str]:
+    """
+    Pre-screen a photo kept in a file, like prescreen_page, without reading the whole file into memory.
+    """
+    return _prescreen(image_path, thresholds, image_path)
+
+
+def _prescreen(source, thresholds: PrescreenThresholds, name: str) -> Optional[str]:
+    try:
+        with Image.open(source) as image:
+            width, height = image.size
+            if min(width, height) < thresholds.min_short_edge:
+                return f"The photo resolution is too low ({width}x{height}). Please take the photo closer to the document."
+            if max(width, height) / min(width, height) > thresholds.max_aspect_ratio:
+                return "The photo is too narrow to be a document. Please photograph the whole document."
+            # JPEGs are decoded at a reduced scale straight away
+            image.draft('L', (ANALYSIS_LONG_EDGE, ANALYSIS_LONG_EDGE))
+            gray = ImageOps.exif_transpose(image).convert('L')
+    except Exception as e:
+        logger.warning(f"Failed to pre-screen {name}, letting it through: {e}")
+        return None
+    gray.thumbnail((ANALYSIS_LONG_EDGE, ANALYSIS_LONG_EDGE))
+
+    stats = ImageStat.Stat(gray)
+    brightness, contrast = stats.mean[0], stats.stddev[0]
+    if brightness < thresholds.min_brightness:
+        return "The photo is too dark. Please retake it in better light."
+    if contrast < thresholds.min_contrast:
+        return "The photo looks blank. Please photograph the document."
+    if brightness > thresholds.max_brightness:
+        return "The photo is overexposed. Please retake it without flash or direct light."
+
+    sharpness = ImageStat.Stat(gray.filter(LAPLACIAN)).var[0]
+    if sharpness < thresholds.min_sharpness:
+        return "The photo is too blurry. Please hold the camera steady and retake it."
+
+    # Printed text shows up as many short, sharp edges
+    edges = gray.filter(ImageFilter.FIND_EDGES).point(lambda value: 255 if value > EDGE_THRESHOLD else 0)
+    text_density = ImageStat.Stat(edges).mean[0] / 255
+    if text_density < thresholds.min_text_density:
+        return "No text was found in the photo. Please upload a photo of the bill."
+    return None
@@ -0,0 +1,299 @@
+import json
+import base64
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from firebase_admin import firestore, firestore_async
+from google.cloud.firestore_v1.base_query import FieldFilter
+from models.bills import Bill
+from models.hospital import Hospital
+from config.settings import settings
+from config.logger import logger
+
+# One async Firestore client shared by every repository, created on first use
+_client = None
+
+# Firestore accepts at most 500 writes per batch
+MAX_BATCH_WRITES = 500
+
+
+@dataclass(frozen=True)
+class FetchPlan:
+    """
+    What to read for each document of a query: fields projects the documents to the
+    given fields (None reads them whole). Subcollections are never read.
+    """
+    fields: Optional[Tuple[str, ...]] = None
+
+    @classmethod
+    def for_model(cls, model) -> "FetchPlan":
+        """Project documents to the fields of a response model. The 'id' comes from the document itself."""
+        return cls(fields=tuple(name for name in model.model_fields if name != 'id'))
+
+
+FULL_DOCUMENT = FetchPlan()
+
+
+def get_async_client():
+    """
+    Return the shared async Firestore client. Honours FIRESTORE_EMULATOR_HOST,
+    so the repositories can be exercised against the Firestore emulator.
+    """
+    global _client
+    if _client is None:
+        _client = firestore_async.client()
+    return _client
+
+
+class FirestoreRepository:
+    """
+    Async access to one top-level Firestore collection. Every call is bounded by
+    timeout seconds, both as the RPC deadline and as an overall asyncio timeout.
+    """
+
+    collection_path: str = None
+
+    def __init__(self, client=None, timeout: float = None):
+        self._client = client
+        self.timeout = timeout or settings.FIRESTORE_TIMEOUT
+
+    @property
+    def client(self):
+        return self._client or get_async_client()
+
+    def collection(self):
+        return self.client.collection(self.collection_path)
+
+    @staticmethod
+    def _to_dict(snapshot) -> Dict[str, Any]:
+        data = snapshot.to_dict()
+        data['id'] = snapshot.id
+        return data
+
+    async def get(self, document_id: str, plan: FetchPlan = FULL_DOCUMENT) -> Optional[Dict[str, Any]]:
+        """
+        Fetch one document by ID.
+
+        Returns:
+            Optional[Dict[str, Any]]: The document data with its 'id', or None if it does not exist.
+        """
+        doc_ref = self.collection().document(document_id)
+        async with asyncio.timeout(self.timeout):
+            snapshot = await doc_ref.get(field_paths=plan.fields, timeout=self.timeout)
+        if not snapshot.exists:
+            logger.info(f"Document not found at {self.collection_path}/{document_id}")
+            return None
+        return self._to_dict(snapshot)
+
+    async def find(self, filter_field: str = None, filter_value: Any = None, plan: FetchPlan = FULL_DOCUMENT) -> List[Dict[str, Any]]:
+        """
+        Fetch every document of the collection, optionally where filter_field == filter_value.
+        """
+        query = self.collection()
+        if filter_field:
+            query = query.where(filter=FieldFilter(filter_field, '==', filter_value))
+        if plan.fields:
+            query = query.select(plan.fields)
+        async with asyncio.timeout(self.timeout):
+            result = [self._to_dict(snapshot) async for snapshot in query.stream(timeout=self.timeout)]
+        logger.info(f"Fetched {len(result)} documents from {self.collection_path}")
+        return result
+
+    @staticmethod
+    def _new_document(doc_ref, data: Dict[str, Any]) -> Dict[str, Any]:
+        # A copy, so the caller's dict is left untouched
+        return {
+            **data,
+            'id': doc_ref.id,
+            'created_at': firestore.SERVER_TIMESTAMP,
+            'updated_at': firestore.SERVER_TIMESTAMP,
+        }
+
+    async def create(self, data: Dict[str, Any], document_id: str = None) -> str:
+        """
+        Write a new document with server timestamps and its own ID stored in the 'id' field.
+        The document ID is allocated client-side when not given, so this is a single write.
+
+        Returns:
+            str: The ID of the written document.
+        """
+        doc_ref = self.collection().document(document_id)
+        async with asyncio.timeout(self.timeout):
+            await doc_ref.set(self._new_document(doc_ref, data), timeout=self.timeout)
+        logger.info(f"Document added with ID: {doc_ref.id} in collection: {self.collection_path}")
+        return doc_ref.id
+
+    async def create_many(self, documents: Sequence[Dict[str, Any]]) -> List[str]:
+        """
+        Write several new documents with client-side IDs in one WriteBatch commit
+        (one commit per MAX_BATCH_WRITES documents).
+
+        Returns:
+            List[str]: The IDs of the written documents, in the order of documents.
+        """
+        document_ids = []
+        async with asyncio.timeout(self.timeout):
+            for start in range(0, len(documents), MAX_BATCH_WRITES):
+                batch = self.client.batch()
+                for data in documents[start:start + MAX_BATCH_WRITES]:
+                    doc_ref = self.collection().document()
+                    batch.set(doc_ref, self._new_document(doc_ref, data))
+                    document_ids.append(doc_ref.id)
+                await batch.commit(timeout=self.timeout)
+        logger.info(f"{len(document_ids)} documents added in collection: {self.collection_path}")
+        return document_ids
+
+
+class PatientRepository(FirestoreRepository):
+    collection_path = 'patients'
+
+    async def get_patient(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return await self.get(user_id)
+
+    async def save_patient(self, user_id: str, patient: Dict[str, Any]) -> str:
+        return await self.create(patient, document_id=user_id)
+
+
+class BillRepository(FirestoreRepository):
+    collection_path = 'bills'
+    list_plan = FetchPlan.for_model(Bill)
+
+    hashes_plan = FetchPlan(fields=('status', 'page_hashes', 'date', 'amount'))
+
+    async def list_page_hashes(self, patient_id: str) -> List[Dict[str, Any]]:
+        """Fetch the status, page hashes, date and amount of every bill of a patient."""
+        return await self.find('patient_id', patient_id, plan=self.hashes_plan)
+
+    @staticmethod
+    def encode_page_token(bill: Dict[str, Any]) -> str:
+        cursor = {'date': bill['date'].isoformat(), 'id': bill['id']}
+        return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+    @staticmethod
+    def decode_page_token(page_token: str) -> Dict[str, Any]:
+        """
+        Raises:
+            ValueError: If the page token is malformed.
+        """
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(page_token.encode()))
+            return {'date': datetime.fromisoformat(cursor['date']), '__name__': cursor['id']}
+        except (TypeError, KeyError, ValueError) as e:
+            raise ValueError(f"Invalid page token: {page_token}") from e
+
+    async def list_page(
+        self,
+        patient_id: str,
+        limit: Optional[int],
+        page_token: Optional[str] = None,
+        status: Optional[str] = None,
+        bill_type: Optional[str] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        fields: Optional[Sequence[str]] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Fetch one page of a patient's bills, newest first. Without a limit the page holds all
+        the remaining bills.
+
+        Returns:
+            Tuple[List[Dict[str, Any]], Optional[str]]: The bills of the page, projected to fields
+            when given and to the fields of the Bill response model otherwise, and the token of
+            the next page or None on the last page.
+
+        Raises:
+            ValueError: If the page token is malformed.
+        """
+        query = self.collection().where(filter=FieldFilter('patient_id', '==', patient_id))
+        if status:
+            query = query.where(filter=FieldFilter('status', '==', status))
+        if bill_type:
+            query = query.where(filter=FieldFilter('type', '==', bill_type))
+        if date_from:
+            query = query.where(filter=FieldFilter('date', '>=', date_from))
+        if date_to:
+            query = query.where(filter=FieldFilter('date', '<=', date_to))
+        # The date is needed to build the cursor of the next page
+        query = query.select(sorted({*(fields or self.list_plan.fields), 'date'}))
+        query = query.order_by('date', direction=firestore.Query.DESCENDING)
+        query = query.order_by('__name__', direction=firestore.Query.DESCENDING)
+        if page_token:
+            query = query.start_after(self.decode_page_token(page_token))
+        if limit is not None:
+            # One extra document tells whether there is a next page
+            query = query.limit(limit + 1)
+
+        async with asyncio.timeout(self.timeout):
+            result = [self._to_dict(snapshot) async for snapshot in query.stream(timeout=self.timeout)]
+
+        next_page_token = None
+        if limit is not None and len(result) > limit:
+            result = result[:limit]
+            next_page_token = self.encode_page_token(result[-1])
+        if fields:
+            result = [{key: bill[key] for key in ('id', *fields) if key in bill} for bill in result]
+        logger.info(f"Fetched {len(result)} bills of patient {patient_id}")
+        return result, next_page_token
+
+    async def last_updated(self, patient_id: str) -> Optional[datetime]:
+        """
+        Return the latest updated_at among the patient's bills, read as a single projected document.
+        """
+        query = (
+            self.collection()
+            .where(filter=FieldFilter('patient_id', '==', patient_id))
+            .order_by('updated_at', direction=firestore.Query.DESCENDING)
+            .select(['updated_at'])
+            .limit(1)
+        )
+        async with asyncio.timeout(self.timeout):
+            async for snapshot in query.stream(timeout=self.timeout):
+                return snapshot.get('updated_at')
+        return None
+
+    async def count_for_patient(self, patient_id: str) -> int:
+        """
+        Count the patient's bills with an aggregation query, billed as one read per 1000 bills.
+        """
+        query = self.collection().where(filter=FieldFilter('patient_id', '==', patient_id)).count(alias='count')
+        async with asyncio.timeout(self.timeout):
+            results = await query.get(timeout=self.timeout)
+        return int(results[0][0].value) if results else 0
+
+    async def add_bill(self, bill: Dict[str, Any]) -> str:
+        return await self.create(bill)
+
+    async def add_bills(self, bills: Sequence[Dict[str, Any]]) -> List[str]:
+        if len(bills) == 1:
+            return [await self.add_bill(bills[0])]
+        return await self.create_many(bills)
+
+
+class HospitalRepository(FirestoreRepository):
+    collection_path = 'hospitals'
+    plan = FetchPlan.for_model(Hospital)
+
+    async def list_hospitals(self) -> List[Dict[str, Any]]:
+        return await self.find(plan=self.plan)
+
+
+patients = PatientRepository()
+bills = BillRepository()
+hospitals = HospitalRepository()
+
+
+def initialize_repositories():
+    """
+    Create the shared async client on the running event loop. Must be called from the
+    application lifespan, after Firebase is initialized.
+    """
+    get_async_client()
+    logger.info("Firestore repositories initialized")
+
+
+def close_repositories():
+    global _client
+    if _client is not None:
+        _client.close()
+    _client = None
@@ -0,0 +1,201 @@
+import time
+import random
+import asyncio
+import requests
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+from google.api_core import exceptions as api_exceptions
+from google.auth import exceptions as auth_exceptions
+from services.concurrency import OVERLOAD_ERRORS, WINDOW_SIZE, percentile
+from config.logger import logger
+
+# Errors worth retrying: overload, server-side failures and dropped connections
+TRANSIENT_ERRORS = OVERLOAD_ERRORS + (
+    api_exceptions.InternalServerError,
+    api_exceptions.BadGateway,
+    api_exceptions.GatewayTimeout,
+    api_exceptions.Aborted,
+    auth_exceptions.TransportError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    ConnectionError,
+)
+
+# Calls observed before hedging starts, so the latency percentile means something
+HEDGE_MIN_SAMPLES = 20
+
+
+class UpstreamUnavailable(Exception):
+    """An upstream kept failing with transient errors or its circuit is open; worth retrying later."""
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast while an upstream is down.
+
+    failure_threshold consecutive transient failures open the circuit for reset_seconds.
+    Then a single trial call is let through, which closes the circuit on success and
+    opens it again on failure.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        """
+        Raises:
+            CircuitOpenError: If the call must not be made.
+        """
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+            self.state = self.HALF_OPEN
+        if self.state == self.OPEN or (self.state == self.HALF_OPEN and self._trial_in_flight):
+            self.rejected += 1
+            raise CircuitOpenError(f"{self.name} is unavailable, calls are suspended")
+        if self.state == self.HALF_OPEN:
+            self._trial_in_flight = True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info(f"Circuit of {self.name} closed")
+        self.state = self.CLOSED
+        self._failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self._failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self._failures >= self.failure_threshold):
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+            self.opened += 1
+            logger.warning(f"Circuit of {self.name} opened after {self._failures} failures")
+
+    def record_cancelled(self):
+        # A cancelled trial call tells nothing about the upstream; let the next one try
+        self._trial_in_flight = False
+
+
+class ResilientCaller:
+    """
+    Calls one upstream with retries, optional hedging and a circuit breaker.
+
+    Transient errors (TRANSIENT_ERRORS) are retried up to max_attempts times with
+    full-jitter exponential backoff; other errors are raised right away. A hedged call
+    starts a second attempt once the first is slower than hedge_percentile of the recent
+    calls, and the first attempt to succeed wins. Attempts are coroutine functions, so a
+    retry repeats only the upstream call, with inputs that were already prepared.
+    """
+
+    def __init__(self, name: str, max_attempts: int, base_delay_seconds: float, max_delay_seconds: float,
+                 breaker: CircuitBreaker, hedge_percentile: Optional[float] = None):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.breaker = breaker
+        self.hedge_percentile = hedge_percentile
+        self._latencies: Deque[float] = deque(maxlen=WINDOW_SIZE)
+        self.retries = 0
+        self.hedges = 0
+        self.exhausted = 0
+
+    async def call(self, attempt: Callable[[], Awaitable[Any]], hedge: bool = False) -> Any:
+        """
+        Run attempt until it succeeds, fails with a non-transient error or runs out of attempts.
+
+        Args:
+            attempt (Callable[[], Awaitable[Any]]): Makes one call to the upstream.
+            hedge (bool): Allow a hedged second attempt. Only for idempotent calls.
+
+        Raises:
+            UpstreamUnavailable: If every attempt failed with a transient error, or the circuit is open.
+            Exception: The non-transient error an attempt failed with.
+        """
+        for attempt_number in range(1, self.max_attempts + 1):
+            try:
+                if hedge and self.hedge_percentile is not None:
+                    return await self._hedged(attempt)
+                return await self._attempt(attempt)
+            except TRANSIENT_ERRORS as e:
+                if attempt_number == self.max_attempts:
+                    self.exhausted += 1
+                    raise UpstreamUnavailable(f"{self.name} failed {attempt_number} times: {str(e)}") from e
+                delay = random.uniform(0, min(self.max_delay_seconds, self.base_delay_seconds * 2 ** (attempt_number - 1)))
+                self.retries += 1
+                logger.warning(f"{self.name} call failed with {type(e).__name__} (attempt {attempt_number}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def _attempt(self, attempt: Callable[[], Awaitable[Any]]) -> Any:
+        self.breaker.allow()
+        started_at = time.monotonic()
+        try:
+            result = await attempt()
+        except TRANSIENT_ERRORS:
+            self.breaker.record_failure()
+            raise
+        except asyncio.CancelledError:
+            self.breaker.record_cancelled()
+            raise
+        except Exception:
+            # The upstream answered; the request itself was refused
+            self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        self._latencies.append(time.monotonic() - started_at)
+        return result
+
+    async def _hedged(self, attempt: Callable[[], Awaitable[Any]]) -> Any:
+        if len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return await self._attempt(attempt)
+
+        tasks = [asyncio.ensure_future(self._attempt(attempt))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=percentile(self._latencies, self.hedge_percentile))
+            if not done:
+                self.hedges += 1
+                tasks.append(asyncio.ensure_future(self._attempt(attempt)))
+            error = None
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    return await next_done
+                except Exception as e:
+                    error = error or e
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "circuit": self.breaker.state,
+            "circuit_opened": self.breaker.opened,
+            "rejected": self.breaker.rejected,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "exhausted": self.exhausted,
+            "latency_p95_seconds": percentile(self._latencies, 0.95),
+        }
+
+
+async def resilient_call(caller: Optional[ResilientCaller], attempt: Callable[[], Awaitable[Any]], hedge: bool = False) -> Any:
+    """Run attempt through caller, or once if there is no caller."""
+    if caller is None:
+        return await attempt()
+    return await caller.call(attempt, hedge=hedge)
@@ -0,0 +1,271 @@
+import google.generativeai as genai
+from typing import Dict, Optional
+from config.settings import initialize_model
+from config.logger import logger
+from services.doc_service import DocService, ProcessingType
+from services.pipeline import ExecutionEngine, Stage
+from services.extraction_cache import ExtractionCache
+from services.gemini_files import GeminiFileRegistry
+from services.repositories import initialize_repositories, close_repositories, get_async_client, hospitals, bills
+from services.claim_jobs import ClaimJobQueue, JobBackend, SqliteJobBackend, FirestoreJobBackend
+from services.hospital_directory import HospitalDirectory
+from services.concurrency import AdaptiveLimiter
+from services.resilience import CircuitBreaker, ResilientCaller
+from services.single_flight import SingleFlight, LockBackend, FirestoreLockBackend
+from services.duplicates import DuplicateIndex
+from services.metrics import PipelineCollector, registry
+from config.settings import settings
+
+# Process-wide services, built once during the application lifespan
+model: genai.GenerativeModel = None
+engine: ExecutionEngine = None
+extraction_cache: ExtractionCache = None
+file_registry: GeminiFileRegistry = None
+gemini_limiter: AdaptiveLimiter = None
+gemini_calls: ResilientCaller = None
+storage_calls: ResilientCaller = None
+claim_flights: SingleFlight = None
+duplicate_index: DuplicateIndex = None
+hospital_directory: HospitalDirectory = None
+claim_jobs: ClaimJobQueue = None
+doc_service: DocService = None
+pipeline_collector: PipelineCollector = None
+
+
+def create_job_backend() -> JobBackend:
+    """
+    Build the claim job store selected by settings.CLAIM_JOB_BACKEND.
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    if settings.CLAIM_JOB_BACKEND == "sqlite":
+        return SqliteJobBackend(settings.CLAIM_JOB_DB_PATH)
+    if settings.CLAIM_JOB_BACKEND == "firestore":
+        return FirestoreJobBackend(get_async_client(), settings.FIRESTORE_TIMEOUT)
+    raise ValueError(f"Unknown claim job backend: {settings.CLAIM_JOB_BACKEND}")
+
+
+def create_lock_backend() -> Optional[LockBackend]:
+    """
+    Build the lock backend selected by settings.CLAIM_LOCK_BACKEND, or None to coalesce within the process only.
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    if settings.CLAIM_LOCK_BACKEND == "local":
+        return None
+    if settings.CLAIM_LOCK_BACKEND == "firestore":
+        return FirestoreLockBackend(get_async_client(), settings.FIRESTORE_TIMEOUT)
+    raise ValueError(f"Unknown claim lock backend: {settings.CLAIM_LOCK_BACKEND}")
+
+
+def create_caller(name: str, hedge_percentile: float = None) -> ResilientCaller:
+    """
+    Build the retry policy and circuit breaker of one upstream from the settings.
+    """
+    return ResilientCaller(
+        name,
+        max_attempts=settings.RETRY_MAX_ATTEMPTS,
+        base_delay_seconds=settings.RETRY_BASE_DELAY_SECONDS,
+        max_delay_seconds=settings.RETRY_MAX_DELAY_SECONDS,
+        breaker=CircuitBreaker(name, settings.CIRCUIT_FAILURE_THRESHOLD, settings.CIRCUIT_RESET_SECONDS),
+        hedge_percentile=hedge_percentile
+    )
+
+
+async def initialize_services():
+    """
+    Build the Firestore repositories, the Gemini model and the document services once and warm them up.
+    Must be awaited from the application lifespan, after Firebase is initialized. The
+    Gemini warm-up runs on the generate pool, so the background tasks already started
+    (hospital directory load, key refresh) keep running on the event loop meanwhile.
+    """
+    global model, engine, extraction_cache, file_registry, hospital_directory, doc_service, claim_jobs
+    global gemini_limiter, gemini_calls, storage_calls, claim_flights, duplicate_index, pipeline_collector
+    initialize_repositories()
+    hospital_directory = HospitalDirectory(hospitals, settings.HOSPITAL_DIRECTORY_REFRESH_SECONDS)
+    hospital_directory.start()
+    model = initialize_model()
+    engine = ExecutionEngine()
+    if settings.EXTRACTION_CACHE_ENABLED:
+        extraction_cache = ExtractionCache(
+            max_entries=settings.EXTRACTION_CACHE_MAX_ENTRIES,
+            ttl_seconds=settings.EXTRACTION_CACHE_TTL_SECONDS,
+            db_path=settings.EXTRACTION_CACHE_DB_PATH or None,
+            max_stored_entries=settings.EXTRACTION_CACHE_MAX_STORED_ENTRIES
+        )
+        # Earlier versions also stored KYC extractions on disk
+        purged = await engine.run(Stage.CACHE, extraction_cache.delete_stored, f"%:{ProcessingType.KYC.value}:%")
+        if purged:
+            logger.info(f"Deleted {purged} stored KYC extractions from the extraction cache")
+    gemini_calls = create_caller("gemini", settings.GEMINI_HEDGE_PERCENTILE if settings.GEMINI_HEDGE_ENABLED else None)
+    storage_calls = create_caller("storage")
+    file_registry = GeminiFileRegistry(
+        engine,
+        retention_seconds=settings.GEMINI_FILE_RETENTION_SECONDS,
+        expiry_margin_seconds=settings.GEMINI_FILE_EXPIRY_MARGIN_SECONDS,
+        cleanup_interval_seconds=settings.GEMINI_FILE_CLEANUP_INTERVAL_SECONDS,
+        delete_batch_size=settings.GEMINI_FILE_DELETE_BATCH_SIZE,
+        caller=gemini_calls
+    )
+    file_registry.start()
+    gemini_limiter = AdaptiveLimiter(
+        "gemini",
+        initial_limit=settings.GEMINI_CONCURRENCY_INITIAL,
+        min_limit=settings.GEMINI_CONCURRENCY_MIN,
+        max_limit=settings.GEMINI_CONCURRENCY_MAX,
+        latency_target_seconds=settings.GEMINI_LATENCY_TARGET_SECONDS,
+        backoff_ratio=settings.GEMINI_CONCURRENCY_BACKOFF,
+        cooldown_seconds=settings.GEMINI_CONCURRENCY_COOLDOWN_SECONDS
+    )
+    # A lock outlives a run, so only the locks of dead instances are taken over
+    claim_flights = SingleFlight(create_lock_backend(), lease_seconds=2 * settings.PROCESSING_TIMEOUT,
+                                 poll_seconds=settings.CLAIM_LOCK_POLL_SECONDS)
+    if settings.DUPLICATE_DETECTION_ENABLED:
+        duplicate_index = DuplicateIndex(bills, settings.DUPLICATE_INDEX_MAX_PATIENTS, settings.DUPLICATE_MAX_DISTANCE)
+    doc_service = DocService(model, engine, extraction_cache, file_registry, limiter=gemini_limiter,
+                             gemini_calls=gemini_calls, storage_calls=storage_calls, claim_flights=claim_flights,
+                             duplicate_index=duplicate_index)
+    await engine.run(Stage.GENERATE, doc_service.doc_processor.warm_up)
+    claim_jobs = ClaimJobQueue(
+        create_job_backend(),
+        doc_service,
+        workers=settings.CLAIM_JOB_WORKERS,
+        poll_seconds=settings.CLAIM_JOB_POLL_SECONDS,
+        max_attempts=settings.CLAIM_JOB_MAX_ATTEMPTS,
+        retry_base_delay_seconds=settings.CLAIM_JOB_RETRY_BASE_DELAY_SECONDS,
+        retry_max_delay_seconds=settings.CLAIM_JOB_RETRY_MAX_DELAY_SECONDS
+    )
+    claim_jobs.start()
+    pipeline_collector = PipelineCollector(engine, gemini_limiter, claim_jobs, claim_flights)
+    registry.register(pipeline_collector)
+    logger.info("Document services initialized")
+
+
+async def shutdown_services():
+    """
+    Release the resources held by the document services.
+    """
+    global doc_service, claim_jobs, pipeline_collector
+    if pipeline_collector is not None:
+        registry.unregister(pipeline_collector)
+        pipeline_collector = None
+    if claim_jobs is not None:
+        await claim_jobs.close()
+        claim_jobs = None
+    doc_service = None
+    if file_registry is not None:
+        await file_registry.close()
+    if hospital_directory is not None:
+        await hospital_directory.close()
+    if engine is not None:
+        engine.shutdown(wait=True)
+    if extraction_cache is not None:
+        extraction_cache.close()
+    close_repositories()
+
+
+def get_engine() -> ExecutionEngine:
+    """
+    Return the shared execution engine.
+
+    Raises:
+        RuntimeError: If the services have not been initialized yet.
+    """
+    if engine is None:
+        raise RuntimeError("Execution engine is not initialized")
+    return engine
+
+
+def get_extraction_cache() -> ExtractionCache:
+    """
+    Return the shared extraction cache, or None when it is disabled.
+    """
+    return extraction_cache
+
+
+def get_file_registry() -> GeminiFileRegistry:
+    """
+    Return the shared Gemini file registry, or None before initialization.
+    """
+    return file_registry
+
+
+def get_gemini_limiter() -> AdaptiveLimiter:
+    """
+    Return the adaptive concurrency limiter of the Gemini calls.
+
+    Raises:
+        RuntimeError: If the services have not been initialized yet.
+    """
+    if gemini_limiter is None:
+        raise RuntimeError("Gemini limiter is not initialized")
+    return gemini_limiter
+
+
+def get_upstream_callers() -> Dict[str, ResilientCaller]:
+    """
+    Return the retry policies and circuit breakers of the upstreams, by name.
+
+    Raises:
+        RuntimeError: If the services have not been initialized yet.
+    """
+    if gemini_calls is None or storage_calls is None:
+        raise RuntimeError("Upstream callers are not initialized")
+    return {"gemini": gemini_calls, "storage": storage_calls}
+
+
+def get_claim_flights() -> SingleFlight:
+    """
+    Return the registry of claim verifications in flight.
+
+    Raises:
+        RuntimeError: If the services have not been initialized yet.
+    """
+    if claim_flights is None:
+        raise RuntimeError("Claim flights are not initialized")
+    return claim_flights
+
+
+def get_duplicate_index() -> DuplicateIndex:
+    """
+    Return the index of the patients' bill page hashes, or None when duplicate detection is disabled.
+    """
+    return duplicate_index
+
+
+def get_hospital_directory() -> HospitalDirectory:
+    """
+    Return the shared hospital directory.
+
+    Raises:
+        RuntimeError: If the services have not been initialized yet.
+    """
+    if hospital_directory is None:
+        raise RuntimeError("Hospital directory is not initialized")
+    return hospital_directory
+
+
+def get_claim_jobs() -> ClaimJobQueue:
+    """
+    Return the shared claim job queue.
+
+    Raises:
+        RuntimeError: If the services have not been initialized yet.
+    """
+    if claim_jobs is None:
+        raise RuntimeError("Claim job queue is not initialized")
+    return claim_jobs
+
+
+def get_doc_service() -> DocService:
+    """
+    FastAPI dependency returning the shared DocService instance.
+
+    Raises:
+        RuntimeError: If the services have not been initialized yet.
+    """
+    if doc_service is None:
+        raise RuntimeError("Document services are not initialized")
+    return doc_service
@@ -0,0 +1,195 @@
+import time
+import uuid
+import asyncio
+import hashlib
+import functools
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+from google.cloud.firestore_v1.async_transaction import async_transactional
+from config.logger import logger
+
+# Lock documents are kept this long after their last use, for a Firestore TTL policy on expire_at
+LOCK_RETENTION = timedelta(days=1)
+
+
+class LockBackend(ABC):
+    """
+    Lock shared by the instances of the service, so only one of them runs a keyed
+    execution at a time. The owner leaves the outcome behind for the others.
+    """
+
+    @abstractmethod
+    async def acquire(self, key: str, lease_seconds: float) -> Optional[str]:
+        """Take the lock for lease_seconds. Returns an owner token, or None if another owner holds it."""
+
+    @abstractmethod
+    async def release(self, key: str, token: str, result: Optional[Dict[str, Any]]):
+        """Release the lock and publish the result, if there is one."""
+
+    @abstractmethod
+    async def result(self, key: str, since: float) -> Optional[Dict[str, Any]]:
+        """Return the result published for key at or after since, or None."""
+
+
+class FirestoreLockBackend(LockBackend):
+    """
+    Locks in the claim_locks Firestore collection, one document per key, taken in a
+    transaction. A lock whose lease expired (its owner died) can be taken again.
+    """
+
+    collection_path = 'claim_locks'
+
+    def __init__(self, client, timeout: float):
+        self.client = client
+        self.timeout = timeout
+
+    def document(self, key: str):
+        return self.client.collection(self.collection_path).document(hashlib.sha256(key.encode()).hexdigest())
+
+    async def acquire(self, key: str, lease_seconds: float) -> Optional[str]:
+        token = uuid.uuid4().hex
+        reference = self.document(key)
+
+        @async_transactional
+        async def take(transaction) -> bool:
+            snapshot = await reference.get(transaction=transaction)
+            now = time.time()
+            if snapshot.exists and (snapshot.to_dict().get('lease_expires_at') or 0) > now:
+                return False
+            # The previous result is kept for the requests still waiting on it
+            transaction.set(reference, {
+                'key': key,
+                'owner': token,
+                'lease_expires_at': now + lease_seconds,
+                'expire_at': datetime.now(timezone.utc) + LOCK_RETENTION,
+            }, merge=True)
+            return True
+
+        async with asyncio.timeout(self.timeout):
+            return token if await take(self.client.transaction()) else None
+
+    async def release(self, key: str, token: str, result: Optional[Dict[str, Any]]):
+        reference = self.document(key)
+
+        @async_transactional
+        async def give_back(transaction):
+            snapshot = await reference.get(transaction=transaction)
+            if not snapshot.exists or snapshot.to_dict().get('owner') != token:
+                return
+            update = {'owner': None, 'lease_expires_at': 0.0}
+            if result is not None:
+                update.update({'result': result, 'completed_at': time.time()})
+            transaction.update(reference, update)
+
+        async with asyncio.timeout(self.timeout):
+            await give_back(self.client.transaction())
+
+    async def result(self, key: str, since: float) -> Optional[Dict[str, Any]]:
+        async with asyncio.timeout(self.timeout):
+            snapshot = await self.document(key).get(timeout=self.timeout)
+        data = snapshot.to_dict() if snapshot.exists else {}
+        if data.get('result') is None or (data.get('completed_at') or 0) < since:
+            return None
+        return data['result']
+
+
+@dataclass
+class Flight:
+    task: asyncio.Future
+    waiters: int = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent executions with the same key: the first caller starts the
+    execution and later callers wait for its result instead of starting their own.
+    The execution is cancelled once no caller is waiting for it anymore.
+
+    With a lock backend, callers on other instances coalesce too: while another
+    instance holds the lock they poll for the result it publishes, and run the
+    execution themselves if it ends without one (it failed or its owner died).
+    """
+
+    def __init__(self, backend: Optional[LockBackend] = None, lease_seconds: float = 0.0, poll_seconds: float = 1.0):
+        self.backend = backend
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self._flights: Dict[str, Flight] = {}
+        self.executions = 0
+        self.coalesced = 0
+        self.remote = 0
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]],
+                  encode: Callable[[Any], Dict[str, Any]] = None, decode: Callable[[Dict[str, Any]], Any] = None) -> Any:
+        """
+        Return the result of fn, shared with the concurrent callers of the same key.
+
+        Args:
+            key (str): Identifies the execution.
+            fn (Callable[[], Awaitable[Any]]): Runs the execution.
+            encode, decode (optional): Convert the result to and from the JSON-like dict published
+                through the lock backend. Without them the execution is only coalesced in-process.
+
+        Raises:
+            Exception: The error the shared execution failed with.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight(task=asyncio.ensure_future(self._lead(key, fn, encode, decode)))
+            self._flights[key] = flight
+            flight.task.add_done_callback(functools.partial(self._landed, key, flight))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # A retry arriving while the cancelled execution cleans up starts a new one
+                self._landed(key, flight, None)
+                flight.task.cancel()
+
+    def _landed(self, key: str, flight: Flight, _):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def _lead(self, key: str, fn: Callable[[], Awaitable[Any]], encode, decode) -> Any:
+        if self.backend is None or encode is None or decode is None:
+            return await fn()
+
+        waiting_since = time.time()
+        while True:
+            try:
+                token = await self.backend.acquire(key, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Failed to take the lock of {key}, running without it: {str(e)}")
+                return await fn()
+            if token is not None:
+                break
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                shared = await self.backend.result(key, waiting_since)
+            except Exception as e:
+                logger.error(f"Failed to read the result of {key}: {str(e)}")
+                shared = None
+            if shared is not None:
+                self.remote += 1
+                return decode(shared)
+
+        result = None
+        try:
+            result = await fn()
+            return result
+        finally:
+            try:
+                await self.backend.release(key, token, encode(result) if result is not None else None)
+            except Exception as e:
+                logger.error(f"Failed to release the lock of {key}: {str(e)}")
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._flights), "executions": self.executions, "coalesced": self.coalesced, "remote": self.remote}
@@ -0,0 +1,21 @@
+import os
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Settings are read at import time; give the required ones harmless values for the tests
+for name, value in {
+    "ENVIRONMENT": "test",
+    "MODEL_NAME": "gemini-1.5-flash",
+    "GEMINI_API_KEY": "test",
+    "FIREBASE_CREDENTIALS_PATH": "credentials.json",
+    "FIREBASE_STORAGE_BUCKET": "test",
+    "PROCESSING_TIMEOUT": "30",
+    "CLAIM_JOB_BACKEND": "sqlite",
+}.items():
+    os.environ.setdefault(name, value)
+
+sys.path.insert(0, str(BACKEND_DIR))
+# Prompts are loaded from paths relative to the backend directory
+os.chdir(BACKEND_DIR)
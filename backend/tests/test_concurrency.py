@@ -0,0 +1,98 @@
+import asyncio
+import pytest
+from google.api_core import exceptions as api_exceptions
+from services.concurrency import AdaptiveLimiter
+
+
+def limiter(initial_limit=4, min_limit=1, max_limit=8, cooldown_seconds=60.0):
+    return AdaptiveLimiter("gemini", initial_limit=initial_limit, min_limit=min_limit, max_limit=max_limit,
+                           latency_target_seconds=1.0, backoff_ratio=0.5, cooldown_seconds=cooldown_seconds)
+
+
+async def succeed(adaptive: AdaptiveLimiter, calls: int):
+    for _ in range(calls):
+        async with adaptive.acquire():
+            pass
+
+
+def test_fast_calls_grow_the_limit_up_to_the_maximum():
+    adaptive = limiter()
+    asyncio.run(succeed(adaptive, 5))
+    # About one more slot per round of limit calls
+    assert adaptive.limit == 5
+    asyncio.run(succeed(adaptive, 200))
+    assert adaptive.limit == 8
+
+
+def test_overload_halves_the_limit_once_per_cooldown():
+    async def overload(adaptive: AdaptiveLimiter):
+        for _ in range(2):
+            with pytest.raises(api_exceptions.TooManyRequests):
+                async with adaptive.acquire():
+                    raise api_exceptions.TooManyRequests("slow down")
+
+    adaptive = limiter()
+    asyncio.run(overload(adaptive))
+    assert adaptive.limit == 2
+    assert adaptive.overloads == 2
+    assert adaptive.decreases == 1
+    assert adaptive.in_flight == 0
+
+
+def test_limit_does_not_drop_below_the_minimum():
+    async def overload(adaptive: AdaptiveLimiter):
+        for _ in range(5):
+            with pytest.raises(api_exceptions.ResourceExhausted):
+                async with adaptive.acquire():
+                    raise api_exceptions.ResourceExhausted("quota")
+
+    adaptive = limiter(min_limit=2, cooldown_seconds=0.0)
+    asyncio.run(overload(adaptive))
+    assert adaptive.limit == 2
+
+
+def test_slot_handed_to_a_cancelled_waiter_is_given_back():
+    async def cancel_after_handover():
+        adaptive = limiter(initial_limit=1, max_limit=1)
+        held = adaptive.acquire()
+        await held.__aenter__()
+
+        async def wait_for_slot():
+            async with adaptive.acquire():
+                pass
+
+        waiter = asyncio.create_task(wait_for_slot())
+        await asyncio.sleep(0)
+        assert adaptive.stats()["waiting"] == 1
+        # The slot goes to the waiter, which is cancelled before it gets to run
+        await held.__aexit__(None, None, None)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert waiter.cancelled()
+        assert adaptive.in_flight == 0
+
+        # The slot is free again
+        async with asyncio.timeout(1):
+            await succeed(adaptive, 1)
+        return adaptive
+
+    adaptive = asyncio.run(cancel_after_handover())
+    assert adaptive.in_flight == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def cancel_while_queued():
+        adaptive = limiter(initial_limit=1, max_limit=1)
+        held = adaptive.acquire()
+        await held.__aenter__()
+        waiter = asyncio.create_task(succeed(adaptive, 1))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        waiting = adaptive.stats()["waiting"]
+        await held.__aexit__(None, None, None)
+        return adaptive, waiting
+
+    adaptive, waiting = asyncio.run(cancel_while_queued())
+    assert waiting == 0
+    assert adaptive.in_flight == 0
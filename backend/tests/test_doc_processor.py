@@ -0,0 +1,129 @@
+import asyncio
+import pytest
+import google.generativeai as genai
+from google.api_core import exceptions as api_exceptions
+from services.doc_processor import DocProcessor
+from services.resilience import TRANSIENT_ERRORS
+
+
+def function_call_response(name, args):
+    return genai.protos.GenerateContentResponse(candidates=[
+        genai.protos.Candidate(content=genai.protos.Content(parts=[
+            genai.protos.Part(function_call=genai.protos.FunctionCall(name=name, args=args))
+        ]))
+    ])
+
+
+def text_response(text):
+    return genai.protos.GenerateContentResponse(candidates=[
+        genai.protos.Candidate(content=genai.protos.Content(parts=[genai.protos.Part(text=text)]))
+    ])
+
+
+PHARMACY_BILL = {"patient_name": "Asha Rao", "total_amount": 1250.5, "date": "2024-03-14"}
+DISCHARGE_BILL = {"patient_name": "Asha Rao", "doctor_name": "Dr. Mehta", "total_amount": "48000",
+                  "date": "14/03/2024", "hospital_name": "City Hospital"}
+PAN_CARD = {"name": "ASHA RAO", "pan_number": "ABCDE1234F"}
+
+CLAIM_RESPONSES = [
+    function_call_response("process_pharmacy_bill", PHARMACY_BILL),
+    function_call_response("process_discharge_bill", DISCHARGE_BILL),
+    # Missing required fields
+    function_call_response("process_discharge_bill", {"patient_name": "Asha Rao"}),
+    # Not a claim function
+    function_call_response("process_pan_card", PAN_CARD),
+    text_response("This is not a bill."),
+    genai.protos.GenerateContentResponse(candidates=[]),
+]
+
+KYC_RESPONSES = [
+    function_call_response("process_pan_card", PAN_CARD),
+    function_call_response("process_pan_card", {"name": "ASHA RAO", "pan_number": "12345"}),
+    function_call_response("process_pharmacy_bill", PHARMACY_BILL),
+    text_response("Unreadable."),
+    genai.protos.GenerateContentResponse(candidates=[]),
+]
+
+DOCUMENTS = [
+    {"mime_type": "image/jpeg", "data": b"page"},
+    [{"mime_type": "image/jpeg", "data": b"page 1"}, {"mime_type": "image/jpeg", "data": b"page 2"}],
+]
+
+
+@pytest.fixture
+def model(mocker):
+    model = mocker.Mock(spec=genai.GenerativeModel)
+    model.generate_content = mocker.Mock()
+    model.generate_content_async = mocker.AsyncMock()
+    return model
+
+
+@pytest.fixture
+def processor(model):
+    return DocProcessor(model)
+
+
+def stub(model, outcome):
+    """Make both the blocking and the asyncio call return, or raise, outcome."""
+    if isinstance(outcome, BaseException):
+        model.generate_content.side_effect = outcome
+        model.generate_content_async.side_effect = outcome
+    else:
+        model.generate_content.return_value = outcome
+        model.generate_content_async.return_value = outcome
+
+
+def classify_both(processor, kind, document):
+    sync_result = getattr(processor, f"classify_{kind}")(document)
+    async_result = asyncio.run(getattr(processor, f"classify_{kind}_async")(document))
+    return sync_result, async_result
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+@pytest.mark.parametrize("response", CLAIM_RESPONSES)
+def test_claim_classifiers_agree(processor, model, response, document):
+    stub(model, response)
+    sync_result, async_result = classify_both(processor, "claim", document)
+    assert sync_result == async_result
+    # The same request is sent either way
+    assert model.generate_content.call_args == model.generate_content_async.call_args
+
+
+@pytest.mark.parametrize("response", KYC_RESPONSES)
+def test_kyc_classifiers_agree(processor, model, response):
+    stub(model, response)
+    sync_result, async_result = classify_both(processor, "kyc", DOCUMENTS[0])
+    assert sync_result == async_result
+    assert model.generate_content.call_args == model.generate_content_async.call_args
+
+
+def test_valid_bill_is_extracted(processor, model):
+    stub(model, CLAIM_RESPONSES[0])
+    sync_result, async_result = classify_both(processor, "claim", DOCUMENTS[0])
+    assert sync_result == async_result == ("process_pharmacy_bill", PHARMACY_BILL)
+
+
+@pytest.mark.parametrize("kind", ["claim", "kyc"])
+@pytest.mark.parametrize("error", [
+    api_exceptions.TooManyRequests("slow down"),
+    api_exceptions.ResourceExhausted("quota"),
+    api_exceptions.ServiceUnavailable("unavailable"),
+    api_exceptions.DeadlineExceeded("deadline"),
+    api_exceptions.InternalServerError("internal"),
+    ConnectionError("reset"),
+])
+def test_transient_errors_are_raised_by_both(processor, model, kind, error):
+    assert isinstance(error, TRANSIENT_ERRORS)
+    stub(model, error)
+    with pytest.raises(type(error)):
+        getattr(processor, f"classify_{kind}")(DOCUMENTS[0])
+    with pytest.raises(type(error)):
+        asyncio.run(getattr(processor, f"classify_{kind}_async")(DOCUMENTS[0]))
+
+
+@pytest.mark.parametrize("kind", ["claim", "kyc"])
+@pytest.mark.parametrize("error", [api_exceptions.InvalidArgument("bad request"), ValueError("bad response")])
+def test_other_errors_are_swallowed_by_both(processor, model, kind, error):
+    stub(model, error)
+    sync_result, async_result = classify_both(processor, kind, DOCUMENTS[0])
+    assert sync_result == async_result == (None, None)
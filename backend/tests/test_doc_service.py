@@ -0,0 +1,94 @@
+import time
+import uuid
+import asyncio
+import google.generativeai as genai
+from services.doc_service import ClaimResult, DocService
+from services.single_flight import LockBackend, SingleFlight
+from services.metrics import ClaimOutcome
+from models.documents import DocumentType
+
+
+class MemoryLockBackend(LockBackend):
+    """A lock backend shared by the DocServices of a test, standing in for claim_locks."""
+
+    def __init__(self):
+        self.owners = {}
+        self.results = {}
+
+    async def acquire(self, key, lease_seconds):
+        if key in self.owners:
+            return None
+        self.owners[key] = uuid.uuid4().hex
+        return self.owners[key]
+
+    async def release(self, key, token, result):
+        if self.owners.get(key) != token:
+            return
+        del self.owners[key]
+        if result is not None:
+            self.results[key] = (result, time.time())
+
+    async def result(self, key, since):
+        result, completed_at = self.results.get(key, (None, 0.0))
+        return result if completed_at >= since else None
+
+
+def doc_service(mocker, backend, verified, save_error):
+    """A DocService whose pipeline waits for verified and whose bill writes fail with save_error."""
+    async def verify_document(user_id, file_uri, document_type):
+        await verified.wait()
+        return ClaimResult(status=True, bills=[mocker.sentinel.bill], outcome=ClaimOutcome.VERIFIED)
+
+    service = DocService(mocker.Mock(spec=genai.GenerativeModel), mocker.Mock(),
+                         claim_flights=SingleFlight(backend, lease_seconds=30, poll_seconds=0.01))
+    service._verify_document = mocker.AsyncMock(side_effect=verify_document)
+    service.save_bills = mocker.AsyncMock(side_effect=save_error)
+    return service
+
+
+def test_failed_bill_write_fails_every_waiter(mocker):
+    async def verify_everywhere():
+        backend = MemoryLockBackend()
+        verified = asyncio.Event()
+        leader = doc_service(mocker, backend, verified, Exception("write failed"))
+        remote = doc_service(mocker, backend, verified, Exception("write failed"))
+
+        local_calls = [asyncio.create_task(leader.verify_claim("user", "gs://bill.jpg", DocumentType.IMAGE)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        remote_call = asyncio.create_task(remote.verify_claim("user", "gs://bill.jpg", DocumentType.IMAGE))
+        await asyncio.sleep(0.05)
+        verified.set()
+        return leader, remote, await asyncio.gather(*local_calls, remote_call, return_exceptions=True)
+
+    leader, remote, outcomes = asyncio.run(verify_everywhere())
+
+    assert len(outcomes) == 3
+    for outcome in outcomes:
+        assert isinstance(outcome, Exception)
+        assert "write failed" in str(outcome)
+    # The document was verified and its bills written once, by the instance holding the lock
+    assert leader._verify_document.await_count == 1
+    leader.save_bills.assert_awaited_once_with([mocker.sentinel.bill])
+    remote._verify_document.assert_not_awaited()
+    remote.save_bills.assert_not_awaited()
+
+
+def test_result_is_shared_once_the_bills_are_written(mocker):
+    async def verify_everywhere():
+        backend = MemoryLockBackend()
+        verified = asyncio.Event()
+        leader = doc_service(mocker, backend, verified, None)
+        leader.save_bills.return_value = ["bill-1"]
+        remote = doc_service(mocker, backend, verified, None)
+
+        local_calls = [asyncio.create_task(leader.verify_claim("user", "gs://bill.jpg", DocumentType.IMAGE)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        remote_call = asyncio.create_task(remote.verify_claim("user", "gs://bill.jpg", DocumentType.IMAGE))
+        await asyncio.sleep(0.05)
+        verified.set()
+        return await asyncio.gather(*local_calls, remote_call)
+
+    results = asyncio.run(verify_everywhere())
+
+    assert [result.status for result in results] == [True, True, True]
+    assert [result.bill_ids for result in results] == [["bill-1"]] * 3
@@ -0,0 +1,54 @@
+import asyncio
+from datetime import datetime, timezone
+from models.bills import BillCreate, BillStatus, BillType
+from services.duplicates import DuplicateIndex
+
+# Weekly bills of one pharmacy: the same template, so their pages hash a bit apart
+TEMPLATE_HASH = 0x0F0F_F0F0_0F0F_F0F0
+
+
+class StoredBills:
+    def __init__(self, bills):
+        self.bills = bills
+
+    async def list_page_hashes(self, patient_id):
+        return self.bills
+
+
+def pharmacy_bill(day: int, amount: float) -> BillCreate:
+    return BillCreate(patient_id="patient", date=datetime(2026, 10, day), amount=amount, status=BillStatus.VERIFIED,
+                      type=BillType.PHARMACY, page_hashes=[f"{TEMPLATE_HASH:016x}"])
+
+
+def index_with_last_week():
+    return DuplicateIndex(StoredBills([{
+        "id": "last-week", "status": "verified", "page_hashes": [f"{TEMPLATE_HASH ^ 0b11:016x}"],
+        # Firestore returns the stored dates in UTC
+        "date": datetime(2026, 10, 6, tzinfo=timezone.utc), "amount": 1240.5
+    }]), max_patients=10, max_distance=6)
+
+
+def test_bill_on_the_same_template_is_only_a_candidate():
+    index = index_with_last_week()
+    candidates = asyncio.run(index.find("patient", [TEMPLATE_HASH]))
+    assert list(candidates) == ["last-week"]
+    assert index.confirm(candidates, pharmacy_bill(13, 1240.5)) is None
+    assert index.confirm(candidates, pharmacy_bill(6, 980.0)) is None
+
+
+def test_bill_with_the_same_date_and_amount_is_a_duplicate():
+    index = index_with_last_week()
+    candidates = asyncio.run(index.find("patient", [TEMPLATE_HASH]))
+    assert index.confirm(candidates, pharmacy_bill(6, 1240.5)) == "last-week"
+
+
+def test_written_bills_become_candidates():
+    async def write_then_find():
+        index = index_with_last_week()
+        await index.find("patient", [TEMPLATE_HASH])
+        index.add("this-week", pharmacy_bill(13, 1240.5))
+        return index, await index.find("patient", [TEMPLATE_HASH])
+
+    index, candidates = asyncio.run(write_then_find())
+    assert sorted(candidates) == ["last-week", "this-week"]
+    assert index.confirm(candidates, pharmacy_bill(13, 1240.5)) == "this-week"
@@ -0,0 +1,23 @@
+from services.extraction_cache import ExtractionCache
+
+
+def test_unpersisted_entries_stay_in_memory(tmp_path):
+    db_path = str(tmp_path / "extraction_cache.sqlite3")
+    cache = ExtractionCache(max_entries=10, ttl_seconds=60, db_path=db_path)
+    cache.set("model:claim:a", "process_pharmacy_bill", {"total_amount": 120.0})
+    cache.set("model:kyc:b", "process_pan_card", {"pan_number": "ABCDE1234F"}, persist=False)
+    assert cache.get("model:kyc:b") == ("process_pan_card", {"pan_number": "ABCDE1234F"})
+    cache.close()
+
+    restarted = ExtractionCache(max_entries=10, ttl_seconds=60, db_path=db_path)
+    assert restarted.get("model:claim:a") == ("process_pharmacy_bill", {"total_amount": 120.0})
+    assert restarted.get("model:kyc:b") is None
+    restarted.close()
+
+
+def test_stored_entries_can_be_deleted_by_key_pattern(tmp_path):
+    cache = ExtractionCache(max_entries=10, ttl_seconds=60, db_path=str(tmp_path / "extraction_cache.sqlite3"))
+    cache.set("model:claim:a", "process_pharmacy_bill", {"total_amount": 120.0})
+    cache.set("model:kyc:b", "process_pan_card", {"pan_number": "ABCDE1234F"})
+    assert cache.delete_stored("%:kyc:%") == 1
+    cache.close()
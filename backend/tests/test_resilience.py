@@ -0,0 +1,103 @@
+import asyncio
+import pytest
+from google.api_core import exceptions as api_exceptions
+from services.resilience import CircuitBreaker, CircuitOpenError, HEDGE_MIN_SAMPLES, ResilientCaller, UpstreamUnavailable
+
+
+def caller(max_attempts=3, failure_threshold=10, hedge_percentile=None):
+    return ResilientCaller("gemini", max_attempts=max_attempts, base_delay_seconds=0.0, max_delay_seconds=0.0,
+                           breaker=CircuitBreaker("gemini", failure_threshold, reset_seconds=60.0),
+                           hedge_percentile=hedge_percentile)
+
+
+def test_circuit_opens_then_closes_after_a_successful_trial():
+    breaker = CircuitBreaker("gemini", failure_threshold=2, reset_seconds=60.0)
+    for _ in range(2):
+        breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    # Once reset_seconds have passed a single trial call is let through
+    breaker._opened_at -= 60.0
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.allow()
+
+
+def test_failed_trial_opens_the_circuit_again():
+    breaker = CircuitBreaker("gemini", failure_threshold=1, reset_seconds=60.0)
+    breaker.allow()
+    breaker.record_failure()
+    breaker._opened_at -= 60.0
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened == 2
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_transient_errors_are_retried_until_attempts_run_out():
+    attempts = []
+
+    async def unavailable():
+        attempts.append(len(attempts))
+        raise api_exceptions.ServiceUnavailable("overloaded")
+
+    gemini = caller(max_attempts=3)
+    with pytest.raises(UpstreamUnavailable):
+        asyncio.run(gemini.call(unavailable))
+    assert len(attempts) == 3
+    assert gemini.retries == 2
+    assert gemini.exhausted == 1
+
+
+def test_other_errors_are_raised_right_away():
+    attempts = []
+
+    async def invalid():
+        attempts.append(len(attempts))
+        raise api_exceptions.InvalidArgument("bad request")
+
+    gemini = caller(max_attempts=3)
+    with pytest.raises(api_exceptions.InvalidArgument):
+        asyncio.run(gemini.call(invalid))
+    assert len(attempts) == 1
+    assert gemini.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_slow_call_is_hedged_and_the_loser_cancelled():
+    cancelled = []
+
+    async def hedge():
+        gemini = caller(hedge_percentile=0.5)
+        gemini._latencies.extend([0.01] * HEDGE_MIN_SAMPLES)
+        calls = []
+
+        async def attempt():
+            calls.append(len(calls))
+            if len(calls) == 1:
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    cancelled.append(True)
+                    raise
+                return "first"
+            return "second"
+
+        async with asyncio.timeout(1):
+            return gemini, await gemini.call(attempt, hedge=True)
+
+    gemini, result = asyncio.run(hedge())
+    assert result == "second"
+    assert gemini.hedges == 1
+    assert cancelled == [True]
+    # The cancelled attempt does not count against the upstream
+    assert gemini.breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,43 @@
+import asyncio
+from services.single_flight import LockBackend, SingleFlight
+
+
+class SlowReleaseBackend(LockBackend):
+    """A lock that takes a while to give back, like a Firestore release transaction."""
+
+    async def acquire(self, key, lease_seconds):
+        return "token"
+
+    async def release(self, key, token, result):
+        await asyncio.sleep(0.05)
+
+    async def result(self, key, since):
+        return None
+
+
+def test_retry_after_a_timeout_starts_a_new_execution():
+    async def time_out_then_retry():
+        flights = SingleFlight(SlowReleaseBackend(), lease_seconds=30, poll_seconds=0.01)
+        runs = []
+
+        async def verify():
+            runs.append(len(runs))
+            if len(runs) == 1:
+                await asyncio.sleep(10)
+            return "verified"
+
+        def run():
+            return flights.run("claim", verify, encode=lambda result: {"result": result}, decode=lambda data: data["result"])
+
+        try:
+            async with asyncio.timeout(0.01):
+                await run()
+        except TimeoutError:
+            pass
+        # The first execution is still releasing its lock
+        return await run(), runs
+
+    result, runs = asyncio.run(time_out_then_retry())
+
+    assert result == "verified"
+    assert runs == [0, 1]
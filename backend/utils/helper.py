@@ -1,19 +1,172 @@
+import io
 import os
 import re
+import math
 import json
 import tempfile
+import mimetypes
+import hashlib
+from dataclasses import dataclass
+from functools import cached_property
 import google.generativeai as genai
-from typing import List, Dict, Any, Union
-from firebase_admin import firestore
+from typing import List, Optional, Tuple
 from config.logger import logger
 from firebase_admin import storage
-from pdf2image import convert_from_path
-
-def get_firestore_client():
-    return firestore.client()
+from pdf2image import convert_from_path, pdfinfo_from_path
+from PIL import Image, ImageOps
 
 #### General helper functions
 
+@dataclass
+class PageImage:
+    """
+    An encoded page image held in memory.
+    """
+    data: bytes
+    mime_type: str
+    page_number: int = 1
+
+    @cached_property
+    def content_hash(self) -> str:
+        """SHA-256 of the encoded page, used to address caches and uploaded files."""
+        return hashlib.sha256(self.data).hexdigest()
+
+
+# Gemini counts an image as 258 tokens per 768x768 tile, and small images as a single tile
+IMAGE_TILE_SIZE = 768
+IMAGE_TILE_TOKENS = 258
+SMALL_IMAGE_SIZE = 384
+
+
+def estimate_image_tokens(page: PageImage) -> int:
+    """
+    Estimate the input tokens Gemini counts for a page image. Only the image header is read.
+    Images that can not be read are counted as a 3x3 tile page.
+    """
+    try:
+        with Image.open(io.BytesIO(page.data)) as image:
+            width, height = image.size
+    except Exception:
+        return 9 * IMAGE_TILE_TOKENS
+    if width <= SMALL_IMAGE_SIZE and height <= SMALL_IMAGE_SIZE:
+        return IMAGE_TILE_TOKENS
+    return math.ceil(width / IMAGE_TILE_SIZE) * math.ceil(height / IMAGE_TILE_SIZE) * IMAGE_TILE_TOKENS
+
+
+def detect_image_mime_type(data: bytes, default: str = 'image/png') -> str:
+    """
+    Detect the MIME type of an encoded image from its magic bytes.
+    """
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[4:12] in (b'ftypheic', b'ftypheix', b'ftypmif1', b'ftypmsf1'):
+        return 'image/heic'
+    if data.startswith(b'%PDF'):
+        return 'application/pdf'
+    return default
+
+
+@dataclass(frozen=True)
+class PreprocessProfile:
+    """
+    How a page image is normalized and re-encoded before it is sent to Gemini.
+    """
+    max_long_edge: int
+    grayscale: bool = True
+    autocontrast: bool = True
+    format: str = 'JPEG'
+    quality: int = 85
+
+
+def normalize_image(image, profile: PreprocessProfile):
+    """
+    Fix the EXIF orientation, downscale to the profile's long edge and optionally
+    convert to grayscale with contrast normalization.
+    """
+    image = ImageOps.exif_transpose(image)
+    if max(image.size) > profile.max_long_edge:
+        image.thumbnail((profile.max_long_edge, profile.max_long_edge), Image.LANCZOS)
+    if profile.grayscale:
+        image = ImageOps.grayscale(image)
+    elif image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    if profile.autocontrast:
+        image = ImageOps.autocontrast(image, cutoff=1)
+    return image
+
+
+def encode_image(image, profile: PreprocessProfile) -> Tuple[bytes, str]:
+    """
+    Encode an image with the profile's format and quality.
+
+    :return: Tuple of (encoded bytes, MIME type)
+    """
+    buffer = io.BytesIO()
+    image.save(buffer, profile.format, quality=profile.quality, optimize=True)
+    return buffer.getvalue(), Image.MIME.get(profile.format.upper(), 'image/jpeg')
+
+
+def preprocess_page(page: PageImage, profile: PreprocessProfile) -> PageImage:
+    """
+    Shrink a page image before upload. The original page is kept if it can not be
+    decoded or if re-encoding does not make it smaller.
+    """
+    try:
+        with Image.open(io.BytesIO(page.data)) as image:
+            data, mime_type = encode_image(normalize_image(image, profile), profile)
+    except Exception as e:
+        logger.warning(f"Failed to preprocess page {page.page_number}, keeping the original: {e}")
+        return page
+    if len(data) >= len(page.data):
+        return page
+    logger.info(f"Preprocessed page {page.page_number}: {len(page.data)} -> {len(data)} bytes")
+    return PageImage(data=data, mime_type=mime_type, page_number=page.page_number)
+
+
+def preprocess_image_file(image_path: str, profile: Optional[PreprocessProfile]) -> PageImage:
+    """
+    Load a page image from a file, shrunk with the profile. Only the shrunk page is held
+    in memory, unless the image can not be decoded, re-encoding does not make it smaller
+    or there is no profile, in which case the file is read as it is.
+    """
+    if profile is not None:
+        try:
+            with Image.open(image_path) as image:
+                data, mime_type = encode_image(normalize_image(image, profile), profile)
+            if len(data) < os.path.getsize(image_path):
+                logger.info(f"Preprocessed {image_path}: {os.path.getsize(image_path)} -> {len(data)} bytes")
+                return PageImage(data=data, mime_type=mime_type)
+        except Exception as e:
+            logger.warning(f"Failed to preprocess {image_path}, keeping the original: {e}")
+    with open(image_path, 'rb') as image_file:
+        data = image_file.read()
+    return PageImage(data=data, mime_type=detect_image_mime_type(data, default='image/jpeg'))
+
+
+def write_temp_file(data: bytes, suffix: str = '', output_dir: str = "output") -> str:
+    """
+    Write bytes to a new temporary file and return its path.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile(delete=False, dir=output_dir, suffix=suffix) as temp_file:
+        temp_file.write(data)
+        return temp_file.name
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check an If-None-Match header against a strong ETag. Weak validators match too.
+    """
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(',')]
+    return "*" in candidates or etag in candidates
+
+
 def load_prompt_from_file(file_path, key):
     with open(file_path, 'r') as file:
         data = json.load(file)
@@ -39,34 +192,70 @@ def convert_json_string_to_dict(json_string):
         raise
 
 
-def pdf_to_images(pdf_path, output_dir=None, dpi=200, format='png'):
+def get_pdf_info(pdf_path: str) -> Tuple[int, Optional[Tuple[float, float]]]:
     """
-    Convert a PDF file to a list of images.
-    
+    Read the page count and the page size (in points) of a PDF without rendering it.
+
     :param pdf_path: Path to the PDF file
-    :param output_dir: Directory to save the images (default is a temporary directory)
-    :param dpi: DPI for the output images (default is 200)
-    :param format: Format of the output images (default is 'png')
-    :return: List of paths to the saved images
-    """
-    # Create a temporary directory if output_dir is not provided
-    if output_dir is None:
-        output_dir = tempfile.mkdtemp()
-    else:
-        os.makedirs(output_dir, exist_ok=True)
+    :return: Tuple of (page count, (width, height) in points or None if unknown)
+    """
+    info = pdfinfo_from_path(pdf_path)
+    page_size = None
+    match = re.match(r'^\s*([\d.]+)\s*x\s*([\d.]+)', str(info.get("Page size", "")))
+    if match:
+        page_size = (float(match.group(1)), float(match.group(2)))
+    return int(info["Pages"]), page_size
+
+
+def plan_pdf_dpi(page_size: Optional[Tuple[float, float]], dpi: int, max_page_pixels: int, max_long_edge: Optional[int] = None) -> int:
+    """
+    Lower the rendering DPI so that a single page stays within max_page_pixels and,
+    when given, renders no larger than max_long_edge pixels on its long side.
+
+    :param page_size: (width, height) of the page in points, or None if unknown
+    :param dpi: Requested DPI
+    :param max_page_pixels: Maximum number of pixels of a rendered page
+    :param max_long_edge: Target size in pixels of the long edge of a rendered page
+    :return: The DPI to render with
+    """
+    if not page_size:
+        return dpi
+    width_in, height_in = page_size[0] / 72, page_size[1] / 72
+    if max_long_edge:
+        dpi = min(dpi, int(max_long_edge / max(width_in, height_in)))
+    pixels = width_in * dpi * height_in * dpi
+    if pixels <= max_page_pixels:
+        return max(36, dpi)
+    return max(36, int(dpi * math.sqrt(max_page_pixels / pixels)))
+
 
-    # Convert PDF to list of images
-    images = convert_from_path(pdf_path, dpi=dpi)
+def _render_pdf_page_image(pdf_path: str, page_number: int, dpi: int):
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number)
+    if not images:
+        raise ValueError(f"Page {page_number} of {pdf_path} could not be rendered")
+    return images[0]
 
-    # Save each image
-    image_paths = []
-    for i, image in enumerate(images):
-        file_name = f'page_{i+1}.{format}'
-        file_path = os.path.join(output_dir, file_name)
-        image.save(file_path, format)
-        image_paths.append(file_path)
 
-    return image_paths
+def render_pdf_page_to_bytes(pdf_path: str, page_number: int, dpi: int, profile: Optional[PreprocessProfile] = None) -> Tuple[PageImage, int]:
+    """
+    Render a single page of a PDF into an in-memory encoded image.
+
+    :param pdf_path: Path to the PDF file
+    :param page_number: 1-based page number
+    :param dpi: DPI for the output image
+    :param profile: Preprocessing profile to encode the page with (default is a lossless PNG)
+    :return: Tuple of (the encoded page, number of pixels of the page)
+    """
+    image = _render_pdf_page_image(pdf_path, page_number, dpi)
+    pixels = image.width * image.height
+    if profile is None:
+        buffer = io.BytesIO()
+        image.save(buffer, 'png')
+        data, mime_type = buffer.getvalue(), 'image/png'
+    else:
+        data, mime_type = encode_image(normalize_image(image, profile), profile)
+    image.close()
+    return PageImage(data=data, mime_type=mime_type, page_number=page_number), pixels
 
 
 #### Firebase helper functions
@@ -88,155 +277,69 @@ def download_from_storage(firebase_uri, bucket_name, output_dir="output"):
     with tempfile.NamedTemporaryFile(delete=False, dir=output_dir) as temp_file:
         temp_file_path = temp_file.name
 
-    # Download the file to the temporary location
-    blob.download_to_filename(temp_file_path)
+    # Download the file to the temporary location, leaving nothing behind if it fails
+    try:
+        blob.download_to_filename(temp_file_path)
+    except Exception:
+        os.remove(temp_file_path)
+        raise
     logger.info(f"Downloaded file to: {temp_file_path}")
 
     return temp_file_path
 
 
-def add_data_to_firestore(data_dict: Dict, collection_path: str, document_id: str = None) -> Union[str, None]:
+def download_image_from_storage(firebase_uri, bucket_name, max_in_memory_bytes: int) -> Tuple[Optional[bytes], Optional[str]]:
     """
-    Add data to Firestore in a specified collection or subcollection.
+    Download a file from Firebase Storage straight into memory, or to a temporary
+    file when it is larger than max_in_memory_bytes.
 
-    Args:
-    data_dict (Dict): The data to be added to Firestore.
-    collection_path (str): The path to the collection or subcollection, using '/' as separator.
-                           E.g., "users" or "users/user123/orders"
-    document_id (str, optional): The document ID. If None, Firestore will auto-generate an ID.
-
-    Returns:
-    Union[str, None]: The ID of the added document, or None if an error occurred.
+    :return: Tuple of (the file's bytes, None) or (None, path of the temporary file)
     """
-    db = get_firestore_client()
-    
-    try:
-        # Split the path and navigate to the specified collection or subcollection
-        path_parts = collection_path.split('/')
-        collection_ref = db
-        for i, part in enumerate(path_parts):
-            if i % 2 == 0:
-                collection_ref = collection_ref.collection(part)
-            else:
-                collection_ref = collection_ref.document(part)
-                
-        # Add server timestamp to the data
-        data_dict['created_at'] = firestore.SERVER_TIMESTAMP
-        data_dict['updated_at'] = firestore.SERVER_TIMESTAMP
-
-        # Add the data to Firestore
-        if document_id:
-            doc_ref = collection_ref.document(document_id)
-            doc_ref.set(data_dict)
-        else:
-            doc_ref = collection_ref.add(data_dict)[1]
-
-        # Add the document ID to the data
-        data_dict['id'] = doc_ref.id
-        doc_ref.update({'id': doc_ref.id})
-
-        logger.info(f"Document added with ID: {doc_ref.id} in collection: {collection_path}")
-        return doc_ref.id
-
-    except Exception as e:
-        logger.error(f"An error occurred while adding data to Firestore: {str(e)}")
-        return None
-
-
-def get_data_from_firestore(
-    path: str, 
-    filter_field: str = None, 
-    filter_value: Any = None, 
-    document_id: str = None, 
-    include_subcollections: bool = True
-) -> Union[Dict, List[Dict], None]:
-    db = get_firestore_client()
-    
-    try:
-        # Split the path and navigate to the specified location
-        path_parts = path.split('/')
-        current_ref = db
-        for i, part in enumerate(path_parts):
-            if i % 2 == 0:
-                current_ref = current_ref.collection(part)
-            else:
-                current_ref = current_ref.document(part)
-
-        # Fetch the data
-        if isinstance(current_ref, firestore.DocumentReference):
-            # Processing a document
-            doc = current_ref.get()
-            if doc.exists:
-                logger.info(f"Document fetched from {path}")
-                data = doc.to_dict()
-                data['id'] = doc.id
-                if include_subcollections:
-                    subcollections = current_ref.collections()
-                    for subcoll in subcollections:
-                        data[subcoll.id] = get_data_from_firestore(f"{path}/{subcoll.id}")
-                return data
-            else:
-                logger.info(f"Document not found at {path}")
-                return None
-        elif isinstance(current_ref, firestore.CollectionReference):
-            # Processing a collection
-            if document_id:
-                return get_data_from_firestore(f"{path}/{document_id}", include_subcollections=include_subcollections)
-            else:
-                # Apply filter if provided
-                if filter_field and filter_value:
-                    query = current_ref.where(filter_field, '==', filter_value)
-                else:
-                    query = current_ref
-
-                docs = query.stream()
-                result = []
-                for doc in docs:
-                    data = doc.to_dict()
-                    data['id'] = doc.id
-                    if include_subcollections:
-                        subcollections = doc.reference.collections()
-                        for subcoll in subcollections:
-                            data[subcoll.id] = get_data_from_firestore(f"{path}/{doc.id}/{subcoll.id}")
-                    result.append(data)
-                logger.info(f"Fetched {len(result)} documents from {path}")
-                return result
+    bucket = storage.bucket(bucket_name)
+    file_path = firebase_uri.split('/', 3)[-1]
+    # The range is inclusive, so one byte more than the limit tells a larger file apart
+    data = bucket.blob(file_path).download_as_bytes(end=max_in_memory_bytes)
+    if len(data) > max_in_memory_bytes:
+        return None, download_from_storage(firebase_uri, bucket_name)
+    logger.info(f"Downloaded {len(data)} bytes from: {file_path}")
+    return data, None
 
-    except Exception as e:
-        logger.error(f"An error occurred while fetching data from Firestore: {str(e)}")
-        return None
 
 #### Gemini helper functions
 
-def upload_to_gemini(file_path, remove_after_upload=True):
+def upload_page_to_gemini(page: PageImage):
+    """
+    Upload an in-memory page through the Gemini File API.
+
+    google-generativeai only uploads from a path, so the page is spilled to a
+    temporary file that is removed once the upload is done. Upload errors are
+    raised, so the caller can retry transient ones with the same page.
+    """
+    file_path = write_temp_file(page.data, mimetypes.guess_extension(page.mime_type) or '')
     try:
-        # Debug information
-        logger.info(f"Attempting to upload file: {file_path}")
-        logger.info(f"File exists: {os.path.exists(file_path)}")
-        logger.info(f"File size: {os.path.getsize(file_path)} bytes")
-
-        # Explicitly set MIME type to a supported image format
-        mime_type = 'image/png'  # or 'image/jpeg' if you're sure it's a JPEG
-
-        # Upload the file with the explicit MIME type
-        patient_doc = genai.upload_file(path=file_path,
-                                        display_name="patient_doc",
-                                        mime_type=mime_type)
-        logger.info(f"Uploaded file '{patient_doc.display_name}' as: {patient_doc.uri}")
-        
-        # Attempt to remove the file from the local directory
-        if remove_after_upload:
-            try:
-                os.remove(file_path)
-                logger.info(f"Successfully removed local file: {file_path}")
-            except OSError as e:
-                logger.warning(f"Failed to remove local file {file_path}: {e}")
-        
+        patient_doc = genai.upload_file(path=file_path, display_name="patient_doc", mime_type=page.mime_type)
+        logger.info(f"Uploaded page {page.page_number} as: {patient_doc.uri}")
         return patient_doc
-    except Exception as e:
-        logger.error(f"Error uploading file to Gemini: {e}")
-        logger.error(f"File path: {file_path}")
-        logger.error(f"File exists: {os.path.exists(file_path)}")
-        if os.path.exists(file_path):
-            logger.error(f"File size: {os.path.getsize(file_path)} bytes")
-        return None
\ No newline at end of file
+    finally:
+        try:
+            os.remove(file_path)
+        except OSError as e:
+            logger.warning(f"Failed to remove local file {file_path}: {e}")
+
+
+def delete_from_gemini(file_names: List[str]) -> int:
+    """
+    Delete uploaded files from the Gemini File API.
+
+    :param file_names: Names of the files to delete (e.g. "files/abc123")
+    :return: Number of files deleted
+    """
+    deleted = 0
+    for file_name in file_names:
+        try:
+            genai.delete_file(file_name)
+            deleted += 1
+        except Exception as e:
+            logger.warning(f"Failed to delete Gemini file {file_name}: {e}")
+    logger.info(f"Deleted {deleted}/{len(file_names)} Gemini files")
+    return deleted